@@ -6,14 +6,18 @@ Ce fichier évite les problèmes d'imports relatifs en servant de module princip
 
 if __name__ == "__main__":
     import uvicorn
-    from server import app
+    from backend.config import config
+    
+    # Plusieurs workers sont possibles : les stockages JSON sont verrouillés
+    # et écrits de manière atomique ([server] workers dans config.ini)
+    workers = config.getint('server', 'workers', 1)
     
     uvicorn.run(
-        app,
+        "server:app",
         host="0.0.0.0",
         port=8001,
-        workers=1
+        workers=workers
     )
 else:
     # Import pour uvicorn quand lancé avec uvicorn main:app
-    from server import app 
\ No newline at end of file
+    from server import app
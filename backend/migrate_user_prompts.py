@@ -0,0 +1,47 @@
+"""
+Script de migration des prompts utilisateur entre le fichier JSON et SQLite.
+
+Usage :
+    python migrate_user_prompts.py migrate [--force]   # user_prompts.json -> SQLite
+    python migrate_user_prompts.py export <fichier.json>
+    python migrate_user_prompts.py import <fichier.json>
+"""
+import sys
+from pathlib import Path
+
+# Ajouter la racine du projet au PYTHONPATH
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.services.prompt_service import PromptService
+from backend.services.prompt_storage import SqliteUserPromptStorage, migrate_json_to_sqlite
+
+def main(args):
+    if not args or args[0] not in ('migrate', 'export', 'import'):
+        print(__doc__)
+        return 1
+
+    service = PromptService()
+    command = args[0]
+
+    if command == 'migrate':
+        if not isinstance(service.user_storage, SqliteUserPromptStorage):
+            print("❌ Le stockage SQLite n'est pas activé ([database] user_prompts_backend = sqlite)")
+            return 1
+        count = migrate_json_to_sqlite(
+            service.user_prompts_file, service.user_storage, force='--force' in args
+        )
+        print(f"✅ {count} prompts migrés vers {service.user_storage.db_path}")
+    elif len(args) < 2:
+        print(__doc__)
+        return 1
+    elif command == 'export':
+        count = service.export_user_prompts(args[1])
+        print(f"✅ {count} prompts exportés vers {args[1]}")
+    else:
+        count = service.import_user_prompts(args[1])
+        print(f"✅ {count} prompts importés depuis {args[1]}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -30,6 +30,7 @@ class PromptBase(BaseModel):
     category: str = "General"
     welcome_page_html: str = ""
     is_system: bool = False  # Added for system prompts
+    cache_responses: bool = True  # False: never serve executions from the response cache
 
 class SystemPrompt(PromptBase):
     id: str
@@ -53,6 +54,7 @@ class UserPromptCreate(BaseModel):
     uses_cockpit_data: bool = False  # Changed from needs_cockpit
     category: str = "General"
     welcome_page_html: str = ""
+    cache_responses: bool = True
     type: PromptType
     is_public: bool = False
     based_on_system_prompt: Optional[str] = None
@@ -66,6 +68,7 @@ class UserPromptUpdate(BaseModel):
     uses_cockpit_data: Optional[bool] = None  # Changed from needs_cockpit
     category: Optional[str] = None
     welcome_page_html: Optional[str] = None
+    cache_responses: Optional[bool] = None
     type: Optional[PromptType] = None
     is_public: Optional[bool] = None
 
@@ -261,6 +264,17 @@ class PromptExecutionRequest(BaseModel):
     files: List[str] = []  # Base64 encoded files
     server_id: Optional[str] = None
     model: Optional[str] = None
+    execution_id: Optional[str] = None  # Client-chosen id, to cancel a running execution
+
+class CompareTarget(BaseModel):
+    server_id: Optional[str] = None  # "system_<name>" or a user server id
+    model: Optional[str] = None
+
+class PromptCompareRequest(BaseModel):
+    variables: List[PromptVariable] = []
+    modified_content: Optional[str] = None
+    files: List[str] = []  # Base64 encoded files
+    targets: List[CompareTarget]
 
 class PromptExecutionLog(BaseModel):
     timestamp: datetime
@@ -277,6 +291,8 @@ class PromptExecutionResult(BaseModel):
     execution_time: float
     tokens_used: Optional[int] = None
     cost: Optional[float] = None
+    cached: bool = False
+    server_name: Optional[str] = None  # Serveur qui a effectivement répondu
 
 # Category Models
 class Category(BaseModel):
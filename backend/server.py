@@ -1,8 +1,10 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import ClientDisconnect
 import os
 import logging
 from pathlib import Path
@@ -10,9 +12,11 @@ from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime
 import json
+import asyncio
 import PyPDF2
 import io
 import shutil
+import hashlib
 
 from backend.models import (
     User, UserLogin, Token, UserCreate, UserUpdate,
@@ -22,7 +26,7 @@ from backend.models import (
     UserLLMServer, UserLLMServerCreate, UserLLMServerUpdate,
     CockpitVariable, Category, CategoryCreate, CategoryUpdate,
     AdminLLMServerCreate, AdminLLMServerUpdate,
-    PromptVariable, PromptExecutionRequest, PromptExecutionLog
+    PromptVariable, PromptExecutionRequest, PromptExecutionLog, PromptCompareRequest
 )
 from backend.services import AuthService, PromptService, LLMService
 from backend.services.cockpit_service import CockpitService
@@ -30,6 +34,26 @@ from backend.services.user_llm_server_service import UserLLMServerService
 from backend.services.category_service import CategoryService
 from backend.services.admin_llm_server_service import AdminLLMServerService
 from backend.services.prompt_execution_service import PromptExecutionService
+from backend.services.prompt_template import template_for_prompt
+from backend.services.upstream_client import connection_manager
+from backend.services.llm_scheduler import QueueFullError, llm_scheduler
+from backend.services.response_cache import response_cache
+from backend.services.single_flight import single_flight
+from backend.services.llm_balancer import is_balanced, load_balancer
+from backend.services.llm_hedging import hedger
+from backend.services.llm_health import health_monitor
+from backend.services.model_catalog import model_catalog
+from backend.services.stream_coalescer import frame_coalescer
+from backend.services.execution_control import ExecutionIdInUseError, execution_registry
+from backend.services.stream_replay import stream_replay
+from backend.services.execution_store import execution_store
+from backend.services.batch_execution import (
+    CSV as BATCH_CSV, NDJSON as BATCH_NDJSON, BatchRow, batch_executor, parse_rows
+)
+from backend.services.fan_out import fan_out
+from backend.services.job_queue import (
+    CANCELLED as JOB_CANCELLED, DONE as JOB_DONE, FAILED as JOB_FAILED, Job, job_queue
+)
 from backend.config import get_app_config, get_database_config
 
 ROOT_DIR = Path(__file__).parent
@@ -47,7 +71,7 @@ cockpit_service = CockpitService()
 user_llm_server_service = UserLLMServerService()
 category_service = CategoryService()
 admin_llm_server_service = AdminLLMServerService()
-prompt_execution_service = PromptExecutionService()
+prompt_execution_service = PromptExecutionService(server_lookup=admin_llm_server_service.get_server)
 
 # Create the main app
 app = FastAPI(
@@ -99,6 +123,81 @@ async def get_admin_user(current_user: User = Depends(get_current_user)) -> User
         )
     return current_user
 
+# Conditional GET helpers
+def _make_etag(*parts) -> str:
+    """Build a weak ETag from a catalog version and the view parameters."""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+def _conditional_response(request: Request, etag: str, build) -> Response:
+    """Return 304 if the client already has this ETag, otherwise build the payload."""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in candidates or etag in candidates:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(content=jsonable_encoder(build()), headers=headers)
+
+# LLM admission helpers
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    """The LLM server queue is full: fail fast and tell the client when to retry."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+async def _queue_events(ticket):
+    """SSE events giving the queue position while waiting for an LLM slot."""
+    if ticket is None:
+        return
+    async for position in ticket.positions():
+        yield f"data: {json.dumps({'queue_position': position})}\n\n"
+
+def _release(ticket):
+    """Give back an LLM slot (or queue place) when a stream ends or is dropped."""
+    if ticket is not None:
+        ticket.abandon()
+
+def _client_gone(http_request: Request):
+    """Factory of an awaitable completing when the client closes the connection."""
+    async def wait():
+        while True:
+            message = await http_request.receive()
+            if message["type"] == "http.disconnect":
+                return
+    return wait
+
+async def _resume_stream(http_request: Request, user_id: str) -> Optional[StreamingResponse]:
+    """Resume an interrupted stream from its Last-Event-ID, without a new LLM call."""
+    frames = await stream_replay.resume(
+        http_request.headers.get("last-event-id"), user_id, _client_gone(http_request)
+    )
+    if frames is None:
+        return None
+    return StreamingResponse(frames, media_type="text/plain")
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """Streaming response sent while the handler still reads the request body.
+    
+    Starlette would listen for the client's disconnect on receive() in
+    parallel, taking the body messages away from the handler; the handler
+    detects the disconnect itself instead.
+    """
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+def _start_execution(user_id: Optional[str]) -> str:
+    """Register a new streamed execution, cancellable by DELETE /prompts/executions/{id}."""
+    execution_id = str(uuid.uuid4())
+    execution_registry.register(execution_id, user_id)
+    return execution_id
+
 # ===============================
 # Authentication Routes
 # ===============================
@@ -141,31 +240,71 @@ async def get_auth_config():
 # ===============================
 
 @api_router.get("/prompts")
-async def get_prompts(current_user: Optional[User] = Depends(get_current_user_optional)):
-    """Get all available prompts."""
+async def get_prompts(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: str = "title",
+    type: Optional[str] = None,
+    category: Optional[str] = None,
+    source: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """Get available prompts (supports If-None-Match).
+    
+    Without limit/cursor/fields, returns every visible prompt grouped by type.
+    Otherwise returns a page {items, next_cursor, total, limit}: sort by
+    title/category/type/created_at/updated_at ('-' prefix for descending),
+    filter by type, category and source (system/user/mine), and project with
+    fields=id,title,... (content and welcome_page_html are left out by
+    default, fields=* returns everything).
+    """
     user_id = current_user.id if current_user else None
-    return prompt_service.get_all_prompts(user_id)
+    
+    if limit is None and cursor is None and fields is None:
+        etag = _make_etag("prompts", prompt_service.get_catalog_version(), user_id)
+        return _conditional_response(request, etag, lambda: prompt_service.get_all_prompts(user_id))
+    
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    etag = _make_etag(
+        "prompts_page", prompt_service.get_catalog_version(), user_id,
+        limit, cursor, sort, type, category, source, fields
+    )
+    
+    def build():
+        try:
+            return prompt_service.list_prompts(
+                user_id, limit=limit or 50, cursor=cursor, sort=sort,
+                prompt_type=type, category=category, source=source, fields=field_list
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    return _conditional_response(request, etag, build)
 
 @api_router.get("/prompts/categories")
-async def get_categories():
-    """Get all prompt categories."""
-    return prompt_service.get_categories()
+async def get_categories(request: Request):
+    """Get all prompt categories (supports If-None-Match)."""
+    etag = _make_etag("prompt_categories", prompt_service.get_catalog_version())
+    return _conditional_response(request, etag, prompt_service.get_categories)
 
 @api_router.get("/prompts/search")
 async def search_prompts(
     q: str,
     category: Optional[str] = None,
     type: Optional[str] = None,
+    facets: bool = False,
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
-    """Search prompts."""
+    """Search prompts (ranked; category and type counts with facets=true)."""
     user_id = current_user.id if current_user else None
     prompt_type = None
     if type in ['internal', 'external']:
         from backend.models import PromptType
         prompt_type = PromptType(type)
     
-    return prompt_service.search_prompts(q, user_id, category, prompt_type)
+    return prompt_service.search_prompts(q, user_id, category, prompt_type, facets=facets)
 
 @api_router.get("/prompts/{prompt_id}")
 async def get_prompt(prompt_id: str, current_user: Optional[User] = Depends(get_current_user_optional)):
@@ -223,56 +362,108 @@ async def duplicate_prompt(
 @api_router.post("/llm/chat/internal")
 async def chat_internal(
     request: ChatRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user)
 ):
     """Chat with internal LLM."""
+    resumed = await _resume_stream(http_request, current_user.id)
+    if resumed is not None:
+        return resumed
+    
     # Get prompt and fill with context
     prompt_data = prompt_service.get_prompt_by_id(request.prompt_id, current_user.id)
     if not prompt_data:
         raise HTTPException(status_code=404, detail="Prompt non trouvé")
     
     # Fill prompt with variables
-    filled_prompt = prompt_data['content']
-    for var, value in request.context_variables.items():
-        filled_prompt = filled_prompt.replace(f"{{{var}}}", value)
+    filled_prompt = template_for_prompt(prompt_data).render(request.context_variables)
     
     # Create LLM request
     llm_request = LLMRequest(prompt=filled_prompt, stream=True)
     
+    # Reserve a slot on the server (503 if its queue is full)
+    ticket = llm_service.reserve(llm_service.server_manager.get_default_server())
+    
+    trace = {}
+    execution_id = _start_execution(current_user.id)
+    buffer = stream_replay.open(execution_id, current_user.id)
+    
     # Stream response
     async def generate():
-        async for chunk in llm_service.chat_internal(llm_request):
-            yield f"data: {json.dumps({'content': chunk})}\n\n"
-        yield "data: [DONE]\n\n"
+        try:
+            yield f"data: {json.dumps({'execution_id': execution_id})}\n\n"
+            async for event in _queue_events(ticket):
+                yield event
+            chunks = execution_registry.guard(
+                execution_id,
+                llm_service.chat_internal(llm_request, ticket=ticket, trace=trace),
+                buffer.abandoned
+            )
+            async for frame in frame_coalescer.sse(chunks, 'content'):
+                yield frame
+            yield f"data: {json.dumps({'server': trace.get('server')})}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            _release(ticket)
+            execution_registry.unregister(execution_id)
     
-    return StreamingResponse(generate(), media_type="text/plain")
+    return StreamingResponse(
+        stream_replay.stream(buffer, generate(), _client_gone(http_request)),
+        media_type="text/plain"
+    )
 
 @api_router.post("/llm/chat/ollama")
 async def chat_ollama(
     request: ChatRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user)
 ):
     """Chat with Ollama."""
+    resumed = await _resume_stream(http_request, current_user.id)
+    if resumed is not None:
+        return resumed
+    
     # Get prompt and fill with context
     prompt_data = prompt_service.get_prompt_by_id(request.prompt_id, current_user.id)
     if not prompt_data:
         raise HTTPException(status_code=404, detail="Prompt non trouvé")
     
     # Fill prompt with variables
-    filled_prompt = prompt_data['content']
-    for var, value in request.context_variables.items():
-        filled_prompt = filled_prompt.replace(f"{{{var}}}", value)
+    filled_prompt = template_for_prompt(prompt_data).render(request.context_variables)
     
     # Create LLM request
     llm_request = LLMRequest(prompt=filled_prompt, stream=True)
     
+    # Reserve a slot on the server (503 if its queue is full)
+    ticket = llm_service.reserve(llm_service.find_server('ollama'))
+    
+    trace = {}
+    execution_id = _start_execution(current_user.id)
+    buffer = stream_replay.open(execution_id, current_user.id)
+    
     # Stream response
     async def generate():
-        async for chunk in llm_service.chat_ollama(llm_request):
-            yield f"data: {json.dumps({'content': chunk})}\n\n"
-        yield "data: [DONE]\n\n"
+        try:
+            yield f"data: {json.dumps({'execution_id': execution_id})}\n\n"
+            async for event in _queue_events(ticket):
+                yield event
+            chunks = execution_registry.guard(
+                execution_id,
+                llm_service.chat_ollama(llm_request, ticket=ticket, trace=trace),
+                buffer.abandoned
+            )
+            async for frame in frame_coalescer.sse(chunks, 'content'):
+                yield frame
+            yield f"data: {json.dumps({'server': trace.get('server')})}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            _release(ticket)
+            execution_registry.unregister(execution_id)
     
-    return StreamingResponse(generate(), media_type="text/plain")
+    return StreamingResponse(
+        stream_replay.stream(buffer, generate(), _client_gone(http_request)),
+        media_type="text/plain"
+    )
 
 @api_router.post("/llm/generate-external")
 async def generate_external_prompt(
@@ -288,9 +479,7 @@ async def generate_external_prompt(
         raise HTTPException(status_code=404, detail="Prompt non trouvé")
     
     # Fill prompt with variables
-    filled_prompt = prompt_data['content']
-    for var, value in request.context_variables.items():
-        filled_prompt = filled_prompt.replace(f"{{{var}}}", value)
+    filled_prompt = template_for_prompt(prompt_data).render(request.context_variables)
     
     # Check privacy if enabled
     privacy_result = await llm_service.check_privacy(filled_prompt)
@@ -309,31 +498,57 @@ async def generate_external_prompt(
 @api_router.post("/llm/chat/server")
 async def chat_with_specific_server(
     request: ChatRequest,
+    http_request: Request,
     server_name: str,
     model: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """Chat with a specific LLM server."""
+    resumed = await _resume_stream(http_request, current_user.id)
+    if resumed is not None:
+        return resumed
+    
     # Get prompt and fill with context
     prompt_data = prompt_service.get_prompt_by_id(request.prompt_id, current_user.id)
     if not prompt_data:
         raise HTTPException(status_code=404, detail="Prompt non trouvé")
     
     # Fill prompt with variables
-    filled_prompt = prompt_data['content']
-    for var, value in request.context_variables.items():
-        filled_prompt = filled_prompt.replace(f"{{{var}}}", value)
+    filled_prompt = template_for_prompt(prompt_data).render(request.context_variables)
     
     # Create LLM request
     llm_request = LLMRequest(prompt=filled_prompt, stream=True, model=model)
     
+    # Reserve a slot on the server (503 if its queue is full)
+    ticket = llm_service.reserve(server_name, model)
+    
+    trace = {}
+    execution_id = _start_execution(current_user.id)
+    buffer = stream_replay.open(execution_id, current_user.id)
+    
     # Stream response
     async def generate():
-        async for chunk in llm_service.chat_with_server(server_name, llm_request, model):
-            yield f"data: {json.dumps({'content': chunk})}\n\n"
-        yield "data: [DONE]\n\n"
+        try:
+            yield f"data: {json.dumps({'execution_id': execution_id})}\n\n"
+            async for event in _queue_events(ticket):
+                yield event
+            chunks = execution_registry.guard(
+                execution_id,
+                llm_service.chat_with_server(server_name, llm_request, model, ticket=ticket, trace=trace),
+                buffer.abandoned
+            )
+            async for frame in frame_coalescer.sse(chunks, 'content'):
+                yield frame
+            yield f"data: {json.dumps({'server': trace.get('server')})}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            _release(ticket)
+            execution_registry.unregister(execution_id)
     
-    return StreamingResponse(generate(), media_type="text/plain")
+    return StreamingResponse(
+        stream_replay.stream(buffer, generate(), _client_gone(http_request)),
+        media_type="text/plain"
+    )
 
 @api_router.get("/llm/servers")
 async def get_llm_servers():
@@ -345,7 +560,9 @@ async def get_llm_servers():
             "type": server.type,
             "url": server.url,
             "default_model": server.default_model,
-            "has_api_key": server.api_key is not None
+            "has_api_key": server.api_key is not None,
+            "is_available": server.is_available,
+            "health": health_monitor.describe(name)
         }
         for name, server in servers.items()
     }
@@ -371,19 +588,9 @@ async def get_server_models(server_name: str):
 @api_router.get("/llm/models")
 async def get_available_models():
     """Get available LLM models.""" 
-    models = llm_service.get_available_models()
-    
-    # Get dynamic models for servers that support it
-    servers = llm_service.get_servers()
-    for server_name, server in servers.items():
-        try:
-            dynamic_models = await llm_service.get_server_models(server_name)
-            if dynamic_models:
-                models[server_name] = dynamic_models
-        except:
-            pass  # Keep default model if dynamic fetch fails
-    
-    return models
+    # Catalogue en cache : les serveurs injoignables gardent leur dernière liste
+    # connue (ou leur modèle par défaut) sans ralentir la réponse
+    return await llm_service.get_all_server_models()
 
 # ===============================
 # User Preferences Routes
@@ -743,26 +950,26 @@ async def test_user_llm_server(
             # Test Ollama server
             url = f"{server.url.rstrip('/')}/api/tags"
             
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(url) as response:
-                    response_time = time.time() - start_time
-                    
-                    if response.status == 200:
-                        data = await response.json()
-                        models = [model['name'] for model in data.get('models', [])]
-                        return {
-                            "status": "success",
-                            "message": "Connexion réussie",
-                            "response_time": response_time,
-                            "available_models": models
-                        }
-                    else:
-                        return {
-                            "status": "error",
-                            "message": f"Erreur HTTP {response.status}",
-                            "response_time": response_time,
-                            "available_models": []
-                        }
+            session = connection_manager.session(url)
+            async with session.get(url, timeout=timeout) as response:
+                response_time = time.time() - start_time
+                
+                if response.status == 200:
+                    data = await response.json()
+                    models = [model['name'] for model in data.get('models', [])]
+                    return {
+                        "status": "success",
+                        "message": "Connexion réussie",
+                        "response_time": response_time,
+                        "available_models": models
+                    }
+                else:
+                    return {
+                        "status": "error",
+                        "message": f"Erreur HTTP {response.status}",
+                        "response_time": response_time,
+                        "available_models": []
+                    }
         
         else:  # OpenAI compatible
             # Test OpenAI compatible server
@@ -772,27 +979,27 @@ async def test_user_llm_server(
             if server.api_key:
                 headers["Authorization"] = f"Bearer {server.api_key}"
             
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(url, headers=headers) as response:
-                    response_time = time.time() - start_time
+            session = connection_manager.session(url)
+            async with session.get(url, headers=headers, timeout=timeout) as response:
+                response_time = time.time() - start_time
+                
+                if response.status == 200:
+                    data = await response.json()
+                    models = [model['id'] for model in data.get('data', [])]
+                    return {
+                        "status": "success",
+                        "message": "Connexion réussie",
+                        "response_time": response_time,
+                        "available_models": models
+                    }
+                else:
+                    return {
+                        "status": "error",
+                        "message": f"Erreur HTTP {response.status}",
+                        "response_time": response_time,
+                        "available_models": []
+                    }
                     
-                    if response.status == 200:
-                        data = await response.json()
-                        models = [model['id'] for model in data.get('data', [])]
-                        return {
-                            "status": "success",
-                            "message": "Connexion réussie",
-                            "response_time": response_time,
-                            "available_models": models
-                        }
-                    else:
-                        return {
-                            "status": "error",
-                            "message": f"Erreur HTTP {response.status}",
-                            "response_time": response_time,
-                            "available_models": []
-                        }
-                        
     except aiohttp.ClientError:
         return {
             "status": "timeout",
@@ -813,15 +1020,25 @@ async def test_user_llm_server(
 # ===============================
 
 @api_router.get("/categories", response_model=List[Category])
-async def get_categories(current_user: Optional[User] = Depends(get_current_user_optional)):
-    """Get all categories available to the user."""
+async def get_categories(
+    request: Request,
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """Get all categories available to the user (supports If-None-Match)."""
     user_id = current_user.id if current_user else None
-    return category_service.get_categories_by_user(user_id)
+    etag = _make_etag("categories", category_service.get_catalog_version(), user_id)
+    return _conditional_response(
+        request, etag, lambda: category_service.get_categories_by_user(user_id)
+    )
 
 @api_router.get("/categories/dict")
-async def get_categories_dict(current_user: Optional[User] = Depends(get_current_user_optional)):
-    """Get categories as a dictionary."""
-    return category_service.get_categories_dict()
+async def get_categories_dict(
+    request: Request,
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """Get categories as a dictionary (supports If-None-Match)."""
+    etag = _make_etag("categories_dict", category_service.get_catalog_version())
+    return _conditional_response(request, etag, category_service.get_categories_dict)
 
 @api_router.post("/categories", response_model=Category)
 async def create_category(
@@ -878,7 +1095,15 @@ async def suggest_category(data: Dict[str, str]):
 @api_router.get("/admin/llm-servers")
 async def get_admin_llm_servers(admin_user: User = Depends(get_admin_user)):
     """Get all system LLM servers (admin only)."""
-    return admin_llm_server_service.get_all_servers()
+    servers = llm_service.get_servers()
+    return [
+        {
+            **server,
+            "is_available": servers[server['id']].is_available if server['id'] in servers else False,
+            "health": health_monitor.describe(server['id'])
+        }
+        for server in admin_llm_server_service.get_all_servers()
+    ]
 
 @api_router.post("/admin/llm-servers")
 async def create_admin_llm_server(
@@ -931,6 +1156,17 @@ async def test_admin_llm_server(
     result = admin_llm_server_service.test_server_connection(server_id)
     return result
 
+@api_router.get("/admin/response-cache")
+async def get_response_cache_stats(admin_user: User = Depends(get_admin_user)):
+    """Response cache hit/miss counters and sizes."""
+    return response_cache.stats()
+
+@api_router.delete("/admin/response-cache")
+async def clear_response_cache(admin_user: User = Depends(get_admin_user)):
+    """Empty the response cache."""
+    response_cache.clear()
+    return {"message": "Cache des réponses vidé"}
+
 # ===============================
 # Enhanced Prompt Routes
 # ===============================
@@ -947,7 +1183,7 @@ async def import_new_prompts(admin_user: User = Depends(get_admin_user)):
         result = import_new_prompts()
         
         # Reload prompt service to pick up new prompts
-        prompt_service._load_system_prompts()
+        prompt_service.reload()
         
         return {
             "message": "Nouveaux prompts importés avec succès",
@@ -974,7 +1210,9 @@ async def validate_prompt_execution(
         raise HTTPException(status_code=404, detail="Prompt non trouvé")
     
     # Validate variables
-    validation = prompt_execution_service.validate_variables(prompt['content'], variables)
+    validation = prompt_execution_service.validate_variables(
+        prompt['content'], variables, template_for_prompt(prompt)
+    )
     
     return validation
 
@@ -997,7 +1235,8 @@ async def build_final_prompt(
     final_prompt, logs = prompt_execution_service.build_final_prompt(
         content,
         request.variables,
-        request.files
+        request.files,
+        template_for_prompt(prompt, request.modified_content)
     )
     
     return {
@@ -1007,40 +1246,18 @@ async def build_final_prompt(
         "logs": logs
     }
 
-@api_router.post("/prompts/{prompt_id}/execute")
-async def execute_prompt(
-    prompt_id: str,
-    request: PromptExecutionRequest,
-    current_user: User = Depends(get_current_user)
-):
-    """Execute a prompt with full logging."""
-    # Get prompt
-    prompt = prompt_service.get_prompt_by_id(prompt_id, current_user.id)
-    if not prompt:
-        raise HTTPException(status_code=404, detail="Prompt non trouvé")
-    
-    # Use modified content if provided, otherwise use original
-    content = request.modified_content or prompt['content']
-    
-    # Validate variables first
-    validation = prompt_execution_service.validate_variables(content, request.variables)
-    if not validation["is_valid"]:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Variables manquantes: {', '.join(validation['missing_variables'])}"
-        )
-    
-    # Get server configuration
+def _server_config_for(server_id: Optional[str], user_id: str) -> Dict[str, Any]:
+    """Config of a system ("system_<name>") or user server; the default system server otherwise."""
     server_config = None
     
-    if request.server_id:
-        if request.server_id.startswith("system_"):
+    if server_id:
+        if server_id.startswith("system_"):
             # System server
-            server_name = request.server_id[7:]  # Remove "system_" prefix
+            server_name = server_id[7:]  # Remove "system_" prefix
             server_config = admin_llm_server_service.get_server(server_name)
         else:
             # User server
-            user_server = user_llm_server_service.get_server(request.server_id, current_user.id)
+            user_server = user_llm_server_service.get_server(server_id, user_id)
             if user_server:
                 server_config = {
                     "type": user_server.type,
@@ -1056,14 +1273,261 @@ async def execute_prompt(
             raise HTTPException(status_code=500, detail="Aucun serveur LLM disponible")
         server_config = servers[0]
     
-    # Execute prompt
+    return server_config
+
+def _prepare_execution(prompt_id: str, request: PromptExecutionRequest, user_id: str):
+    """Prompt, template and server config of an execution request (HTTPException if invalid)."""
+    # Get prompt
+    prompt = prompt_service.get_prompt_by_id(prompt_id, user_id)
+    if not prompt:
+        raise HTTPException(status_code=404, detail="Prompt non trouvé")
+    
+    # Use modified content if provided, otherwise use original
+    content = request.modified_content or prompt['content']
+    template = template_for_prompt(prompt, request.modified_content)
+    
+    # Validate variables first
+    validation = prompt_execution_service.validate_variables(content, request.variables, template)
+    if not validation["is_valid"]:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Variables manquantes: {', '.join(validation['missing_variables'])}"
+        )
+    
+    return prompt, template, _server_config_for(request.server_id, user_id)
+
+@api_router.post("/prompts/{prompt_id}/execute")
+async def execute_prompt(
+    prompt_id: str,
+    request: PromptExecutionRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Execute a prompt with full logging."""
+    prompt, template, server_config = _prepare_execution(prompt_id, request, current_user.id)
+    
+    # Execute prompt (cancellable with the client-chosen execution id)
+    try:
+        result = await prompt_execution_service.execute_prompt(
+            request,
+            prompt['content'],
+            server_config,
+            template,
+            use_cache=prompt.get('cache_responses', True),
+            user_id=current_user.id,
+            disconnected=_client_gone(http_request)
+        )
+    except ExecutionIdInUseError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return result
+
+@api_router.post("/prompts/{prompt_id}/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_prompt_job(
+    prompt_id: str,
+    request: PromptExecutionRequest,
+    priority: int = 0,
+    current_user: User = Depends(get_current_user)
+):
+    """Queue a prompt execution and return its id without waiting for the answer."""
+    # Requête invalide refusée tout de suite plutôt qu'à l'exécution
+    _prepare_execution(prompt_id, request, current_user.id)
+    
+    execution_id = request.execution_id or str(uuid.uuid4())
+    if not await execution_store.available(execution_id, current_user.id):
+        raise HTTPException(status_code=409, detail=f"Identifiant d'exécution {execution_id} déjà utilisé")
+    try:
+        await job_queue.submit(
+            execution_id,
+            current_user.id,
+            prompt_id,
+            request.dict(),
+            priority=max(-10, min(10, priority))
+        )
+    except ExecutionIdInUseError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return await job_queue.get(execution_id, current_user.id)
+
+async def _run_job(job: Job) -> str:
+    """Run a queued execution; its result is stored like those of /execute."""
+    request = PromptExecutionRequest(**job.payload)
+    request.execution_id = job.job_id
+    prompt, template, server_config = _prepare_execution(job.prompt_id, request, job.user_id)
     result = await prompt_execution_service.execute_prompt(
         request,
         prompt['content'],
-        server_config
+        server_config,
+        template,
+        use_cache=prompt.get('cache_responses', True),
+        user_id=job.user_id,
+        on_chunk=job.on_chunk
     )
+    if any(log.action == "cancelled" for log in result.logs):
+        return JOB_CANCELLED
+    return JOB_DONE if all(log.success for log in result.logs) else JOB_FAILED
+
+@api_router.post("/prompts/{prompt_id}/batch")
+async def execute_prompt_batch(
+    prompt_id: str,
+    http_request: Request,
+    servers: str = "",
+    model: str = "",
+    concurrency: Optional[int] = None,
+    format: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Run a prompt over many variable sets (CSV or NDJSON body), streaming NDJSON results.
     
-    return result
+    servers is a comma-separated list of server ids the rows are spread over.
+    """
+    prompt = prompt_service.get_prompt_by_id(prompt_id, current_user.id)
+    if not prompt:
+        raise HTTPException(status_code=404, detail="Prompt non trouvé")
+    
+    template = template_for_prompt(prompt)
+    targets = [_server_config_for(server_id.strip(), current_user.id)
+               for server_id in servers.split(",") if server_id.strip()]
+    if not targets:
+        targets = [_server_config_for(None, current_user.id)]
+    
+    if format is None:
+        content_type = http_request.headers.get("content-type", "")
+        format = BATCH_CSV if "csv" in content_type else BATCH_NDJSON
+    if format not in (BATCH_CSV, BATCH_NDJSON):
+        raise HTTPException(status_code=400, detail="Format de lot inconnu (csv ou ndjson)")
+    
+    use_cache = prompt.get('cache_responses', True)
+    
+    async def execute_row(row: BatchRow) -> Dict[str, Any]:
+        missing = template.missing(row.variables)
+        if missing:
+            return {'status': 'error', 'error': f"Variables manquantes: {', '.join(missing)}"}
+        # Lignes réparties entre les serveurs demandés
+        server_config = targets[row.index % len(targets)]
+        return await prompt_execution_service.execute_batch_row(
+            template.render(row.variables),
+            server_config,
+            model or server_config.get('default_model', 'llama3'),
+            use_cache=use_cache
+        )
+    
+    gone = asyncio.Event()
+    
+    async def body():
+        try:
+            async for chunk in http_request.stream():
+                yield chunk
+        except ClientDisconnect:
+            gone.set()
+            raise
+        # Corps lu : surveiller la déconnexion du client jusqu'à la fin du lot
+        watcher = asyncio.ensure_future(_client_gone(http_request)())
+        watcher.add_done_callback(lambda _: gone.set())
+    
+    rows = parse_rows(body(), format, batch_executor.max_row_bytes)
+    
+    async def generate():
+        async for result in batch_executor.run(
+            rows, execute_row, batch_executor.concurrency(concurrency), gone.wait
+        ):
+            yield json.dumps(result) + "\n"
+    
+    return _DuplexStreamingResponse(generate(), media_type="application/x-ndjson")
+
+@api_router.post("/prompts/{prompt_id}/compare")
+async def compare_prompt_execution(
+    prompt_id: str,
+    request: PromptCompareRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Run one final prompt on several server/model pairs at once, streaming all answers.
+    
+    Events are tagged with their target; the last one gives each target's
+    time to first token, tokens per second and latency.
+    """
+    if not request.targets:
+        raise HTTPException(status_code=400, detail="Aucune cible à comparer")
+    if len(request.targets) > fan_out.max_targets:
+        raise HTTPException(status_code=400, detail=f"{fan_out.max_targets} cibles au maximum")
+    
+    execution_request = PromptExecutionRequest(
+        prompt_id=prompt_id,
+        variables=request.variables,
+        modified_content=request.modified_content,
+        files=request.files
+    )
+    prompt, template, _ = _prepare_execution(prompt_id, execution_request, current_user.id)
+    
+    # Build the final prompt once for all targets
+    final_prompt, _ = prompt_execution_service.build_final_prompt(
+        request.modified_content or prompt['content'],
+        request.variables,
+        request.files,
+        template
+    )
+    
+    labels, streams, metas = [], [], []
+    for target in request.targets:
+        server_config = _server_config_for(target.server_id, current_user.id)
+        model = target.model or server_config.get('default_model', 'llama3')
+        meta = {}
+        labels.append({
+            'server_id': target.server_id,
+            'server': server_config.get('name') or server_config['url'],
+            'model': model
+        })
+        streams.append(prompt_execution_service.stream_target(final_prompt, server_config, model, meta))
+        metas.append(meta)
+    
+    execution_id = _start_execution(current_user.id)
+    
+    async def generate():
+        try:
+            yield f"data: {json.dumps({'execution_id': execution_id})}\n\n"
+            events = execution_registry.guard(
+                execution_id,
+                fan_out.run(labels, streams, metas),
+                _client_gone(http_request)
+            )
+            async for event in events:
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            execution_registry.unregister(execution_id)
+    
+    return StreamingResponse(generate(), media_type="text/plain")
+
+@api_router.get("/prompts/jobs/{execution_id}")
+async def get_prompt_job(
+    execution_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Status, queue position and partial output of a queued execution."""
+    job = await job_queue.get(execution_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trouvé")
+    
+    return job
+
+@api_router.get("/prompts/jobs/{execution_id}/events")
+async def follow_prompt_job(
+    execution_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream the status changes and the partial output of a queued execution."""
+    if not await job_queue.get(execution_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Job non trouvé")
+    
+    async def generate():
+        async for event in job_queue.follow(execution_id, current_user.id):
+            if event.get('done'):
+                result = await prompt_execution_service.get_execution_result(execution_id, current_user.id)
+                if result is not None:
+                    event['result'] = result.result
+            yield f"data: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(generate(), media_type="text/plain")
 
 @api_router.get("/prompts/executions/{execution_id}")
 async def get_execution_result(
@@ -1071,15 +1535,37 @@ async def get_execution_result(
     current_user: User = Depends(get_current_user)
 ):
     """Get execution result by ID."""
-    result = prompt_execution_service.get_execution_result(execution_id)
+    result = await prompt_execution_service.get_execution_result(execution_id, current_user.id)
     if not result:
         raise HTTPException(status_code=404, detail="Résultat d'exécution non trouvé")
     
     return result
 
+@api_router.delete("/prompts/executions/{execution_id}")
+async def cancel_execution(
+    execution_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Cancel a running or queued execution; its upstream generation is stopped."""
+    if not (await job_queue.cancel(execution_id, current_user.id)
+            or execution_registry.cancel(execution_id, current_user.id)):
+        raise HTTPException(status_code=404, detail="Exécution en cours non trouvée")
+    
+    return {"message": "Exécution annulée", "execution_id": execution_id}
+
+@api_router.get("/prompts/{prompt_id}/executions")
+async def list_prompt_executions(
+    prompt_id: str,
+    limit: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """Latest execution results of the current user for a prompt."""
+    return await prompt_execution_service.list_executions(current_user.id, prompt_id, min(limit, 200))
+
 @api_router.get("/prompts/{prompt_id}/stream")
 async def stream_prompt_execution(
     prompt_id: str,
+    http_request: Request,
     variables: str = "",  # JSON encoded variables
     modified_content: str = "",
     files: str = "",  # JSON encoded files
@@ -1088,8 +1574,9 @@ async def stream_prompt_execution(
     current_user: User = Depends(get_current_user)
 ):
     """Stream prompt execution results."""
-    from fastapi.responses import StreamingResponse
-    import json
+    resumed = await _resume_stream(http_request, current_user.id)
+    if resumed is not None:
+        return resumed
     
     # Get prompt
     prompt = prompt_service.get_prompt_by_id(prompt_id, current_user.id)
@@ -1109,50 +1596,73 @@ async def stream_prompt_execution(
     content = modified_content or prompt['content']
     
     # Get server configuration
-    server_config = None
-    if server_id:
-        if server_id.startswith("system_"):
-            server_name = server_id[7:]
-            server_config = admin_llm_server_service.get_server(server_name)
-        else:
-            user_server = user_llm_server_service.get_server(server_id, current_user.id)
-            if user_server:
-                server_config = {
-                    "type": user_server.type,
-                    "url": user_server.url,
-                    "api_key": user_server.api_key,
-                    "default_model": user_server.default_model
-                }
-    
-    if not server_config:
-        servers = admin_llm_server_service.get_all_servers()
-        if servers:
-            server_config = servers[0]
-    
-    if not server_config:
-        raise HTTPException(status_code=500, detail="Aucun serveur LLM disponible")
+    server_config = _server_config_for(server_id, current_user.id)
     
     # Build final prompt
     final_prompt, _ = prompt_execution_service.build_final_prompt(
         content,
         variables_obj,
-        files_list
+        files_list,
+        template_for_prompt(prompt, modified_content)
     )
     
     # Determine model
     final_model = model or server_config.get('default_model', 'llama3')
     
+    # Replay a cached answer without touching the LLM server
+    cached = None
+    if prompt.get('cache_responses', True):
+        cached = await prompt_execution_service.get_cached_response(final_prompt, server_config, final_model)
+    if cached is not None:
+        async def replay():
+            async for chunk in prompt_execution_service.replay_cached_response(cached):
+                yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+            yield f"data: {json.dumps({'done': True, 'cached': True})}\n\n"
+        
+        return StreamingResponse(replay(), media_type="text/plain")
+    
+    # Reserve a slot on the server (503 if its queue is full), unless an
+    # identical stream is already running and can be joined
+    ticket = None
+    if not prompt_execution_service.is_streaming(final_prompt, server_config, final_model):
+        ticket = prompt_execution_service.reserve(server_config, final_model)
+    
+    trace = {}
+    execution_id = _start_execution(current_user.id)
+    buffer = stream_replay.open(execution_id, current_user.id)
+    
     # Stream execution
     async def generate():
-        async for chunk in prompt_execution_service.execute_prompt_streaming(
-            final_prompt,
-            server_config,
-            final_model
-        ):
-            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-        yield f"data: {json.dumps({'done': True})}\n\n"
+        try:
+            yield f"data: {json.dumps({'execution_id': execution_id})}\n\n"
+            async for event in _queue_events(ticket):
+                yield event
+            chunks = execution_registry.guard(
+                execution_id,
+                prompt_execution_service.execute_prompt_streaming(
+                    final_prompt,
+                    server_config,
+                    final_model,
+                    ticket=ticket,
+                    trace=trace
+                ),
+                buffer.abandoned,
+                info=trace
+            )
+            async for frame in frame_coalescer.sse(chunks, 'chunk'):
+                yield frame
+            done = {'done': True, 'server': trace.get('server')}
+            if trace.get('stopped') == 'cancelled':
+                done['cancelled'] = True
+            yield f"data: {json.dumps(done)}\n\n"
+        finally:
+            _release(ticket)
+            execution_registry.unregister(execution_id)
     
-    return StreamingResponse(generate(), media_type="text/plain")
+    return StreamingResponse(
+        stream_replay.stream(buffer, generate(), _client_gone(http_request)),
+        media_type="text/plain"
+    )
 
 # ===============================
 # Health Check Routes
@@ -1180,10 +1690,28 @@ async def health_check():
         }
     }
     
-    # Check LLM services
-    models = llm_service.get_available_models()
-    for service, model_list in models.items():
-        health_status["services"]["llm"][service] = "available" if model_list else "unavailable"
+    # Check LLM services (état mis à jour par les sondes de fond)
+    for name, server in llm_service.get_servers().items():
+        if health_monitor.enabled:
+            available = server.is_available and health_monitor.is_routable(name)
+        else:
+            available = bool(server.default_model)
+        health_status["services"]["llm"][name] = "available" if available else "unavailable"
+    health_status["services"]["llm_health"] = health_monitor.stats()
+    health_status["services"]["llm_models"] = model_catalog.stats()
+    health_status["services"]["streaming"] = frame_coalescer.stats()
+    health_status["services"]["executions"] = execution_registry.stats()
+    health_status["services"]["stream_replay"] = stream_replay.stats()
+    health_status["services"]["jobs"] = job_queue.stats()
+    health_status["services"]["batch"] = batch_executor.stats()
+    health_status["services"]["compare"] = fan_out.stats()
+    health_status["services"]["execution_store"] = execution_store.stats()
+    
+    # Générations en cours et en attente par serveur/modèle
+    health_status["services"]["llm_queues"] = llm_scheduler.stats()
+    health_status["services"]["llm_coalescing"] = single_flight.stats()
+    health_status["services"]["llm_balancer"] = load_balancer.stats()
+    health_status["services"]["llm_hedging"] = hedger.stats()
     
     return health_status
 
@@ -1206,6 +1734,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def open_upstream_sessions():
+    # Ouvrir les pools de connexions vers les serveurs LLM connus
+    # (les pools « balanced » n'ont pas d'URL propre)
+    urls = [server.url for server in llm_service.get_servers().values() if not is_balanced(server.type)]
+    urls += [server['url'] for server in admin_llm_server_service.get_all_servers()
+             if not is_balanced(server['type'])]
+    await connection_manager.start(urls)
+    # Sondes de santé en tâche de fond
+    health_monitor.start(llm_service.server_manager)
+    # Workers de la file des jobs d'exécution
+    job_queue.start(_run_job)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    pass
+    await health_monitor.stop()
+    await job_queue.stop()
+    await connection_manager.close()
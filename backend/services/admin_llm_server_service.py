@@ -130,12 +130,34 @@ class AdminLLMServerService:
         self._save_config()
         return True
     
+    def _test_pool_connection(self, server: Dict[str, Any]) -> Dict[str, Any]:
+        """Test every member of a balanced pool; the pool is up if one member is."""
+        members = [self.get_server(name.strip()) for name in server['url'].split(',')]
+        # Les pools ne s'imbriquent pas
+        results = {member['id']: self.test_server_connection(member['id']) for member in members
+                   if member and member['type'].lower() != "balanced"}
+        available = [name for name, result in results.items() if result['status'] == "success"]
+        models = []
+        for name in available:
+            for model in results[name]['available_models']:
+                if model not in models:
+                    models.append(model)
+        return {
+            "status": "success" if available else "error",
+            "message": f"{len(available)}/{len(results)} membre(s) disponible(s)",
+            "response_time": max((result.get('response_time', 0) for result in results.values()), default=0),
+            "available_models": models
+        }
+    
     def test_server_connection(self, server_id: str) -> Dict[str, Any]:
         """Test connection to a system LLM server."""
         server = self.get_server(server_id)
         if not server:
             return {"status": "error", "message": "Serveur non trouvé"}
         
+        if server['type'].lower() == "balanced":
+            return self._test_pool_connection(server)
+        
         import requests
         import time
         
@@ -0,0 +1,223 @@
+"""
+Exécution d'un même prompt sur de nombreux jeux de variables (lignes CSV ou
+NDJSON). Le corps de la requête est lu au fil de l'eau et les résultats
+sont renvoyés dès qu'ils sont prêts : au plus `concurrency` lignes sont en
+cours ou en attente d'envoi, la mémoire reste constante quelle que soit la
+taille du lot.
+"""
+import asyncio
+import csv
+import json
+import logging
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from backend.config import config
+from backend.models import PromptVariable
+
+logger = logging.getLogger(__name__)
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+
+class BatchFormatError(ValueError):
+    """The batch body cannot be read any further."""
+
+class BatchRow(NamedTuple):
+    """One variable set of a batch; error is set when the row could not be parsed."""
+    index: int
+    id: Optional[str]
+    variables: Dict[str, str]
+    error: Optional[str] = None
+
+async def read_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncGenerator[str, None]:
+    """Decoded lines of a byte stream, without their line ending."""
+    pending = b''
+    async for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        if len(pending) > max_line_bytes:
+            raise BatchFormatError(f"Ligne de plus de {max_line_bytes} octets")
+        for line in lines:
+            yield line.rstrip(b'\r').decode('utf-8-sig')
+    if pending.strip():
+        yield pending.rstrip(b'\r').decode('utf-8-sig')
+
+def _variables(value: Any) -> Dict[str, str]:
+    """Variables of an NDJSON row: a list of PromptVariable or a name -> value object."""
+    if isinstance(value, list):
+        return {variable.name: variable.value for variable in (PromptVariable(**item) for item in value)}
+    if isinstance(value, dict):
+        return {str(name): '' if item is None else str(item) for name, item in value.items()}
+    raise ValueError("variables attendues sous forme de liste ou d'objet")
+
+async def ndjson_rows(lines: AsyncIterator[str]) -> AsyncGenerator[BatchRow, None]:
+    """Rows of an NDJSON body: one variable set per line, optionally {"id", "variables"}."""
+    index = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if isinstance(data, dict) and 'variables' in data:
+                row_id = data.get('id')
+                row = BatchRow(index, None if row_id is None else str(row_id), _variables(data['variables']))
+            else:
+                row = BatchRow(index, None, _variables(data))
+        except (ValueError, TypeError) as e:
+            row = BatchRow(index, None, {}, f"Ligne NDJSON invalide: {e}")
+        yield row
+        index += 1
+
+async def csv_rows(lines: AsyncIterator[str], id_column: str = '_id') -> AsyncGenerator[BatchRow, None]:
+    """Rows of a CSV body whose header gives the variable names (, ; or tab separated)."""
+    header: Optional[List[str]] = None
+    dialect = None
+    record = ''
+    index = 0
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        # Champ entre guillemets sur plusieurs lignes : attendre la suite
+        if record.count('"') % 2:
+            continue
+        text, record = record, ''
+        if not text.strip():
+            continue
+        if header is None:
+            try:
+                dialect = csv.Sniffer().sniff(text, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            header = [name.strip() for name in next(csv.reader([text], dialect))]
+            continue
+        values = next(csv.reader([text], dialect))
+        if len(values) != len(header):
+            yield BatchRow(index, None, {}, f"{len(values)} colonnes au lieu de {len(header)}")
+        else:
+            variables = dict(zip(header, values))
+            yield BatchRow(index, variables.pop(id_column, None), variables)
+        index += 1
+    if record:
+        raise BatchFormatError("Guillemet non fermé en fin de fichier CSV")
+
+def parse_rows(chunks: AsyncIterator[bytes], fmt: str, max_line_bytes: int) -> AsyncIterator[BatchRow]:
+    lines = read_lines(chunks, max_line_bytes)
+    return csv_rows(lines) if fmt == CSV else ndjson_rows(lines)
+
+# execute(row) renvoie le résultat d'une ligne (champs ajoutés à la ligne NDJSON)
+RowExecutor = Callable[[BatchRow], Awaitable[Dict[str, Any]]]
+
+_END = object()
+
+class BatchExecutor:
+    """Run batch rows with a concurrency cap, yielding their results as they finish."""
+
+    def __init__(self, max_concurrency: int = 8, default_concurrency: int = 4,
+                 max_rows: int = 10000, max_row_bytes: int = 1024 * 1024):
+        self.max_concurrency = max_concurrency
+        self.default_concurrency = default_concurrency
+        self.max_rows = max_rows
+        self.max_row_bytes = max_row_bytes
+        self.counters = {'batches': 0, 'rows': 0, 'failed_rows': 0}
+
+    @classmethod
+    def from_config(cls) -> 'BatchExecutor':
+        return cls(
+            max_concurrency=config.getint('batch', 'max_concurrency', 8),
+            default_concurrency=config.getint('batch', 'default_concurrency', 4),
+            max_rows=config.getint('batch', 'max_rows', 10000),
+            max_row_bytes=config.getint('batch', 'max_row_kb', 1024) * 1024,
+        )
+
+    def concurrency(self, requested: Optional[int]) -> int:
+        return max(1, min(requested or self.default_concurrency, self.max_concurrency))
+
+    async def run(self, rows: AsyncIterator[BatchRow], execute: RowExecutor, concurrency: int,
+                  disconnected: Optional[Callable[[], Awaitable[Any]]] = None
+                  ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Results of the rows in completion order, then a summary with 'done'.
+        The batch is abandoned when disconnected() completes.
+
+        A row is read only when a slot is free, and a slot is freed only once
+        its result is in the (bounded) send queue: reading, running and
+        sending stay in step.
+        """
+        results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+        slots = asyncio.Semaphore(concurrency)
+        tasks = set()
+        summary = {'done': True, 'rows': 0, 'succeeded': 0, 'failed': 0, 'error': None}
+        start = time.monotonic()
+
+        async def one(row: BatchRow):
+            try:
+                if row.error is not None:
+                    result = {'status': 'error', 'error': row.error}
+                else:
+                    try:
+                        result = await execute(row)
+                    except Exception as e:
+                        result = {'status': 'error', 'error': str(e)}
+                await results.put({'row': row.index, 'id': row.id, **result})
+            finally:
+                slots.release()
+
+        async def feed():
+            try:
+                async for row in rows:
+                    if row.index >= self.max_rows:
+                        raise BatchFormatError(f"Lot limité à {self.max_rows} lignes")
+                    await slots.acquire()
+                    task = asyncio.ensure_future(one(row))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            except BatchFormatError as e:
+                summary['error'] = str(e)
+            except Exception as e:
+                logger.warning(f"Batch input interrupted: {e}")
+                summary['error'] = f"Lecture du lot interrompue: {e}"
+            # Lignes déjà lancées, y compris avant une erreur de lecture
+            if tasks:
+                await asyncio.wait(set(tasks))
+            await results.put(_END)
+
+        self.counters['batches'] += 1
+        feeder = asyncio.ensure_future(feed())
+        gone = asyncio.ensure_future(disconnected()) if disconnected is not None else None
+        try:
+            while True:
+                if gone is not None:
+                    taken = asyncio.ensure_future(results.get())
+                    await asyncio.wait({taken, gone}, return_when=asyncio.FIRST_COMPLETED)
+                    if not taken.done():
+                        taken.cancel()
+                        logger.info(f"Batch abandoned by its client after {summary['rows']} rows")
+                        return
+                    result = taken.result()
+                else:
+                    result = await results.get()
+                if result is _END:
+                    break
+                summary['rows'] += 1
+                if result.get('status') == 'ok':
+                    summary['succeeded'] += 1
+                else:
+                    summary['failed'] += 1
+                yield result
+            summary['elapsed'] = round(time.monotonic() - start, 3)
+            yield summary
+        finally:
+            # Client parti : arrêter la lecture et les générations en cours
+            feeder.cancel()
+            if gone is not None:
+                gone.cancel()
+            for task in list(tasks):
+                task.cancel()
+            self.counters['rows'] += summary['rows']
+            self.counters['failed_rows'] += summary['failed']
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters)
+
+# Exécuteur partagé par les routes de lot
+batch_executor = BatchExecutor.from_config()
@@ -1,14 +1,13 @@
 """
 Service pour la gestion des catégories.
 """
-import json
-import uuid
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
 from backend.models import Category, CategoryCreate, CategoryUpdate
 from backend.config import config
+from backend.services.json_store import JsonFileStore
 
 class CategoryService:
     """Service for managing categories."""
@@ -18,25 +17,27 @@ class CategoryService:
         self.data_dir = Path(config.get('storage', 'data_directory', fallback='data'))
         self.categories_file = self.data_dir / 'categories.json'
         self.data_dir.mkdir(exist_ok=True)
+        self.store = JsonFileStore(self.categories_file)
         self._load_categories()
         self._ensure_default_categories()
     
     def _load_categories(self):
         """Load categories from file."""
-        if self.categories_file.exists():
-            try:
-                with open(self.categories_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                self.categories = {
-                    cat_id: Category(**cat_data)
-                    for cat_id, cat_data in data.items()
-                }
-            except Exception as e:
-                print(f"Error loading categories: {e}")
-                self.categories = {}
-        else:
+        try:
+            data = self.store.read()
+            self.categories = {
+                cat_id: Category(**cat_data)
+                for cat_id, cat_data in data.items()
+            }
+        except Exception as e:
+            print(f"Error loading categories: {e}")
             self.categories = {}
     
+    def _refresh(self):
+        """Reload categories if another worker changed the file."""
+        if self.store.changed():
+            self._load_categories()
+    
     def _save_categories(self):
         """Save categories to file."""
         try:
@@ -50,8 +51,7 @@ class CategoryService:
                 if 'created_at' in cat_data and isinstance(cat_data['created_at'], datetime):
                     cat_data['created_at'] = cat_data['created_at'].isoformat()
             
-            with open(self.categories_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            self.store.write(data)
         except Exception as e:
             print(f"Error saving categories: {e}")
     
@@ -100,27 +100,36 @@ class CategoryService:
             }
         ]
         
-        # Check if any system categories exist
-        has_system_categories = any(cat.is_system for cat in self.categories.values())
-        
-        if not has_system_categories:
-            for cat_data in default_categories:
-                category = Category(
-                    name=cat_data["name"],
-                    description=cat_data["description"],
-                    is_system=True,
-                    created_by=None
-                )
-                self.categories[category.id] = category
+        # Check under the lock so that concurrent workers do not both create them
+        with self.store.lock():
+            self._refresh()
+            has_system_categories = any(cat.is_system for cat in self.categories.values())
             
-            self._save_categories()
+            if not has_system_categories:
+                for cat_data in default_categories:
+                    category = Category(
+                        name=cat_data["name"],
+                        description=cat_data["description"],
+                        is_system=True,
+                        created_by=None
+                    )
+                    self.categories[category.id] = category
+                
+                self._save_categories()
+    
+    def get_catalog_version(self) -> str:
+        """Version of the categories file, identical in every worker process."""
+        self._refresh()
+        return str(self.store.signature())
     
     def get_all_categories(self) -> List[Category]:
         """Get all categories."""
+        self._refresh()
         return list(self.categories.values())
     
     def get_categories_by_user(self, user_id: Optional[str] = None) -> List[Category]:
         """Get categories available to a user (system + user created)."""
+        self._refresh()
         categories = []
         
         for category in self.categories.values():
@@ -135,6 +144,7 @@ class CategoryService:
     
     def get_category(self, category_id: str) -> Optional[Category]:
         """Get a category by ID."""
+        self._refresh()
         return self.categories.get(category_id)
     
     def create_category(self, category_data: CategoryCreate, user_id: str) -> Category:
@@ -146,37 +156,44 @@ class CategoryService:
             is_system=False
         )
         
-        self.categories[category.id] = category
-        self._save_categories()
+        with self.store.lock():
+            self._refresh()
+            self.categories[category.id] = category
+            self._save_categories()
         return category
     
     def update_category(self, category_id: str, updates: CategoryUpdate, user_id: str) -> Optional[Category]:
         """Update a category (only if created by user)."""
-        category = self.categories.get(category_id)
-        if not category or category.is_system or category.created_by != user_id:
-            return None
-        
-        # Apply updates
-        update_data = updates.dict(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(category, field, value)
-        
-        self.categories[category_id] = category
-        self._save_categories()
+        with self.store.lock():
+            self._refresh()
+            category = self.categories.get(category_id)
+            if not category or category.is_system or category.created_by != user_id:
+                return None
+            
+            # Apply updates
+            update_data = updates.dict(exclude_unset=True)
+            for field, value in update_data.items():
+                setattr(category, field, value)
+            
+            self.categories[category_id] = category
+            self._save_categories()
         return category
     
     def delete_category(self, category_id: str, user_id: str) -> bool:
         """Delete a category (only if created by user)."""
-        category = self.categories.get(category_id)
-        if not category or category.is_system or category.created_by != user_id:
-            return False
-        
-        del self.categories[category_id]
-        self._save_categories()
+        with self.store.lock():
+            self._refresh()
+            category = self.categories.get(category_id)
+            if not category or category.is_system or category.created_by != user_id:
+                return False
+            
+            del self.categories[category_id]
+            self._save_categories()
         return True
     
     def get_categories_dict(self) -> Dict[str, str]:
         """Get categories as a dictionary of {id: name}."""
+        self._refresh()
         return {
             cat_id: category.name
             for cat_id, category in self.categories.items()
@@ -184,6 +201,7 @@ class CategoryService:
     
     def suggest_category_for_prompt(self, prompt_title: str, prompt_content: str) -> Optional[str]:
         """Suggest a category based on prompt content using keywords."""
+        self._refresh()
         
         # Keywords for each category
         category_keywords = {
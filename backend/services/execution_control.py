@@ -0,0 +1,310 @@
+"""
+Suivi des exécutions LLM en cours : annulation explicite (DELETE) ou à la
+déconnexion du client, avec arrêt immédiat de la génération amont pour ne
+pas consommer de temps GPU inutilement.
+
+Avec plusieurs workers, le registre est partagé en SQLite (à côté des
+résultats d'exécution) : un DELETE reçu par un autre processus y pose une
+demande d'annulation, que le processus qui exécute relit toutes les
+poll_ms millisecondes.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from backend.config import config
+
+logger = logging.getLogger(__name__)
+
+class ExecutionCancelled(Exception):
+    """The execution was cancelled by its user or its client went away."""
+
+    def __init__(self, execution_id: str, reason: str):
+        super().__init__(f"Exécution {execution_id} interrompue ({reason})")
+        self.execution_id = execution_id
+        self.reason = reason
+
+class ExecutionIdInUseError(ValueError):
+    """An execution id is already used by a running, queued or stored execution."""
+
+class _Running:
+    __slots__ = ('user_id', 'cancelled', 'tokens')
+
+    def __init__(self, user_id: Optional[str]):
+        self.user_id = user_id
+        self.cancelled = asyncio.Event()
+        self.tokens = 0
+
+def shared_state_enabled() -> bool:
+    """True when state must be shared between worker processes."""
+    return config.getboolean('server', 'shared_state', config.getint('server', 'workers', 1) > 1)
+
+def shared_state_path() -> str:
+    data_dir = Path(config.get('storage', 'data_directory', fallback='data'))
+    return config.get('execution_store', 'path', str(data_dir / 'executions.db'))
+
+class ExecutionRegistry:
+    """Running executions, their cancellation and the tokens saved by it.
+
+    With a path, executions are also recorded in a SQLite table shared by
+    the worker processes, so any of them can cancel them.
+    """
+
+    def __init__(self, path: Optional[str] = None, poll: float = 0.25, stale_seconds: float = 30.0):
+        self.path = path
+        self.poll = poll
+        # Exécution d'un processus disparu : plus annulable, id réutilisable
+        self.stale_seconds = stale_seconds
+        self.owner = f"{os.getpid()}"
+        self._running: Dict[str, _Running] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self.counters = {
+            'completed': 0,
+            'cancelled': 0,
+            'disconnected': 0,
+            'tokens_generated': 0,
+            # Estimation : longueur moyenne d'une réponse complète moins les
+            # tokens déjà produits au moment de l'arrêt
+            'tokens_saved': 0,
+        }
+        self._avg_tokens = 0.0
+        self._streams_completed = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._opening = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'ExecutionRegistry':
+        return cls(
+            path=shared_state_path() if shared_state_enabled() else None,
+            poll=config.getint('execution_store', 'cancel_poll_ms', 250) / 1000,
+        )
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Connection opened on first use rather than when the module is imported."""
+        if self._db is None:
+            with self._opening:
+                if self._db is None:
+                    self._init_db()
+        return self._db
+
+    def _init_db(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS running_executions (
+                execution_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                owner TEXT NOT NULL,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                seen_at REAL NOT NULL
+            )
+        ''')
+        self._db = conn
+
+    def is_running(self, execution_id: str) -> bool:
+        return execution_id in self._running
+
+    def is_cancelled(self, execution_id: str) -> bool:
+        running = self._running.get(execution_id)
+        return running is not None and running.cancelled.is_set()
+
+    def register(self, execution_id: str, user_id: Optional[str] = None):
+        if execution_id in self._running:
+            raise ExecutionIdInUseError(f"Exécution {execution_id} déjà en cours")
+        if self.path:
+            self._share(execution_id, user_id)
+        self._running[execution_id] = _Running(user_id)
+        self._start_poller()
+
+    def _share(self, execution_id: str, user_id: Optional[str]):
+        now = time.time()
+        with self._lock:
+            # Remplace seulement l'entrée d'un processus disparu
+            taken = not self._conn.execute('''
+                INSERT INTO running_executions (execution_id, user_id, owner, seen_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (execution_id) DO UPDATE SET
+                    user_id = excluded.user_id, owner = excluded.owner,
+                    cancel_requested = 0, seen_at = excluded.seen_at
+                WHERE running_executions.seen_at < ?
+            ''', (execution_id, user_id, self.owner, now, now - self.stale_seconds)).rowcount
+        if taken:
+            raise ExecutionIdInUseError(f"Exécution {execution_id} déjà en cours")
+
+    def unregister(self, execution_id: str):
+        """Forget an execution that ended before its generation started."""
+        if self._running.pop(execution_id, None) is not None:
+            self._unshare(execution_id)
+
+    def _unshare(self, execution_id: str):
+        if self.path:
+            with self._lock:
+                self._conn.execute(
+                    'DELETE FROM running_executions WHERE execution_id = ? AND owner = ?',
+                    (execution_id, self.owner)
+                )
+
+    def cancel(self, execution_id: str, user_id: Optional[str] = None) -> bool:
+        """Ask a running execution to stop; False if unknown or owned by another user."""
+        running = self._running.get(execution_id)
+        if running is None:
+            return self._cancel_shared(execution_id, user_id)
+        if running.user_id is not None and running.user_id != user_id:
+            return False
+        running.cancelled.set()
+        return True
+
+    def _cancel_shared(self, execution_id: str, user_id: Optional[str]) -> bool:
+        """Flag an execution running in another process; it sees it at its next poll."""
+        if not self.path:
+            return False
+        with self._lock:
+            return self._conn.execute('''
+                UPDATE running_executions SET cancel_requested = 1
+                WHERE execution_id = ? AND (user_id IS NULL OR user_id IS ?) AND seen_at >= ?
+            ''', (execution_id, user_id, time.time() - self.stale_seconds)).rowcount > 0
+
+    # ----- Partage entre processus -----
+
+    def _start_poller(self):
+        if not self.path or (self._poller is not None and not self._poller.done()):
+            return
+        try:
+            self._poller = asyncio.get_running_loop().create_task(self._poll())
+        except RuntimeError:
+            # Hors boucle asyncio (scripts, tests) : pas d'annulation à distance
+            self._poller = None
+
+    async def _poll(self):
+        """Keep this process's executions alive and forward cancellations from other processes."""
+        while self._running:
+            await asyncio.sleep(self.poll)
+            try:
+                cancelled = await asyncio.to_thread(self._sync)
+            except sqlite3.Error as e:
+                logger.warning(f"Execution registry sync failed: {e}")
+                continue
+            for execution_id in cancelled:
+                running = self._running.get(execution_id)
+                if running is not None:
+                    running.cancelled.set()
+
+    def _sync(self) -> List[str]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'UPDATE running_executions SET seen_at = ? WHERE owner = ?', (now, self.owner)
+            )
+            self._conn.execute(
+                'DELETE FROM running_executions WHERE seen_at < ?', (now - self.stale_seconds,)
+            )
+            rows = self._conn.execute('''
+                SELECT execution_id FROM running_executions WHERE owner = ? AND cancel_requested = 1
+            ''', (self.owner,)).fetchall()
+        return [row[0] for row in rows]
+
+    def _finish(self, execution_id: str, tokens: Optional[int], reason: Optional[str]):
+        """Unregister an execution; tokens is None when they were not counted."""
+        self.unregister(execution_id)
+        if reason is None:
+            self.counters['completed'] += 1
+        else:
+            self.counters[reason] += 1
+            logger.info(f"Execution {execution_id} stopped ({reason})")
+        if tokens is None:
+            return
+        self.counters['tokens_generated'] += tokens
+        if reason is None:
+            self._streams_completed += 1
+            self._avg_tokens += (tokens - self._avg_tokens) / self._streams_completed
+        else:
+            self.counters['tokens_saved'] += max(0, round(self._avg_tokens) - tokens)
+
+    async def guard(self, execution_id: str, chunks: AsyncIterator[str],
+                    disconnected: Optional[Callable[[], Awaitable[Any]]] = None,
+                    info: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
+        """Pass the chunks of a registered execution through until it ends,
+        is cancelled, or disconnected() completes; the upstream is then closed.
+
+        The execution is unregistered at the end; info, if given, receives
+        'stopped' with the reason ('cancelled', 'disconnected') or None.
+        """
+        running = self._running[execution_id]
+        iterator = chunks.__aiter__()
+        stops = [asyncio.ensure_future(running.cancelled.wait())]
+        if disconnected is not None:
+            stops.append(asyncio.ensure_future(disconnected()))
+        pending: Optional[asyncio.Future] = None
+        reason: Optional[str] = 'disconnected'
+        try:
+            while True:
+                pending = asyncio.ensure_future(iterator.__anext__())
+                done, _ = await asyncio.wait({pending, *stops}, return_when=asyncio.FIRST_COMPLETED)
+                if pending not in done:
+                    reason = 'cancelled' if running.cancelled.is_set() else 'disconnected'
+                    return
+                try:
+                    chunk = pending.result()
+                except StopAsyncIteration:
+                    reason = None
+                    return
+                finally:
+                    if pending.done():
+                        pending = None
+                running.tokens += 1
+                yield chunk
+        finally:
+            for future in stops + ([pending] if pending is not None else []):
+                if not future.done():
+                    future.cancel()
+            if pending is not None:
+                try:
+                    await pending
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+            aclose = getattr(chunks, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+            if info is not None:
+                info['stopped'] = reason
+            self._finish(execution_id, running.tokens, reason)
+
+    async def run(self, execution_id: str, coro: Awaitable[Any],
+                  disconnected: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """Await coro for a registered execution; raise ExecutionCancelled if it
+        is cancelled or disconnected() completes first (coro is then cancelled)."""
+        running = self._running[execution_id]
+        task = asyncio.ensure_future(coro)
+        stops = [asyncio.ensure_future(running.cancelled.wait())]
+        if disconnected is not None:
+            stops.append(asyncio.ensure_future(disconnected()))
+        reason: Optional[str] = 'disconnected'
+        try:
+            done, _ = await asyncio.wait({task, *stops}, return_when=asyncio.FIRST_COMPLETED)
+            if task in done:
+                reason = None
+                return task.result()
+            reason = 'cancelled' if running.cancelled.is_set() else 'disconnected'
+            raise ExecutionCancelled(execution_id, reason)
+        finally:
+            for future in stops + [task]:
+                if not future.done():
+                    future.cancel()
+            self._finish(execution_id, None, reason)
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, 'running': len(self._running)}
+
+# Registre partagé par les routes d'exécution
+execution_registry = ExecutionRegistry.from_config()
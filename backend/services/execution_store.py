@@ -0,0 +1,284 @@
+"""
+Stockage persistant des résultats d'exécution (SQLite, partagé entre les
+workers) avec expiration, taille maximale et déduplication des prompts
+finaux (souvent volumineux avec le texte des PDF) par empreinte.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from backend.config import config
+from backend.models import PromptExecutionResult
+
+logger = logging.getLogger(__name__)
+
+class ExecutionStore:
+    """Bounded SQLite store of PromptExecutionResult, indexed by user and prompt."""
+
+    def __init__(self, path: str, ttl_seconds: int = 7 * 86400, max_mb: int = 256):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self.counters = {'stores': 0, 'deduplicated_prompts': 0, 'evicted': 0}
+        self._db: Optional[sqlite3.Connection] = None
+        self._opening = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'ExecutionStore':
+        data_dir = Path(config.get('storage', 'data_directory', fallback='data'))
+        return cls(
+            path=config.get('execution_store', 'path', str(data_dir / 'executions.db')),
+            ttl_seconds=config.getint('execution_store', 'ttl_hours', 168) * 3600,
+            max_mb=config.getint('execution_store', 'max_mb', 256),
+        )
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Connection opened on first use rather than when the module is imported."""
+        if self._db is None:
+            with self._opening:
+                if self._db is None:
+                    self._init_db()
+        return self._db
+
+    def _init_db(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS prompt_bodies (
+                hash TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS executions (
+                execution_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                prompt_id TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_executions_user ON executions (user_id, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_executions_prompt ON executions (prompt_id, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_executions_expires ON executions (expires_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_executions_hash ON executions (prompt_hash)')
+        # Taille totale (résultats + prompts finaux) tenue à jour à chaque
+        # écriture, partagée entre les workers ; calculée une seule fois
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS store_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO store_meta (key, value)
+            SELECT 'bytes', (SELECT COALESCE(SUM(size), 0) FROM executions)
+                          + (SELECT COALESCE(SUM(size), 0) FROM prompt_bodies)
+        ''')
+        self._db = conn
+
+    # Accès depuis la boucle asyncio : SQLite (verrou d'écriture partagé entre
+    # les workers, attente jusqu'à 30 s) dans un thread
+
+    async def put(self, execution: PromptExecutionResult, user_id: Optional[str] = None) -> bool:
+        """Store an execution result; its final prompt is stored once per content.
+
+        An execution id stays bound to the user who stored it first: the
+        write is rejected (False) if the id belongs to another user.
+        """
+        return await asyncio.to_thread(self._put, execution, user_id)
+
+    async def available(self, execution_id: str, user_id: Optional[str] = None) -> bool:
+        """True if execution_id is free for this user: unknown, expired or already theirs."""
+        return await asyncio.to_thread(self._available, execution_id, user_id)
+
+    async def get(self, execution_id: str, user_id: Optional[str] = None) -> Optional[PromptExecutionResult]:
+        """Execution result by id; None if unknown, expired or owned by another user."""
+        return await asyncio.to_thread(self._get, execution_id, user_id)
+
+    async def list(self, user_id: str, prompt_id: Optional[str] = None,
+                   limit: int = 50) -> List[Dict[str, Any]]:
+        """Latest executions of a user (optionally for one prompt), without the final prompt."""
+        return await asyncio.to_thread(self._list, user_id, prompt_id, limit)
+
+    def _put(self, execution: PromptExecutionResult, user_id: Optional[str]) -> bool:
+        body = execution.final_prompt
+        prompt_hash = hashlib.sha256(body.encode('utf-8')).hexdigest()
+        data = execution.model_dump_json(exclude={'final_prompt'})
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    previous = self._conn.execute(
+                        'SELECT size, prompt_hash FROM executions WHERE execution_id = ?',
+                        (execution.execution_id,)
+                    ).fetchone()
+                    # Identifiant choisi par le client : pas de remplacement de
+                    # l'exécution (non expirée) d'un autre utilisateur
+                    stored = self._conn.execute('''
+                        INSERT INTO executions
+                            (execution_id, user_id, prompt_id, prompt_hash, data, size, created_at, expires_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (execution_id) DO UPDATE SET
+                            user_id = excluded.user_id, prompt_id = excluded.prompt_id,
+                            prompt_hash = excluded.prompt_hash, data = excluded.data, size = excluded.size,
+                            created_at = excluded.created_at, expires_at = excluded.expires_at
+                        WHERE executions.user_id IS excluded.user_id OR executions.expires_at <= excluded.created_at
+                    ''', (
+                        execution.execution_id, user_id, execution.prompt_id, prompt_hash,
+                        data, len(data.encode('utf-8')), now, now + self.ttl_seconds
+                    )).rowcount
+                    if not stored:
+                        self._conn.execute('ROLLBACK')
+                        logger.warning(f"Execution {execution.execution_id} belongs to another user, not stored")
+                        return False
+                    added = len(data.encode('utf-8'))
+                    body_size = len(body.encode('utf-8'))
+                    if self._conn.execute(
+                        'INSERT OR IGNORE INTO prompt_bodies (hash, body, size) VALUES (?, ?, ?)',
+                        (prompt_hash, body, body_size)
+                    ).rowcount:
+                        added += body_size
+                    else:
+                        self.counters['deduplicated_prompts'] += 1
+                    if previous is not None:
+                        # Résultat remplacé : son ancien prompt final peut ne plus servir
+                        added -= previous[0] + self._collect_bodies({previous[1]})
+                    total = self._add_bytes(added)
+                    self._evict(now, total)
+                    self._conn.execute('COMMIT')
+                except Exception:
+                    self._conn.execute('ROLLBACK')
+                    raise
+                self.counters['stores'] += 1
+                return True
+            except sqlite3.Error as e:
+                logger.warning(f"Execution store write failed: {e}")
+                return False
+
+    def _available(self, execution_id: str, user_id: Optional[str]) -> bool:
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    'SELECT user_id, expires_at FROM executions WHERE execution_id = ?', (execution_id,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Execution store read failed: {e}")
+                return True
+        return row is None or row[0] == user_id or row[1] <= time.time()
+
+    def _add_bytes(self, delta: int) -> int:
+        """Update the stored size by delta; returns the new total."""
+        self._conn.execute("UPDATE store_meta SET value = value + ? WHERE key = 'bytes'", (delta,))
+        return self._conn.execute("SELECT value FROM store_meta WHERE key = 'bytes'").fetchone()[0]
+
+    def _collect_bodies(self, hashes) -> int:
+        """Delete the final prompts among hashes no longer referenced; returns the freed size."""
+        freed = 0
+        for prompt_hash in hashes:
+            row = self._conn.execute('''
+                SELECT size FROM prompt_bodies
+                WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM executions WHERE prompt_hash = ?)
+            ''', (prompt_hash, prompt_hash)).fetchone()
+            if row is not None:
+                self._conn.execute('DELETE FROM prompt_bodies WHERE hash = ?', (prompt_hash,))
+                freed += row[0]
+        return freed
+
+    def _remove(self, victims: List[tuple]) -> int:
+        """Delete (execution_id, size, prompt_hash) rows and their orphaned
+        final prompts; returns the freed size."""
+        self._conn.executemany(
+            'DELETE FROM executions WHERE execution_id = ?', [(victim[0],) for victim in victims]
+        )
+        freed = sum(victim[1] for victim in victims) + self._collect_bodies({victim[2] for victim in victims})
+        self.counters['evicted'] += len(victims)
+        return freed
+
+    def _evict(self, now: float, total: int):
+        """Drop expired executions, then the oldest ones until the results and
+        their final prompts fit in the size limit."""
+        conn = self._conn
+        freed = 0
+        expired = conn.execute(
+            'SELECT execution_id, size, prompt_hash FROM executions WHERE expires_at <= ?', (now,)
+        ).fetchall()
+        if expired:
+            freed += self._remove(expired)
+
+        while total - freed > self.max_bytes:
+            # Un à un, en comptant les prompts finaux libérés par chacun
+            oldest = conn.execute(
+                'SELECT execution_id, size, prompt_hash FROM executions ORDER BY created_at LIMIT 32'
+            ).fetchall()
+            if not oldest:
+                break
+            for victim in oldest:
+                freed += self._remove([victim])
+                if total - freed <= self.max_bytes:
+                    break
+
+        if freed:
+            self._add_bytes(-freed)
+
+    def _get(self, execution_id: str, user_id: Optional[str]) -> Optional[PromptExecutionResult]:
+        with self._lock:
+            try:
+                row = self._conn.execute('''
+                    SELECT e.data, e.user_id, e.expires_at, b.body
+                    FROM executions e JOIN prompt_bodies b ON b.hash = e.prompt_hash
+                    WHERE e.execution_id = ?
+                ''', (execution_id,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Execution store read failed: {e}")
+                return None
+        if row is None or row[2] <= time.time():
+            return None
+        if user_id is not None and row[1] is not None and row[1] != user_id:
+            return None
+        return PromptExecutionResult(**json.loads(row[0]), final_prompt=row[3])
+
+    def _list(self, user_id: str, prompt_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        query = 'SELECT data, created_at FROM executions WHERE user_id = ? AND expires_at > ?'
+        params: List[Any] = [user_id, time.time()]
+        if prompt_id is not None:
+            query += ' AND prompt_id = ?'
+            params.append(prompt_id)
+        query += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            try:
+                rows = self._conn.execute(query, params).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f"Execution store read failed: {e}")
+                return []
+        return [{**json.loads(data), 'created_at': created_at} for data, created_at in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+            count = self._conn.execute('SELECT COUNT(*) FROM executions').fetchone()[0]
+            bodies = self._conn.execute('SELECT COUNT(*) FROM prompt_bodies').fetchone()[0]
+            size = self._conn.execute("SELECT value FROM store_meta WHERE key = 'bytes'").fetchone()[0]
+        stats.update(executions=count, prompt_bodies=bodies, bytes=size)
+        return stats
+
+# Stockage partagé par les services du processus
+execution_store = ExecutionStore.from_config()
@@ -0,0 +1,129 @@
+"""
+Comparaison de serveurs/modèles : un même prompt final est envoyé en
+parallèle à plusieurs cibles et leurs flux sont entrelacés dans une seule
+réponse. Chaque cible est mesurée (temps avant le premier token, débit,
+durée totale) ; la durée de la comparaison est celle de la cible la plus
+lente et non la somme.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
+
+from backend.config import config
+from backend.services.stream_coalescer import frame_coalescer
+
+logger = logging.getLogger(__name__)
+
+class TargetRun:
+    """Measurements of one target's stream."""
+
+    def __init__(self, index: int, label: Dict[str, Any], meta: Dict[str, Any]):
+        self.index = index
+        self.label = label
+        # Renseigné par le flux (serveur effectif, usage déclaré, erreur)
+        self.meta = meta
+        self.start = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.end: Optional[float] = None
+        self.chunks = 0
+        self.error: Optional[str] = None
+
+    async def measured(self, chunks: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        async for chunk in chunks:
+            if self.first_token_at is None:
+                self.first_token_at = time.monotonic()
+            self.chunks += 1
+            yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.monotonic()
+        error = self.error or self.meta.get('error')
+        usage = self.meta.get('usage') or {}
+        # Le message d'erreur d'une cible en échec n'est pas une réponse
+        first_token_at = self.first_token_at if not error else None
+        tokens = usage.get('completion_tokens') or (self.chunks if not error else 0)
+        ttft = first_token_at - self.start if first_token_at is not None else None
+        # Débit de génération, hors attente du premier token
+        generation = end - first_token_at if first_token_at is not None else 0
+        return {
+            **self.label,
+            'target': self.index,
+            'server': self.meta.get('server', self.label.get('server')),
+            'status': 'error' if error else 'ok',
+            'error': error,
+            'ttft': round(ttft, 3) if ttft is not None else None,
+            'latency': round(end - self.start, 3),
+            'tokens': tokens,
+            'tokens_per_second': round(tokens / generation, 1) if generation > 0 else None,
+        }
+
+class FanOut:
+    """Run target streams concurrently and interleave their chunks in one event stream."""
+
+    def __init__(self, max_targets: int = 6):
+        self.max_targets = max_targets
+        self.counters = {'comparisons': 0, 'targets': 0, 'failed_targets': 0, 'time_saved': 0.0}
+
+    @classmethod
+    def from_config(cls) -> 'FanOut':
+        return cls(max_targets=config.getint('compare', 'max_targets', 6))
+
+    async def run(self, labels: List[Dict[str, Any]], streams: List[AsyncIterator[str]],
+                  metas: List[Dict[str, Any]]) -> AsyncGenerator[Dict[str, Any], None]:
+        """Events of the comparison: {'target', 'chunk'} as chunks arrive, {'target',
+        'done', 'stats'} when a target ends, then {'done', 'results'} with the timings.
+
+        Each target's chunks are measured, then coalesced like any stream.
+        Closing the generator cancels the targets still running.
+        """
+        runs = [TargetRun(index, label, meta) for index, (label, meta) in enumerate(zip(labels, metas))]
+        events: asyncio.Queue = asyncio.Queue(maxsize=64)
+        start = time.monotonic()
+
+        async def pump(run: TargetRun, chunks: AsyncIterator[str]):
+            run.start = time.monotonic()
+            try:
+                async for text in frame_coalescer.coalesce(run.measured(chunks)):
+                    await events.put({'target': run.index, 'chunk': text})
+            except Exception as e:
+                logger.warning(f"Comparison target {run.label} failed: {e}")
+                run.error = str(e)
+            finally:
+                run.end = time.monotonic()
+            await events.put({'target': run.index, 'done': True, 'stats': run.stats()})
+
+        self.counters['comparisons'] += 1
+        self.counters['targets'] += len(runs)
+        yield {'targets': [{**run.label, 'target': run.index} for run in runs]}
+        tasks = [asyncio.ensure_future(pump(run, stream)) for run, stream in zip(runs, streams)]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await events.get()
+                if event.get('done'):
+                    remaining -= 1
+                yield event
+
+            results = [run.stats() for run in runs]
+            wall_time = time.monotonic() - start
+            sequential = sum(result['latency'] for result in results)
+            self.counters['failed_targets'] += sum(1 for result in results if result['status'] == 'error')
+            self.counters['time_saved'] = round(self.counters['time_saved'] + sequential - wall_time, 3)
+            yield {
+                'done': True,
+                'results': results,
+                'wall_time': round(wall_time, 3),
+                'sequential_time': round(sequential, 3),
+            }
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters)
+
+# Comparaisons partagées par les routes
+fan_out = FanOut.from_config()
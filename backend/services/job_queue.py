@@ -0,0 +1,416 @@
+"""
+File d'attente persistante des exécutions de prompts en mode « job » : la
+soumission répond immédiatement avec l'identifiant d'exécution et un pool de
+workers asynchrones traite les jobs par priorité. Le client suit l'état et
+la réponse partielle par interrogation ou par SSE.
+
+La file est en SQLite (partagée entre les processus, conservée au
+redémarrage) ; un job pris par un worker l'est pour une durée de bail
+renouvelée tant qu'il tourne, et repasse dans la file si son processus
+disparaît. Le nombre de workers borne le nombre de générations de jobs
+simultanées.
+
+Les accès SQLite passent par un thread pour ne pas bloquer la boucle
+asyncio ; la réponse partielle est complétée (et non réécrite) à chaque
+renouvellement du bail.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional
+
+from backend.config import config
+from backend.services.execution_control import ExecutionIdInUseError, execution_registry
+from backend.services.llm_scheduler import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# États d'un job
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class JobQueueFullError(QueueFullError):
+    """Too many jobs are waiting: the caller should retry later."""
+
+    def __init__(self, retry_after: int):
+        Exception.__init__(self, "File d'attente des jobs pleine")
+        self.key = ('jobs', '')
+        self.retry_after = retry_after
+
+class Job:
+    """A claimed job, handed to the runner."""
+
+    def __init__(self, job_id: str, user_id: Optional[str], prompt_id: str, payload: Dict[str, Any]):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.prompt_id = prompt_id
+        self.payload = payload
+        self.chunks: List[str] = []
+        # Morceaux déjà ajoutés à la réponse partielle en base
+        self.saved = 0
+
+    def on_chunk(self, chunk: str):
+        self.chunks.append(chunk)
+
+    @property
+    def partial(self) -> str:
+        return ''.join(self.chunks)
+
+# runner(job) exécute le job ; renvoie l'état final (DONE, FAILED, CANCELLED)
+Runner = Callable[[Job], Awaitable[str]]
+
+class JobQueue:
+    """Persistent priority queue of prompt executions drained by a worker pool."""
+
+    def __init__(self, path: str, workers: int = 4, max_pending: int = 500,
+                 lease_seconds: int = 60, max_attempts: int = 3,
+                 retention_seconds: int = 86400, heartbeat: float = 1.0):
+        self.path = path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        # Intervalle de renouvellement du bail et d'écriture de la réponse partielle
+        self.heartbeat = heartbeat
+        self.owner = f"{os.getpid()}"
+        self._lock = threading.Lock()
+        self._running: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.counters = {'submitted': 0, 'done': 0, 'failed': 0, 'cancelled': 0, 'requeued': 0}
+        self._db: Optional[sqlite3.Connection] = None
+        self._opening = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'JobQueue':
+        data_dir = Path(config.get('storage', 'data_directory', fallback='data'))
+        return cls(
+            path=config.get('jobs', 'path', str(data_dir / 'jobs.db')),
+            workers=config.getint('jobs', 'workers', 4),
+            max_pending=config.getint('jobs', 'max_pending', 500),
+            lease_seconds=config.getint('jobs', 'lease_seconds', 60),
+            max_attempts=config.getint('jobs', 'max_attempts', 3),
+            retention_seconds=config.getint('jobs', 'retention_hours', 24) * 3600,
+            heartbeat=config.getfloat('jobs', 'heartbeat', 1.0),
+        )
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Connection opened on first use rather than when the module is imported."""
+        if self._db is None:
+            with self._opening:
+                if self._db is None:
+                    self._init_db()
+        return self._db
+
+    def _init_db(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                prompt_id TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                partial TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                run_after REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_until REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, created_at)')
+        self._db = conn
+
+    def _write(self, query: str, params=()) -> int:
+        with self._lock:
+            return self._conn.execute(query, params).rowcount
+
+    async def submit(self, job_id: str, user_id: Optional[str], prompt_id: str,
+                     payload: Dict[str, Any], priority: int = 0):
+        """Queue a job. Raises ExecutionIdInUseError if the id is taken, JobQueueFullError if the queue is full."""
+        await asyncio.to_thread(self._submit, job_id, user_id, prompt_id, payload, priority)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _submit(self, job_id: str, user_id: Optional[str], prompt_id: str,
+                payload: Dict[str, Any], priority: int):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Jobs terminés au-delà de la durée de conservation
+                self._conn.execute(
+                    'DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?',
+                    (*FINISHED, now - self.retention_seconds)
+                )
+                pending = self._conn.execute(
+                    'SELECT COUNT(*) FROM jobs WHERE status = ?', (QUEUED,)
+                ).fetchone()[0]
+                if pending >= self.max_pending:
+                    raise JobQueueFullError(retry_after=max(1, self.lease_seconds // 2))
+                try:
+                    self._conn.execute('''
+                        INSERT INTO jobs (job_id, user_id, prompt_id, priority, status, payload, created_at, run_after)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (job_id, user_id, prompt_id, priority, QUEUED, json.dumps(payload), now, now))
+                except sqlite3.IntegrityError:
+                    raise ExecutionIdInUseError(f"Exécution {job_id} déjà soumise")
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        self.counters['submitted'] += 1
+
+    def _claim(self) -> Optional[Job]:
+        """Take the next job: highest priority first, then oldest; expired leases are taken over."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                while True:
+                    row = self._conn.execute('''
+                        SELECT job_id, user_id, prompt_id, payload, attempts, cancel_requested FROM jobs
+                        WHERE (status = ? AND run_after <= ?) OR (status = ? AND lease_until < ?)
+                        ORDER BY priority DESC, created_at
+                        LIMIT 1
+                    ''', (QUEUED, now, RUNNING, now)).fetchone()
+                    if row is None:
+                        self._conn.execute('COMMIT')
+                        return None
+                    job_id, user_id, prompt_id, payload, attempts, cancel_requested = row
+                    if cancel_requested or attempts >= self.max_attempts:
+                        # Processus disparu pendant le job : annulé s'il était
+                        # demandé, en échec après trop de reprises
+                        status = CANCELLED if cancel_requested else FAILED
+                        self._conn.execute('''
+                            UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_until = NULL
+                            WHERE job_id = ?
+                        ''', (status, None if cancel_requested else "Nombre maximal de tentatives atteint",
+                              now, job_id))
+                        self.counters[status] += 1
+                        continue
+                    # Reprise : la réponse partielle repart de zéro
+                    self._conn.execute('''
+                        UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, partial = NULL,
+                            started_at = COALESCE(started_at, ?), lease_until = ?
+                        WHERE job_id = ?
+                    ''', (RUNNING, self.owner, now, now + self.lease_seconds, job_id))
+                    self._conn.execute('COMMIT')
+                    break
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return Job(job_id, user_id, prompt_id, json.loads(payload))
+
+    async def _heartbeat(self, job: Job):
+        """Renew the lease, save the partial output and forward cancellations."""
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                cancel = await asyncio.to_thread(self._renew, job)
+            except sqlite3.Error as e:
+                logger.warning(f"Job heartbeat failed for {job.job_id}: {e}")
+                continue
+            if cancel:
+                # Annulation demandée depuis un autre processus
+                execution_registry.cancel(job.job_id, job.user_id)
+
+    def _renew(self, job: Job) -> bool:
+        """Extend the lease and append the new chunks; True if a cancellation was requested."""
+        count = len(job.chunks)
+        added = ''.join(job.chunks[job.saved:count])
+        with self._lock:
+            self._conn.execute('''
+                UPDATE jobs SET lease_until = ?, partial = COALESCE(partial, '') || ? WHERE job_id = ?
+            ''', (time.time() + self.lease_seconds, added, job.job_id))
+            cancel = self._conn.execute(
+                'SELECT cancel_requested FROM jobs WHERE job_id = ?', (job.job_id,)
+            ).fetchone()
+        job.saved = count
+        return bool(cancel and cancel[0])
+
+    async def _execute(self, runner: Runner, job: Job):
+        self._running[job.job_id] = job
+        heartbeat = asyncio.ensure_future(self._heartbeat(job))
+        status, error = FAILED, None
+        try:
+            status = await runner(job)
+        except QueueFullError as e:
+            # Serveur LLM saturé : le job attend son tour au lieu d'échouer
+            await asyncio.to_thread(self._write, '''
+                UPDATE jobs SET status = ?, run_after = ?, attempts = attempts - 1, lease_until = NULL
+                WHERE job_id = ?
+            ''', (QUEUED, time.time() + e.retry_after, job.job_id))
+            self.counters['requeued'] += 1
+            return
+        except Exception as e:
+            logger.error(f"Job {job.job_id} failed: {e}")
+            error = str(e)
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.job_id, None)
+        await asyncio.to_thread(self._write, '''
+            UPDATE jobs SET status = ?, error = ?, partial = ?, finished_at = ?, lease_until = NULL
+            WHERE job_id = ?
+        ''', (status, error, None if status == DONE else job.partial, time.time(), job.job_id))
+        self.counters[status] += 1
+
+    async def _worker(self, runner: Runner):
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except sqlite3.Error as e:
+                logger.warning(f"Job queue read failed: {e}")
+                job = None
+            if job is None:
+                # Réveil à la soumission, ou périodiquement pour les jobs des
+                # autres processus et les baux expirés
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(runner, job)
+
+    def start(self, runner: Runner):
+        """Start the worker pool in the running event loop."""
+        if self._tasks or self.workers <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker(runner)) for _ in range(self.workers)]
+        logger.info(f"Job queue started with {self.workers} workers")
+
+    async def stop(self):
+        interrupted = list(self._running)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # Les jobs interrompus seront repris au prochain démarrage
+        for job_id in interrupted:
+            await asyncio.to_thread(self._write, '''
+                UPDATE jobs SET status = ?, attempts = attempts - 1, lease_until = NULL WHERE job_id = ?
+            ''', (QUEUED, job_id))
+
+    async def get(self, job_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """State of a job; None if unknown or owned by another user."""
+        return await asyncio.to_thread(self._get, job_id, user_id)
+
+    def _get(self, job_id: str, user_id: Optional[str], since: int = 0) -> Optional[Dict[str, Any]]:
+        """State of a job, with the partial output from character `since` on."""
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT user_id, prompt_id, priority, status, substr(COALESCE(partial, ''), ? + 1), error,
+                       attempts, created_at, started_at, finished_at
+                FROM jobs WHERE job_id = ?
+            ''', (since, job_id)).fetchone()
+            if row is None or (user_id is not None and row[0] is not None and row[0] != user_id):
+                return None
+            position = None
+            if row[3] == QUEUED:
+                position = self._conn.execute('''
+                    SELECT COUNT(*) FROM jobs
+                    WHERE status = ? AND (priority > ? OR (priority = ? AND created_at < ?))
+                ''', (QUEUED, row[2], row[2], row[7])).fetchone()[0] + 1
+        running = self._running.get(job_id)
+        return {
+            'execution_id': job_id,
+            'prompt_id': row[1],
+            'priority': row[2],
+            'status': row[3],
+            'position': position,
+            # Réponse partielle la plus fraîche si le job tourne dans ce processus
+            'partial': running.partial[since:] if running is not None else row[4],
+            'error': row[5],
+            'attempts': row[6],
+            'created_at': row[7],
+            'started_at': row[8],
+            'finished_at': row[9],
+        }
+
+    async def cancel(self, job_id: str, user_id: Optional[str] = None) -> bool:
+        """Cancel a queued job, or ask a running one to stop; False if unknown or finished."""
+        if not await asyncio.to_thread(self._cancel, job_id, user_id):
+            return False
+        execution_registry.cancel(job_id, user_id)
+        return True
+
+    def _cancel(self, job_id: str, user_id: Optional[str]) -> bool:
+        state = self._get(job_id, user_id)
+        if state is None or state['status'] in FINISHED:
+            return False
+        if state['status'] == QUEUED:
+            cancelled = self._write('''
+                UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ? AND status = ?
+            ''', (CANCELLED, time.time(), job_id, QUEUED))
+            if cancelled:
+                self.counters['cancelled'] += 1
+                return True
+        # En cours : ici ou, via le heartbeat, dans le processus qui l'exécute
+        self._write('UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?', (job_id,))
+        return True
+
+    async def follow(self, job_id: str, user_id: Optional[str] = None,
+                     interval: float = 0.25) -> AsyncGenerator[Dict[str, Any], None]:
+        """Status changes and new partial output of a job, until it finishes
+        (the complete answer is then in the execution store)."""
+        status = position = None
+        sent = 0
+        while True:
+            # Seule la suite de la réponse partielle est relue
+            state = await asyncio.to_thread(self._get, job_id, user_id, sent)
+            if state is None:
+                return
+            if (state['status'], state['position']) != (status, position):
+                status, position = state['status'], state['position']
+                yield {'status': status, 'position': position}
+            if state['partial']:
+                yield {'chunk': state['partial']}
+                sent += len(state['partial'])
+            if status in FINISHED:
+                yield {'done': True, 'status': status, 'error': state['error']}
+                return
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._conn.execute(
+                'SELECT status, COUNT(*) FROM jobs GROUP BY status'
+            ).fetchall())
+        return {
+            **self.counters,
+            'workers': len(self._tasks),
+            'running_here': len(self._running),
+            **{status: counts.get(status, 0) for status in (QUEUED, RUNNING)},
+        }
+
+# File partagée par les routes d'exécution
+job_queue = JobQueue.from_config()
@@ -0,0 +1,122 @@
+"""
+Stockage JSON partagé entre plusieurs processus workers.
+
+Les écritures passent par un fichier temporaire (fsync puis rename atomique),
+sous un verrou fcntl exclusif posé sur un fichier « .lock » voisin. Chaque
+rename change l'inode du fichier : les autres workers détectent la nouvelle
+version par un simple stat() et rechargent leur copie en mémoire.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    # Windows : pas de verrou inter-processus, un seul worker supporté
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+def file_signature(path) -> Optional[tuple]:
+    """Return (mtime_ns, size, inode) for a file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def atomic_write_json(path, data: Any, **dump_kwargs):
+    """Write JSON to a temp file in the same directory, fsync it and rename it over path."""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    # Rendre le rename durable
+    if hasattr(os, 'O_DIRECTORY'):
+        try:
+            dir_fd = os.open(str(path.parent), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+
+class JsonFileStore:
+    """A JSON document on disk, safe to share between worker processes."""
+
+    def __init__(self, path, default_factory: Callable[[], Any] = dict):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self._default_factory = default_factory
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+        self._signature: Optional[tuple] = None
+
+    def signature(self) -> Optional[tuple]:
+        """Current on-disk signature of the document."""
+        return file_signature(self.path)
+
+    def changed(self) -> bool:
+        """True if the file changed since our last read or write."""
+        return self.signature() != self._signature
+
+    @contextmanager
+    def lock(self, exclusive: bool = True):
+        """Hold an advisory lock on the document (re-entrant within the process)."""
+        with self._thread_lock:
+            if self._lock_depth == 0 and FCNTL_AVAILABLE:
+                self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+                self._lock_file = open(self.lock_path, 'a+')
+                fcntl.flock(
+                    self._lock_file.fileno(),
+                    fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+                )
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def read(self) -> Any:
+        """Read the document under a shared lock and remember its signature."""
+        with self.lock(exclusive=False):
+            signature = self.signature()
+            if signature is None:
+                data = self._default_factory()
+            else:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            self._signature = signature
+            return data
+
+    def write(self, data: Any, **dump_kwargs):
+        """Atomically replace the document under an exclusive lock."""
+        dump_kwargs.setdefault('indent', 2)
+        dump_kwargs.setdefault('ensure_ascii', False)
+        with self.lock():
+            atomic_write_json(self.path, data, **dump_kwargs)
+            self._signature = self.signature()
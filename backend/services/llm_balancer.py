@@ -0,0 +1,190 @@
+"""
+Serveurs LLM virtuels « balanced » : un pool de serveurs identiques derrière
+un seul nom. Chaque requête est envoyée au membre le mieux classé selon la
+politique du pool, à partir des mesures prises sur les appels réels.
+
+Déclaration dans [llm_servers] :
+    pool = balanced|server1,server3|least_outstanding|llama3
+(membres à la place de l'URL, politique à la place de la clé d'API).
+"""
+import random
+import time
+from typing import AsyncGenerator, AsyncIterator, Dict, List, Optional
+
+from backend.config import config
+from backend.services.llm_failover import UpstreamError
+from backend.services.llm_health import CircuitBreaker, health_monitor
+
+BALANCED_TYPE = 'balanced'
+
+POLICIES = ('least_outstanding', 'ewma_latency', 'ewma_ttft')
+DEFAULT_POLICY = 'least_outstanding'
+
+def is_balanced(server_type: Optional[str]) -> bool:
+    return (server_type or '').lower() == BALANCED_TYPE
+
+def pool_members(members: str) -> List[str]:
+    """Member names from the url field of a balanced server."""
+    return [name.strip() for name in (members or '').split(',') if name.strip()]
+
+def pool_policy(policy: Optional[str]) -> str:
+    """Policy from the api_key field of a balanced server."""
+    policy = (policy or '').strip().lower()
+    return policy if policy in POLICIES else DEFAULT_POLICY
+
+class UpstreamStats:
+    """Live measurements for one server."""
+
+    __slots__ = ('outstanding', 'ewma_latency', 'ewma_ttft', 'error_rate', 'requests', 'failures')
+
+    def __init__(self):
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.ewma_ttft: Optional[float] = None
+        # Taux d'échec récent (moyenne mobile exponentielle, 0 à 1)
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        return {
+            'outstanding': self.outstanding,
+            'ewma_latency': round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            'ewma_ttft': round(self.ewma_ttft, 3) if self.ewma_ttft is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'requests': self.requests,
+            'failures': self.failures,
+        }
+
+class Measurement:
+    """One request in progress on a server."""
+
+    def __init__(self, balancer: 'LoadBalancer', server_name: str, probe: bool = False):
+        self._balancer = balancer
+        self.server_name = server_name
+        # Requête d'essai d'un disjoncteur demi-ouvert
+        self.probe = probe
+        self.started = time.monotonic()
+        self.ttft: Optional[float] = None
+        self.finished = False
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started
+            self._balancer._observe_ttft(self.server_name, self.ttft)
+
+    def finish(self, success: bool = True):
+        if not self.finished:
+            self.finished = True
+            self._balancer._finish(self, success)
+
+    def discard(self):
+        """End the request without recording it (cancelled by the caller)."""
+        if not self.finished:
+            self.finished = True
+            self._balancer._finish(self, None)
+
+class LoadBalancer:
+    """Ranks pool members by outstanding requests or EWMA latency / TTFT."""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self._stats: Dict[str, UpstreamStats] = {}
+
+    @classmethod
+    def from_config(cls) -> 'LoadBalancer':
+        return cls(alpha=config.getfloat('llm', 'balancer_ewma_alpha', 0.3))
+
+    def _get(self, server_name: str) -> UpstreamStats:
+        stats = self._stats.get(server_name)
+        if stats is None:
+            stats = self._stats[server_name] = UpstreamStats()
+        return stats
+
+    def _ewma(self, previous: Optional[float], value: float) -> float:
+        if previous is None:
+            return value
+        return self.alpha * value + (1 - self.alpha) * previous
+
+    # ----- Mesures -----
+
+    def start(self, server_name: str) -> Measurement:
+        """Count a request as outstanding on a server until finish().
+
+        Raises UpstreamError if the server's circuit breaker rejects it.
+        """
+        state = health_monitor.admit(server_name)
+        if state is None:
+            raise UpstreamError(f"{server_name} indisponible (circuit ouvert)", status=503)
+        stats = self._get(server_name)
+        stats.outstanding += 1
+        stats.requests += 1
+        return Measurement(self, server_name, probe=state == CircuitBreaker.HALF_OPEN)
+
+    def _observe_ttft(self, server_name: str, ttft: float):
+        stats = self._get(server_name)
+        stats.ewma_ttft = self._ewma(stats.ewma_ttft, ttft)
+
+    def _finish(self, measurement: Measurement, success: Optional[bool]):
+        stats = self._get(measurement.server_name)
+        stats.outstanding = max(0, stats.outstanding - 1)
+        if success is None:
+            if measurement.probe:
+                health_monitor.abandon(measurement.server_name)
+            return
+        health_monitor.observe(measurement.server_name, success)
+        stats.error_rate = self._ewma(stats.error_rate, 0.0 if success else 1.0)
+        if success:
+            latency = time.monotonic() - measurement.started
+            stats.ewma_latency = self._ewma(stats.ewma_latency, latency)
+        else:
+            stats.failures += 1
+
+    async def measured(self, server_name: str, chunks: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """Pass a stream through while measuring its TTFT and total latency."""
+        measurement = self.start(server_name)
+        try:
+            async for chunk in chunks:
+                measurement.first_token()
+                yield chunk
+        except Exception:
+            measurement.finish(success=False)
+            raise
+        except BaseException:
+            measurement.discard()
+            raise
+        measurement.finish()
+
+    # ----- Choix -----
+
+    def _score(self, server_name: str, policy: str) -> float:
+        stats = self._stats.get(server_name)
+        if stats is None:
+            return 0.0
+        if policy == 'least_outstanding':
+            return stats.outstanding
+        ewma = stats.ewma_ttft if policy == 'ewma_ttft' else stats.ewma_latency
+        if ewma is None:
+            # Membre jamais mesuré : l'essayer en priorité
+            return 0.0
+        # Pondérer par la charge en cours pour ne pas tout envoyer au plus rapide
+        return ewma * (stats.outstanding + 1)
+
+    def rank(self, members: List[str], policy: str = DEFAULT_POLICY) -> List[str]:
+        """Members ordered best first; ties are broken at random.
+
+        Members failing most of their recent requests go last.
+        """
+        return sorted(members, key=lambda name: (
+            self._failing(name), self._score(name, policy), random.random()
+        ))
+
+    def _failing(self, server_name: str) -> bool:
+        stats = self._stats.get(server_name)
+        return stats is not None and stats.error_rate > 0.5
+
+    def stats(self) -> Dict[str, Dict[str, Optional[float]]]:
+        return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+# Répartiteur partagé par les services du processus
+load_balancer = LoadBalancer.from_config()
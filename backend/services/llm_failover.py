@@ -0,0 +1,130 @@
+"""
+Bascule automatique entre serveurs LLM équivalents ([llm_failover]) avec
+nouvelles tentatives espacées (backoff exponentiel avec jitter). Une
+tentative n'est rejouée que tant qu'aucun token n'a été transmis.
+"""
+import asyncio
+import logging
+import random
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+from backend.config import config
+
+logger = logging.getLogger(__name__)
+
+class UpstreamError(Exception):
+    """Transient upstream failure (connection error, timeout, HTTP 429/5xx)."""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+def is_retryable_status(status: int) -> bool:
+    """HTTP statuses worth retrying on the same or another server."""
+    return status == 429 or status >= 500
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Errors of a non-streaming call worth retrying: the connection failed.
+
+    A timeout or a broken connection after the request was sent is not
+    retried: the server may have generated (or still be generating) the
+    answer, and a new attempt would pay for the whole generation again.
+    """
+    return isinstance(error, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError))
+
+class FailoverPolicy:
+    """Failover groups of equivalent servers and the retry schedule."""
+
+    def __init__(self, groups: Optional[Dict[str, List[str]]] = None,
+                 retries_per_server: int = 1, backoff_base: float = 0.25,
+                 backoff_max: float = 4.0):
+        self.groups = groups or {}
+        self.retries_per_server = retries_per_server
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # serveur -> groupe
+        self._group_of: Dict[str, str] = {}
+        for group, members in self.groups.items():
+            for member in members:
+                self._group_of.setdefault(member, group)
+
+    @classmethod
+    def from_config(cls) -> 'FailoverPolicy':
+        groups = {}
+        if config.config.has_section('llm_failover'):
+            for group, members in config.config.items('llm_failover'):
+                names = [name.strip() for name in members.split(',') if name.strip()]
+                if names:
+                    groups[group] = names
+        return cls(
+            groups=groups,
+            retries_per_server=config.getint('llm', 'retries_per_server', 1),
+            backoff_base=config.getint('llm', 'retry_backoff_ms', 250) / 1000,
+            backoff_max=config.getint('llm', 'retry_backoff_max_ms', 4000) / 1000,
+        )
+
+    def alternates(self, server_name: Optional[str]) -> List[str]:
+        """Other servers of the failover group of server_name, in configured order."""
+        group = self._group_of.get(server_name) if server_name else None
+        if group is None:
+            return []
+        return [name for name in self.groups[group] if name != server_name]
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number attempt (0-based)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _schedule(self, targets: Sequence[Any]):
+        for target in targets:
+            for _ in range(self.retries_per_server + 1):
+                yield target
+
+    async def call(self, targets: Sequence[Any], attempt: Callable[[Any], Awaitable[Any]],
+                   on_failure: Optional[Callable[[Any, UpstreamError], None]] = None) -> Tuple[Any, Any]:
+        """Await attempt(target) until one succeeds; return (result, target)."""
+        last_error = None
+        for number, target in enumerate(self._schedule(targets)):
+            if last_error is not None:
+                await asyncio.sleep(self.backoff_delay(number - 1))
+            try:
+                return await attempt(target), target
+            except UpstreamError as e:
+                last_error = e
+                logger.warning(f"LLM attempt failed on {_name(target)}: {e}")
+                if on_failure is not None:
+                    on_failure(target, e)
+        raise last_error or UpstreamError("Aucun serveur disponible")
+
+    async def stream(self, targets: Sequence[Any], attempt: Callable[[Any], AsyncIterator[str]],
+                     on_failure: Optional[Callable[[Any, UpstreamError], None]] = None) -> AsyncGenerator[str, None]:
+        """Stream attempt(target), moving on to the next attempt only before the first chunk."""
+        last_error = None
+        for number, target in enumerate(self._schedule(targets)):
+            if last_error is not None:
+                await asyncio.sleep(self.backoff_delay(number - 1))
+            started = False
+            try:
+                async for chunk in attempt(target):
+                    started = True
+                    yield chunk
+                return
+            except UpstreamError as e:
+                if started:
+                    raise
+                last_error = e
+                logger.warning(f"LLM stream failed on {_name(target)} before the first token: {e}")
+                if on_failure is not None:
+                    on_failure(target, e)
+        raise last_error or UpstreamError("Aucun serveur disponible")
+
+def _name(target: Any) -> str:
+    server = target[0] if isinstance(target, tuple) else target
+    if isinstance(server, dict):
+        return server.get('name') or server.get('url', '?')
+    return getattr(server, 'name', str(server))
+
+# Politique partagée par les services du processus
+failover_policy = FailoverPolicy.from_config()
@@ -0,0 +1,267 @@
+"""
+Surveillance de la santé des serveurs LLM : sondes périodiques en tâche de
+fond (intervalle adaptatif), statistiques glissantes et disjoncteurs qui
+écartent immédiatement du routage les serveurs en panne.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from backend.config import config
+from backend.services.model_catalog import model_catalog
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open after a cool-down.
+
+    While half-open, a single request is let through as a probe; the others
+    are rejected until its outcome closes or reopens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        # Requête d'essai en cours (demi-ouvert)
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Laisser passer une requête d'essai
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allows_requests(self) -> bool:
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self.probing)
+
+    def acquire(self) -> Optional[str]:
+        """Admit a request: the state it was admitted in, None if rejected."""
+        state = self.state
+        if state == self.HALF_OPEN:
+            if self.probing:
+                return None
+            self.probing = True
+        return state if state != self.OPEN else None
+
+    def release(self):
+        """The probe ended without outcome (cancelled): let another one through."""
+        self.probing = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.probing = False
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class ServerHealth:
+    """Rolling probe results and circuit breaker of one server."""
+
+    def __init__(self, window: int, breaker: CircuitBreaker, interval: float):
+        self.probes: Deque[Tuple[bool, Optional[float]]] = deque(maxlen=window)
+        self.breaker = breaker
+        self.interval = interval
+        self.next_probe = 0.0
+        self.last_checked: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def success_rate(self) -> Optional[float]:
+        if not self.probes:
+            return None
+        return sum(1 for ok, _ in self.probes if ok) / len(self.probes)
+
+    @property
+    def avg_latency(self) -> Optional[float]:
+        latencies = [latency for ok, latency in self.probes if ok and latency is not None]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+    def as_dict(self) -> Dict[str, Any]:
+        success_rate = self.success_rate
+        avg_latency = self.avg_latency
+        return {
+            'circuit': self.breaker.state,
+            'success_rate': round(success_rate, 3) if success_rate is not None else None,
+            'avg_latency': round(avg_latency, 3) if avg_latency is not None else None,
+            'probes': len(self.probes),
+            'consecutive_failures': self.breaker.consecutive_failures,
+            'last_checked': self.last_checked,
+            'last_error': self.last_error,
+            'probe_interval': self.interval,
+        }
+
+class HealthMonitor:
+    """Background prober of the configured LLM servers."""
+
+    def __init__(self, enabled: bool = True, interval: float = 15.0, max_interval: float = 120.0,
+                 failure_threshold: int = 3, reset_timeout: float = 30.0, window: int = 20):
+        self.enabled = enabled
+        self.interval = interval
+        self.max_interval = max_interval
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.window = window
+        self._servers: Dict[str, ServerHealth] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls) -> 'HealthMonitor':
+        return cls(
+            enabled=config.getboolean('llm_health', 'enabled', True),
+            interval=config.getint('llm_health', 'interval', 15),
+            max_interval=config.getint('llm_health', 'max_interval', 120),
+            failure_threshold=config.getint('llm_health', 'failure_threshold', 3),
+            reset_timeout=config.getint('llm_health', 'reset_timeout', 30),
+            window=config.getint('llm_health', 'window', 20),
+        )
+
+    def health(self, server_name: str) -> ServerHealth:
+        health = self._servers.get(server_name)
+        if health is None:
+            health = self._servers[server_name] = ServerHealth(
+                self.window, CircuitBreaker(self.failure_threshold, self.reset_timeout), self.interval
+            )
+        return health
+
+    def is_routable(self, server_name: Optional[str]) -> bool:
+        """False while the server's circuit is open; unknown servers are routable."""
+        health = self._servers.get(server_name) if server_name else None
+        return health is None or health.breaker.allows_requests()
+
+    def admit(self, server_name: str) -> Optional[str]:
+        """Admit a real request to a server: the circuit state it was admitted
+        in, None if rejected (open, or half-open with its probe in flight)."""
+        health = self._servers.get(server_name)
+        return health.breaker.acquire() if health is not None else CircuitBreaker.CLOSED
+
+    def abandon(self, server_name: str):
+        """A probe admitted by admit() was cancelled before its outcome."""
+        health = self._servers.get(server_name)
+        if health is not None:
+            health.breaker.release()
+
+    def describe(self, server_name: str) -> Dict[str, Any]:
+        health = self._servers.get(server_name)
+        return health.as_dict() if health is not None else {'circuit': CircuitBreaker.CLOSED}
+
+    # ----- Résultats -----
+
+    def observe(self, server_name: str, success: bool, error: Optional[str] = None):
+        """Outcome of a real request: feeds the circuit breaker only."""
+        health = self.health(server_name)
+        if success:
+            health.breaker.record_success()
+        else:
+            health.breaker.record_failure()
+            health.last_error = error or health.last_error
+            # Vérifier rapidement si le serveur est tombé
+            health.interval = self.interval
+            health.next_probe = min(health.next_probe, time.monotonic() + self.interval)
+
+    def record_probe(self, server_name: str, success: bool, latency: Optional[float] = None,
+                     error: Optional[str] = None):
+        health = self.health(server_name)
+        health.probes.append((success, latency))
+        health.last_checked = time.time()
+        if success:
+            health.breaker.record_success()
+            health.last_error = None
+            # Serveur stable : espacer les sondes
+            health.interval = min(self.max_interval, health.interval * 2)
+        else:
+            health.breaker.record_failure()
+            health.last_error = error
+            health.interval = self.interval
+        health.next_probe = time.monotonic() + health.interval
+
+    # ----- Sondes -----
+
+    async def probe(self, manager, server) -> bool:
+        """Probe one server through manager.test_server and update is_available."""
+        result = await manager.test_server(server.name)
+        success = result.status == "success"
+        self.record_probe(
+            server.name, success, result.response_time,
+            None if success else result.message
+        )
+        server.is_available = success and self.is_routable(server.name)
+        if success:
+            model_catalog.update(server.name, result.available_models)
+        return success
+
+    async def probe_due(self, manager):
+        """Probe every server whose next probe is due, concurrently."""
+        now = time.monotonic()
+        due = [
+            server for server in manager.get_servers().values()
+            if server.type in ('ollama', 'openai') and self.health(server.name).next_probe <= now
+        ]
+        if due:
+            results = await asyncio.gather(
+                *(self.probe(manager, server) for server in due), return_exceptions=True
+            )
+            for server, result in zip(due, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"Health probe failed for {server.name}: {result}")
+                    self.record_probe(server.name, False, error=str(result))
+                    server.is_available = False
+
+        # Un pool est disponible si l'un de ses membres l'est
+        for server in manager.get_servers().values():
+            members = manager.get_pool_members(server)
+            if members:
+                server.is_available = any(
+                    member.is_available and self.is_routable(member.name) for member in members
+                )
+
+    async def run(self, manager):
+        while True:
+            try:
+                await self.probe_due(manager)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Health monitor error: {e}")
+            next_probe = min(
+                (health.next_probe for health in self._servers.values()),
+                default=time.monotonic() + self.interval
+            )
+            await asyncio.sleep(max(1.0, next_probe - time.monotonic()))
+
+    def start(self, manager):
+        """Start the background prober (at application startup)."""
+        if self.enabled and self._task is None:
+            self._task = asyncio.ensure_future(self.run(manager))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: health.as_dict() for name, health in self._servers.items()}
+
+# Surveillance partagée par les services du processus
+health_monitor = HealthMonitor.from_config()
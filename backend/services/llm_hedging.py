@@ -0,0 +1,215 @@
+"""
+Requêtes couvertes ([llm_hedging]) : si le premier token d'un flux tarde
+au-delà du p95 observé pour ce modèle, une copie de la requête part vers un
+serveur équivalent (même modèle, membre du pool ou serveur de secours). Le
+premier flux à produire un token est servi, l'autre est annulé.
+
+Un budget en jetons borne la charge ajoutée : chaque requête crédite
+budget_percent % d'une copie (au plus budget_burst copies d'avance).
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence
+
+from backend.config import config
+
+logger = logging.getLogger(__name__)
+
+class RequestClock:
+    """Target and send time of the upstream request a stream is waiting on.
+
+    The attempts of the stream call sent() once their request leaves, after
+    the wait for a slot and the failover backoff, so that neither counts in
+    the hedging delay nor in the observed TTFT.
+    """
+
+    def __init__(self):
+        self.target: Any = None
+        self.sent_at: Optional[float] = None
+
+    def sent(self, target: Any):
+        self.target = target
+        self.sent_at = time.monotonic()
+
+class Hedger:
+    """Per-model TTFT thresholds and the race between a stalled stream and its copy."""
+
+    def __init__(self, enabled: bool = False, percentile: float = 95.0, window: int = 200,
+                 min_samples: int = 20, min_delay: float = 0.25, max_delay: float = 10.0,
+                 budget: float = 0.1, burst: float = 3.0):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.burst = burst
+        self.credits = 0.0
+        self._ttfts: Dict[str, Deque[float]] = {}
+        self.counters = {'requests': 0, 'hedged': 0, 'hedge_won': 0, 'over_budget': 0}
+
+    @classmethod
+    def from_config(cls) -> 'Hedger':
+        return cls(
+            enabled=config.getboolean('llm_hedging', 'enabled', False),
+            percentile=config.getfloat('llm_hedging', 'percentile', 95.0),
+            window=config.getint('llm_hedging', 'window', 200),
+            min_samples=config.getint('llm_hedging', 'min_samples', 20),
+            min_delay=config.getint('llm_hedging', 'min_delay_ms', 250) / 1000,
+            max_delay=config.getint('llm_hedging', 'max_delay_ms', 10000) / 1000,
+            budget=config.getfloat('llm_hedging', 'budget_percent', 10.0) / 100,
+            burst=config.getfloat('llm_hedging', 'budget_burst', 3.0),
+        )
+
+    # ----- Seuils -----
+
+    def observe(self, model: str, ttft: float):
+        samples = self._ttfts.get(model)
+        if samples is None:
+            samples = self._ttfts[model] = deque(maxlen=self.window)
+        samples.append(ttft)
+
+    def threshold(self, model: str) -> Optional[float]:
+        """Delay before hedging a request to model, None until enough TTFTs are known."""
+        samples = self._ttfts.get(model)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        rank = min(len(ordered) - 1, max(0, math.ceil(self.percentile / 100 * len(ordered)) - 1))
+        return min(self.max_delay, max(self.min_delay, ordered[rank]))
+
+    def backup(self, targets: Sequence[Any], current: Any = None) -> Optional[Any]:
+        """Target for a copy of a request to current (targets[0] by default): the
+        first one serving the same model after the next target of the failover
+        chain, which a failure of current would already fall back to."""
+        if not self.enabled or not targets:
+            return None
+        current = current if current is not None else targets[0]
+        position = targets.index(current) if current in targets else 0
+        return next((target for target in targets[position + 2:] if target[1] == current[1]), None)
+
+    # ----- Budget -----
+
+    def _earn(self):
+        self.counters['requests'] += 1
+        self.credits = min(self.burst, self.credits + self.budget)
+
+    def _spend(self) -> bool:
+        if self.credits < 1:
+            self.counters['over_budget'] += 1
+            return False
+        self.credits -= 1
+        self.counters['hedged'] += 1
+        return True
+
+    # ----- Course -----
+
+    async def stream(self, targets: Sequence[Any], primary: AsyncIterator[str],
+                     hedge: Callable[[Any], AsyncIterator[str]],
+                     trace: Optional[Dict[str, Any]] = None,
+                     clock: Optional[RequestClock] = None) -> AsyncGenerator[str, None]:
+        """Chunks of primary (a stream over targets), or of its copy if that answers first.
+
+        hedge(target) streams from the backup target; it is started once the
+        upstream request of primary, as reported to clock, has produced
+        nothing for the model's threshold and the budget allows it. Without a
+        clock, the delay runs from the call. The losing stream is closed,
+        which aborts its upstream request. trace, if given, receives 'hedged'
+        and 'hedge_won'.
+        """
+        if not self.enabled or not targets:
+            async for chunk in primary:
+                yield chunk
+            return
+
+        if clock is None:
+            clock = RequestClock()
+            clock.sent(targets[0])
+        self._earn()
+        hedged = False
+        start = time.monotonic()
+        primary = primary.__aiter__()
+        contenders: Dict[asyncio.Future, AsyncIterator[str]] = {
+            asyncio.ensure_future(primary.__anext__()): primary
+        }
+        finished: List[tuple] = []  # (flux, exception) terminés sans token
+        closing: List[AsyncIterator[str]] = [primary]
+        winner = None
+        first = None
+        try:
+            while winner is None and contenders:
+                current = clock.target or targets[0]
+                threshold = None if hedged else self.threshold(current[1])
+                delay = threshold
+                if threshold is not None and clock.sent_at is not None:
+                    delay = max(0.0, clock.sent_at + threshold - time.monotonic())
+                done, _ = await asyncio.wait(contenders, timeout=delay,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Requête pas encore envoyée (attente d'une place) ou renvoyée
+                    # entre-temps (bascule) : le délai repart de son envoi
+                    if clock.sent_at is None or time.monotonic() - clock.sent_at < threshold:
+                        continue
+                    # Une seule copie par requête
+                    hedged = True
+                    backup = self.backup(targets, current)
+                    if backup is not None and self._spend():
+                        logger.info(f"No token from {current[1]} after "
+                                    f"{time.monotonic() - clock.sent_at:.2f}s, hedging")
+                        copy = hedge(backup).__aiter__()
+                        closing.append(copy)
+                        contenders[asyncio.ensure_future(copy.__anext__())] = copy
+                        if trace is not None:
+                            trace['hedged'] = True
+                    continue
+                for future in done:
+                    chunks = contenders.pop(future)
+                    if winner is None and future.exception() is None:
+                        winner, first = chunks, future.result()
+                    elif future.exception() is not None:
+                        finished.append((chunks, future.exception()))
+                    # Deux premiers tokens simultanés : le second flux est fermé plus bas
+
+            if winner is None:
+                # Aucun flux n'a rien produit : issue du flux principal
+                error = next((e for chunks, e in finished if chunks is primary), finished[0][1])
+                if not isinstance(error, StopAsyncIteration):
+                    raise error
+                return
+
+            # Copie gagnante : le TTFT du flux abandonné dépasse au moins ce délai
+            current = clock.target or targets[0]
+            self.observe(current[1], time.monotonic() - (clock.sent_at or start))
+            if winner is not primary:
+                self.counters['hedge_won'] += 1
+                if trace is not None:
+                    trace['hedge_won'] = True
+            yield first
+            async for chunk in winner:
+                yield chunk
+        finally:
+            for future in contenders:
+                future.cancel()
+            await asyncio.gather(*contenders, return_exceptions=True)
+            for chunks in closing:
+                aclose = getattr(chunks, 'aclose', None)
+                if aclose is not None:
+                    await aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'enabled': self.enabled,
+            'credits': round(self.credits, 2),
+            'thresholds': {
+                model: round(threshold, 3) for model, threshold in
+                ((model, self.threshold(model)) for model in self._ttfts) if threshold is not None
+            },
+        }
+
+# Politique partagée par les services du processus
+hedger = Hedger.from_config()
@@ -0,0 +1,246 @@
+"""
+Protocoles des serveurs LLM : chemins d'API, construction des requêtes et
+lecture des réponses en streaming (NDJSON d'Ollama, SSE compatible OpenAI).
+
+Les flux sont lus par blocs bruts et découpés en lignes dans un tampon, ce
+qui gère les lignes coupées entre deux lectures TCP. Chaque réponse est
+traduite en événements typés (token, usage, finish, error).
+"""
+import asyncio
+import json
+import logging
+from typing import Any, AsyncGenerator, Dict, List, NamedTuple, Optional
+
+from backend.services.llm_failover import UpstreamError, is_retryable_status
+
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSONDecodeError = (orjson.JSONDecodeError, json.JSONDecodeError)
+except ImportError:
+    json_loads = json.loads
+    JSONDecodeError = (json.JSONDecodeError,)
+
+logger = logging.getLogger(__name__)
+
+# Types d'événements
+TOKEN = 'token'
+USAGE = 'usage'
+FINISH = 'finish'
+ERROR = 'error'
+
+class StreamEvent(NamedTuple):
+    """One decoded event of an upstream stream."""
+    kind: str
+    text: str = ''
+    data: Optional[Dict[str, Any]] = None
+    status: Optional[int] = None
+
+class LineBuffer:
+    """Split raw chunks into complete lines, keeping partial lines for the next feed."""
+
+    def __init__(self):
+        self._pending = b''
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        data = self._pending + chunk
+        lines = data.split(b'\n')
+        self._pending = lines.pop()
+        return [line.rstrip(b'\r') for line in lines]
+
+    def flush(self) -> List[bytes]:
+        """Remaining partial line once the stream is over."""
+        pending, self._pending = self._pending.rstrip(b'\r'), b''
+        return [pending] if pending.strip() else []
+
+class NDJSONParser:
+    """Incremental parser of newline-delimited JSON."""
+
+    def __init__(self):
+        self._lines = LineBuffer()
+
+    def _decode(self, lines: List[bytes]) -> List[Any]:
+        objects = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                objects.append(json_loads(line))
+            except JSONDecodeError:
+                logger.debug(f"Ignoring malformed NDJSON line: {line[:200]!r}")
+        return objects
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        return self._decode(self._lines.feed(chunk))
+
+    def flush(self) -> List[Any]:
+        return self._decode(self._lines.flush())
+
+class SSEParser:
+    """Incremental parser of server-sent events; yields the data payload of each event."""
+
+    DONE = '[DONE]'
+
+    def __init__(self):
+        self._lines = LineBuffer()
+        self._data: List[bytes] = []
+
+    def _decode(self, lines: List[bytes]) -> List[str]:
+        payloads = []
+        for line in lines:
+            if not line:
+                # Ligne vide : fin de l'événement
+                if self._data:
+                    payloads.append(b'\n'.join(self._data).decode('utf-8'))
+                    self._data = []
+            elif line.startswith(b'data:'):
+                value = line[5:]
+                self._data.append(value[1:] if value.startswith(b' ') else value)
+            # Commentaires (":") et autres champs (event, id, retry) ignorés
+        return payloads
+
+    def feed(self, chunk: bytes) -> List[str]:
+        return self._decode(self._lines.feed(chunk))
+
+    def flush(self) -> List[str]:
+        return self._decode(self._lines.flush() + [b''])
+
+class OllamaGenerateProtocol:
+    """Native Ollama /api/generate endpoint (NDJSON stream)."""
+
+    path = '/api/generate'
+
+    def url(self, base_url: str) -> str:
+        return f"{base_url.rstrip('/')}{self.path}"
+
+    def headers(self, api_key: Optional[str] = None) -> Dict[str, str]:
+        return {}
+
+    def payload(self, model: str, prompt: str, stream: bool, **options) -> Dict[str, Any]:
+        payload = {"model": model, "prompt": prompt, "stream": stream}
+        if options:
+            payload["options"] = options
+        return payload
+
+    def completion_text(self, data: Dict[str, Any]) -> str:
+        return data.get('response', '')
+
+    def parser(self) -> NDJSONParser:
+        return NDJSONParser()
+
+    def events(self, items: List[Any]) -> List[StreamEvent]:
+        events = []
+        for data in items:
+            if not isinstance(data, dict):
+                continue
+            if 'error' in data:
+                events.append(StreamEvent(ERROR, text=str(data['error'])))
+                continue
+            if data.get('response'):
+                events.append(StreamEvent(TOKEN, text=data['response']))
+            if data.get('done'):
+                if 'eval_count' in data or 'prompt_eval_count' in data:
+                    events.append(StreamEvent(USAGE, data={
+                        'prompt_tokens': data.get('prompt_eval_count'),
+                        'completion_tokens': data.get('eval_count'),
+                    }))
+                events.append(StreamEvent(FINISH, text=data.get('done_reason') or 'stop'))
+        return events
+
+class OpenAIChatProtocol:
+    """OpenAI-compatible chat completions endpoint (SSE stream)."""
+
+    def __init__(self, path: str = '/v1/chat/completions'):
+        self.path = path
+
+    def url(self, base_url: str) -> str:
+        return f"{base_url.rstrip('/')}{self.path}"
+
+    def headers(self, api_key: Optional[str] = None) -> Dict[str, str]:
+        headers = {'Content-Type': 'application/json'}
+        if api_key:
+            headers['Authorization'] = f"Bearer {api_key}"
+        return headers
+
+    def payload(self, model: str, prompt: str, stream: bool, **options) -> Dict[str, Any]:
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": stream,
+        }
+        payload.update({key: value for key, value in options.items() if value is not None})
+        return payload
+
+    def completion_text(self, data: Dict[str, Any]) -> str:
+        return data['choices'][0]['message']['content']
+
+    def parser(self) -> SSEParser:
+        return SSEParser()
+
+    def events(self, items: List[str]) -> List[StreamEvent]:
+        events = []
+        for payload in items:
+            if payload == SSEParser.DONE:
+                continue
+            try:
+                data = json_loads(payload)
+            except JSONDecodeError:
+                continue
+            if not isinstance(data, dict):
+                continue
+            if data.get('error'):
+                error = data['error']
+                events.append(StreamEvent(ERROR, text=str(error.get('message', error) if isinstance(error, dict) else error)))
+                continue
+            choices = data.get('choices') or []
+            if choices:
+                choice = choices[0]
+                content = (choice.get('delta') or {}).get('content')
+                if content:
+                    events.append(StreamEvent(TOKEN, text=content))
+            if data.get('usage'):
+                events.append(StreamEvent(USAGE, data=data['usage']))
+            if choices and choices[0].get('finish_reason'):
+                events.append(StreamEvent(FINISH, text=choices[0]['finish_reason']))
+        return events
+
+# Chemins relatifs à l'URL du serveur : les serveurs système sont déclarés
+# sans /v1, ceux de LLMServerManager avec (y compris Ollama, appelé via son
+# API compatible OpenAI)
+OLLAMA_GENERATE = OllamaGenerateProtocol()
+OPENAI_CHAT = OpenAIChatProtocol('/v1/chat/completions')
+OPENAI_CHAT_V1_BASE = OpenAIChatProtocol('/chat/completions')
+
+def protocol_for(server_type: str):
+    """Protocol of a system server (URL without /v1)."""
+    return OLLAMA_GENERATE if server_type.lower() == 'ollama' else OPENAI_CHAT
+
+async def stream_events(session, protocol, url: str, headers: Dict[str, str],
+                        payload: Dict[str, Any]) -> AsyncGenerator[StreamEvent, None]:
+    """POST a streaming request and yield its decoded events.
+
+    Retryable HTTP statuses raise UpstreamError; other errors are yielded as
+    a single ERROR event carrying the status and the response body. Closing
+    the generator early aborts the upstream request.
+    """
+    async with session.post(url, json=payload, headers=headers) as response:
+        if response.status != 200:
+            error_text = await response.text()
+            logger.error(f"LLM request failed: {response.status} - {error_text}")
+            if is_retryable_status(response.status):
+                raise UpstreamError(f"Erreur HTTP {response.status}", status=response.status)
+            yield StreamEvent(ERROR, text=error_text, status=response.status)
+            return
+
+        parser = protocol.parser()
+        try:
+            async for chunk in response.content.iter_any():
+                for event in protocol.events(parser.feed(chunk)):
+                    yield event
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client parti ou exécution annulée : couper la connexion pour que
+            # le serveur arrête la génération, sans attendre la fin du corps
+            response.close()
+            raise
+        for event in protocol.events(parser.flush()):
+            yield event
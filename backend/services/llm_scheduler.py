@@ -0,0 +1,178 @@
+"""
+Contrôle d'admission des appels LLM : nombre maximal de générations
+simultanées par serveur et modèle, avec une file d'attente bornée. Les
+limites valent pour un processus, pas pour l'ensemble des workers.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional, Tuple
+
+from backend.config import config
+
+logger = logging.getLogger(__name__)
+
+AdmissionKey = Tuple[str, str]
+
+class QueueFullError(Exception):
+    """The wait queue of an upstream is full: the caller should retry later."""
+
+    def __init__(self, key: AdmissionKey, retry_after: int):
+        super().__init__(f"File d'attente pleine pour {key[0]} ({key[1]})")
+        self.key = key
+        self.retry_after = retry_after
+
+class _Upstream:
+    __slots__ = ('limit', 'in_flight', 'waiting')
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting: Deque['Ticket'] = deque()
+
+class Ticket:
+    """A place in an upstream queue; becomes a slot once granted."""
+
+    def __init__(self, scheduler: 'UpstreamScheduler', key: AdmissionKey):
+        self._scheduler = scheduler
+        self.key = key
+        self.granted = False
+        self.released = False
+        # True once a background generation owns the slot and will release it
+        self.transferred = False
+        # Cibles classées lors de la réservation (la première est celle de la
+        # place) : la requête part là où sa place a été prise
+        self.route: Optional[List[Any]] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def position(self) -> int:
+        """1-based position in the queue, 0 once the slot is granted."""
+        if self.granted:
+            return 0
+        return self._scheduler._position(self)
+
+    def _notify(self):
+        self._changed.set()
+
+    async def wait(self):
+        """Wait until the slot is granted."""
+        while not self.granted:
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def positions(self) -> AsyncGenerator[int, None]:
+        """Yield the queue position each time it changes, until the slot is granted."""
+        last = None
+        while not self.granted:
+            position = self.position
+            if position != last:
+                last = position
+                yield position
+            self._changed.clear()
+            await self._changed.wait()
+
+    def release(self):
+        """Give the slot back, or leave the queue if it was never granted."""
+        if not self.released:
+            self.released = True
+            self._scheduler._release(self)
+
+    def transfer(self):
+        """Hand the slot over to a generation that outlives the caller."""
+        self.transferred = True
+
+    def abandon(self):
+        """Release the slot unless it was transferred to a running generation."""
+        if not self.transferred:
+            self.release()
+
+    async def __aenter__(self) -> 'Ticket':
+        try:
+            await self.wait()
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+class UpstreamScheduler:
+    """Per server/model concurrency limit with a bounded FIFO wait queue."""
+
+    def __init__(self, max_in_flight: int = 4, max_queue: int = 32, retry_after: int = 10):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._upstreams: Dict[AdmissionKey, _Upstream] = {}
+
+    @classmethod
+    def from_config(cls) -> 'UpstreamScheduler':
+        return cls(
+            max_in_flight=config.getint('llm', 'max_in_flight', 4),
+            max_queue=config.getint('llm', 'max_queue', 32),
+            retry_after=config.getint('llm', 'queue_retry_after', 10),
+        )
+
+    @staticmethod
+    def key(url: str, model: Optional[str]) -> AdmissionKey:
+        return (url.rstrip('/'), model or '')
+
+    def reserve(self, url: str, model: Optional[str]) -> Ticket:
+        """Take a slot or a queue position, failing fast when the queue is full."""
+        key = self.key(url, model)
+        upstream = self._upstreams.get(key)
+        if upstream is None:
+            upstream = self._upstreams[key] = _Upstream(self.max_in_flight)
+
+        ticket = Ticket(self, key)
+        if upstream.in_flight < upstream.limit and not upstream.waiting:
+            upstream.in_flight += 1
+            ticket.granted = True
+        elif len(upstream.waiting) < self.max_queue:
+            upstream.waiting.append(ticket)
+        else:
+            raise QueueFullError(key, self.retry_after)
+        return ticket
+
+    def _position(self, ticket: Ticket) -> int:
+        upstream = self._upstreams[ticket.key]
+        try:
+            return upstream.waiting.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def _release(self, ticket: Ticket):
+        upstream = self._upstreams[ticket.key]
+        if ticket.granted:
+            upstream.in_flight -= 1
+        else:
+            try:
+                upstream.waiting.remove(ticket)
+            except ValueError:
+                pass
+
+        while upstream.waiting and upstream.in_flight < upstream.limit:
+            next_ticket = upstream.waiting.popleft()
+            next_ticket.granted = True
+            upstream.in_flight += 1
+            next_ticket._notify()
+
+        # Les positions des suivants ont changé
+        for waiting in upstream.waiting:
+            waiting._notify()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """In-flight and queued counts per server/model."""
+        return {
+            f"{url}|{model}": {
+                'in_flight': upstream.in_flight,
+                'queued': len(upstream.waiting),
+                'limit': upstream.limit,
+            }
+            for (url, model), upstream in self._upstreams.items()
+        }
+
+# Ordonnanceur partagé par tous les appels LLM du processus
+llm_scheduler = UpstreamScheduler.from_config()
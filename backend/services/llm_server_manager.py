@@ -7,9 +7,14 @@ from datetime import datetime
 
 from backend.config import config
 from backend.models import LLMServerConfig, LLMServerTest
+from backend.services.upstream_client import connection_manager
+from backend.services.llm_balancer import is_balanced, pool_members
 
 logger = logging.getLogger(__name__)
 
+# Les tests de connectivité gardent un délai court, indépendant de [llm] timeout
+TEST_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
 class LLMServerManager:
     """Service pour gérer les serveurs LLM multiples."""
     
@@ -78,6 +83,15 @@ class LLMServerManager:
         """Retourne un serveur spécifique."""
         return self.servers.get(server_name)
     
+    def get_pool_members(self, server: LLMServerConfig) -> List[LLMServerConfig]:
+        """Retourne les serveurs membres d'un pool « balanced » (sans pools imbriqués)."""
+        members = []
+        for name in pool_members(server.url):
+            member = self.servers.get(name)
+            if member and not is_balanced(member.type):
+                members.append(member)
+        return members
+    
     async def test_server(self, server_name: str) -> LLMServerTest:
         """Teste la connectivité d'un serveur LLM."""
         server = self.get_server(server_name)
@@ -95,6 +109,8 @@ class LLMServerManager:
                 return await self._test_ollama_server(server, start_time)
             elif server.type == 'openai':
                 return await self._test_openai_server(server, start_time)
+            elif is_balanced(server.type):
+                return await self._test_pool(server, start_time)
             else:
                 return LLMServerTest(
                     server_name=server_name,
@@ -119,36 +135,36 @@ class LLMServerManager:
     
     async def _test_ollama_server(self, server: LLMServerConfig, start_time: float) -> LLMServerTest:
         """Teste un serveur Ollama."""
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            # Test de version (endpoint de santé)
-            version_url = server.url.replace('/v1', '') + '/api/version'
-            async with session.get(version_url) as response:
-                if response.status == 200:
-                    # Récupération des modèles
-                    models_url = server.url.replace('/v1', '') + '/api/tags'
-                    models = []
-                    try:
-                        async with session.get(models_url) as models_response:
-                            if models_response.status == 200:
-                                data = await models_response.json()
-                                models = [model['name'] for model in data.get('models', [])]
-                    except:
-                        pass
-                    
-                    return LLMServerTest(
-                        server_name=server.name,
-                        status="success",
-                        message="Connexion réussie",
-                        response_time=time.time() - start_time,
-                        available_models=models
-                    )
-                else:
-                    return LLMServerTest(
-                        server_name=server.name,
-                        status="error",
-                        message=f"Erreur HTTP {response.status}",
-                        response_time=time.time() - start_time
-                    )
+        session = connection_manager.session(server.url)
+        # Test de version (endpoint de santé)
+        version_url = server.url.replace('/v1', '') + '/api/version'
+        async with session.get(version_url, timeout=TEST_TIMEOUT) as response:
+            if response.status == 200:
+                # Récupération des modèles
+                models_url = server.url.replace('/v1', '') + '/api/tags'
+                models = []
+                try:
+                    async with session.get(models_url, timeout=TEST_TIMEOUT) as models_response:
+                        if models_response.status == 200:
+                            data = await models_response.json()
+                            models = [model['name'] for model in data.get('models', [])]
+                except:
+                    pass
+                
+                return LLMServerTest(
+                    server_name=server.name,
+                    status="success",
+                    message="Connexion réussie",
+                    response_time=time.time() - start_time,
+                    available_models=models
+                )
+            else:
+                return LLMServerTest(
+                    server_name=server.name,
+                    status="error",
+                    message=f"Erreur HTTP {response.status}",
+                    response_time=time.time() - start_time
+                )
     
     async def _test_openai_server(self, server: LLMServerConfig, start_time: float) -> LLMServerTest:
         """Teste un serveur compatible OpenAI."""
@@ -158,32 +174,51 @@ class LLMServerManager:
         if server.api_key:
             headers['Authorization'] = f'Bearer {server.api_key}'
         
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            # Test avec endpoint models
-            models_url = f"{server.url}/models"
-            async with session.get(models_url, headers=headers) as response:
-                if response.status == 200:
-                    models = []
-                    try:
-                        data = await response.json()
-                        models = [model['id'] for model in data.get('data', [])]
-                    except:
-                        models = [server.default_model]
-                    
-                    return LLMServerTest(
-                        server_name=server.name,
-                        status="success",
-                        message="Connexion réussie",
-                        response_time=time.time() - start_time,
-                        available_models=models
-                    )
-                else:
-                    return LLMServerTest(
-                        server_name=server.name,
-                        status="error",
-                        message=f"Erreur HTTP {response.status}",
-                        response_time=time.time() - start_time
-                    )
+        session = connection_manager.session(server.url)
+        # Test avec endpoint models
+        models_url = f"{server.url}/models"
+        async with session.get(models_url, headers=headers, timeout=TEST_TIMEOUT) as response:
+            if response.status == 200:
+                models = []
+                try:
+                    data = await response.json()
+                    models = [model['id'] for model in data.get('data', [])]
+                except:
+                    models = [server.default_model]
+                
+                return LLMServerTest(
+                    server_name=server.name,
+                    status="success",
+                    message="Connexion réussie",
+                    response_time=time.time() - start_time,
+                    available_models=models
+                )
+            else:
+                return LLMServerTest(
+                    server_name=server.name,
+                    status="error",
+                    message=f"Erreur HTTP {response.status}",
+                    response_time=time.time() - start_time
+                )
+    
+    async def _test_pool(self, server: LLMServerConfig, start_time: float) -> LLMServerTest:
+        """Teste les membres d'un pool : disponible si au moins un membre l'est."""
+        members = self.get_pool_members(server)
+        results = await asyncio.gather(*(self.test_server(member.name) for member in members))
+        available = [result for result in results if result.status == "success"]
+        models = []
+        for result in available:
+            for model in result.available_models:
+                if model not in models:
+                    models.append(model)
+        
+        return LLMServerTest(
+            server_name=server.name,
+            status="success" if available else "error",
+            message=f"{len(available)}/{len(members)} membre(s) disponible(s)",
+            response_time=time.time() - start_time,
+            available_models=models
+        )
     
     async def get_models(self, server_name: str) -> List[str]:
         """Récupère la liste des modèles disponibles pour un serveur."""
@@ -221,6 +256,9 @@ class LLMServerManager:
     
     def get_default_server(self) -> Optional[str]:
         """Retourne le nom du serveur par défaut."""
+        default_server = config.get('llm', 'default_server')
+        if default_server and default_server in self.servers:
+            return default_server
         if 'server1' in self.servers:
             return 'server1'
         elif self.servers:
@@ -9,6 +9,14 @@ import re
 from backend.config import get_llm_config, get_features_config
 from backend.models import LLMRequest, LLMResponse, ConfidentialityLevel
 from .llm_server_manager import LLMServerManager
+from .upstream_client import connection_manager
+from .llm_scheduler import QueueFullError, Ticket, llm_scheduler
+from .llm_failover import UpstreamError, failover_policy, is_retryable_error, is_retryable_status
+from .llm_balancer import is_balanced, load_balancer, pool_policy
+from .llm_health import health_monitor
+from .llm_hedging import RequestClock, hedger
+from .model_catalog import model_catalog
+from .llm_protocol import ERROR, OPENAI_CHAT_V1_BASE, TOKEN, json_loads, stream_events
 
 logger = logging.getLogger(__name__)
 
@@ -22,35 +30,83 @@ class LLMService:
         
     async def _make_openai_request(self, url: str, headers: Dict[str, str], 
                                   payload: Dict[str, Any]) -> AsyncGenerator[str, None]:
-        """Make streaming request to OpenAI-compatible endpoint."""
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as response:
+        """Make request to OpenAI-compatible endpoint (streamed or not)."""
+        session = connection_manager.session(url)
+        if not payload.get('stream'):
+            async with session.post(url, headers=headers, json=payload,
+                                    timeout=connection_manager.request_timeout) as response:
                 if response.status != 200:
                     error_text = await response.text()
                     logger.error(f"LLM request failed: {response.status} - {error_text}")
+                    if is_retryable_status(response.status):
+                        raise UpstreamError(f"{response.status} - {error_text}", status=response.status)
                     yield f"Erreur: {response.status} - {error_text}"
                     return
-                
-                async for line in response.content:
-                    line = line.decode('utf-8').strip()
-                    if line.startswith('data: '):
-                        data = line[6:]  # Remove 'data: ' prefix
-                        if data == '[DONE]':
-                            break
-                        
-                        try:
-                            json_data = json.loads(data)
-                            if 'choices' in json_data and json_data['choices']:
-                                delta = json_data['choices'][0].get('delta', {})
-                                content = delta.get('content', '')
-                                if content:
-                                    yield content
-                        except json.JSONDecodeError:
-                            continue
+                data = await response.json(loads=json_loads)
+                yield OPENAI_CHAT_V1_BASE.completion_text(data)
+            return
+        
+        async for event in stream_events(session, OPENAI_CHAT_V1_BASE, url, headers, payload):
+            if event.kind == TOKEN:
+                yield event.text
+            elif event.kind == ERROR:
+                if event.status is not None:
+                    yield f"Erreur: {event.status} - {event.text}"
+                else:
+                    yield f"Erreur: {event.text}"
+
+    def reserve(self, server_name: Optional[str], model: Optional[str] = None) -> Optional[Ticket]:
+        """Reserve a slot on a server before streaming (None if the server is unknown).
+        
+        Raises QueueFullError when the server's wait queue is full.
+        """
+        server = self.server_manager.get_server(server_name) if server_name else None
+        if not server:
+            return None
+        targets = self._targets(server, model or server.default_model)
+        if not targets:
+            return None
+        target_server, target_model = targets[0]
+        ticket = llm_scheduler.reserve(target_server.url, target_model)
+        ticket.route = targets
+        return ticket
+
+    def _targets(self, server, model: str) -> List[tuple]:
+        """(server, model) pairs to try: the server (or the members of a balanced
+        pool, best ranked first), then the other servers of its failover group.
+        Servers whose circuit breaker is open are skipped."""
+        targets = []
+        if is_balanced(server.type):
+            members = {member.name: member for member in self.server_manager.get_pool_members(server)}
+            for name in load_balancer.rank(list(members), pool_policy(server.api_key)):
+                targets.append((members[name], model or members[name].default_model))
+        else:
+            targets.append((server, model))
+        for name in failover_policy.alternates(server.name):
+            alternate = self.server_manager.get_server(name)
+            if alternate and alternate.type in ('ollama', 'openai'):
+                targets.append((alternate, alternate.default_model))
+        return [(target, target_model) for target, target_model in targets
+                if target.type in ('ollama', 'openai') and health_monitor.is_routable(target.name)]
+
+    def find_server(self, server_type: str) -> Optional[str]:
+        """Name of the first configured server of a given type."""
+        for server_name, server in self.server_manager.get_servers().items():
+            if server.type == server_type:
+                return server_name
+        return None
 
     async def chat_with_server(self, server_name: str, request: LLMRequest, 
-                              model: Optional[str] = None) -> AsyncGenerator[str, None]:
-        """Chat with a specific LLM server."""
+                              model: Optional[str] = None,
+                              ticket: Optional[Ticket] = None,
+                              trace: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
+        """Chat with a specific LLM server.
+        
+        Transient failures before the first token are retried, then failed
+        over to the other servers of the failover group; a stream slow to
+        start may be hedged on an equivalent server. trace, if given, receives
+        the name of the server that answered.
+        """
         server = self.server_manager.get_server(server_name)
         if not server:
             yield f"Erreur: Serveur {server_name} non trouvé"
@@ -59,88 +115,139 @@ class LLMService:
         # Utiliser le modèle spécifié ou le modèle par défaut du serveur
         selected_model = model or request.model or server.default_model
         
-        if server.type == 'ollama':
-            async for chunk in self._chat_ollama(server, request, selected_model):
-                yield chunk
-        elif server.type == 'openai':
-            async for chunk in self._chat_openai(server, request, selected_model):
-                yield chunk
-        else:
+        if server.type not in ('ollama', 'openai') and not is_balanced(server.type):
             yield f"Erreur: Type de serveur {server.type} non supporté"
+            return
+        
+        # Classement fait par reserve() : ne pas retirer au sort un autre membre
+        targets = ticket.route if ticket is not None and ticket.route else self._targets(server, selected_model)
+        if not targets:
+            yield f"Erreur: Aucun serveur disponible pour {server_name}"
+            return
+        
+        # Attendre une place sur le serveur (file d'attente bornée)
+        if ticket is None:
+            ticket = llm_scheduler.reserve(targets[0][0].url, targets[0][1])
+        
+        clock = RequestClock()
+        
+        async def attempt(target, trace=trace, hedge=False):
+            target_server, target_model = target
+            if not hedge and not ticket.released and ticket.key == llm_scheduler.key(target_server.url, target_model):
+                slot = ticket
+            else:
+                # Place réservée sur un autre membre du pool (la copie d'une
+                # requête couverte ne touche pas à celle du flux principal)
+                if not hedge:
+                    ticket.release()
+                try:
+                    slot = llm_scheduler.reserve(target_server.url, target_model)
+                except QueueFullError as e:
+                    raise UpstreamError(str(e), status=503)
+            async with slot:
+                if trace is not None:
+                    trace['server'] = target_server.name
+                    trace['model'] = target_model
+                if not hedge:
+                    clock.sent(target)
+                if target_server.type == 'ollama':
+                    chunks = self._chat_ollama(target_server, request, target_model)
+                else:
+                    chunks = self._chat_openai(target_server, request, target_model)
+                async for chunk in load_balancer.measured(target_server.name, chunks):
+                    yield chunk
+        
+        chunks = failover_policy.stream(targets, attempt)
+        backup_trace: Dict[str, Any] = {}
+        hedging: Dict[str, Any] = {}
+        chunks = hedger.stream(
+            targets, chunks, lambda target: attempt(target, backup_trace, hedge=True),
+            trace=hedging, clock=clock
+        )
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except UpstreamError as e:
+            yield f"Erreur: {str(e)}"
+        finally:
+            if hedging.get('hedge_won') and trace is not None:
+                trace.update(backup_trace)
+
+    def _chat_payload(self, request: LLMRequest, model: str) -> Dict[str, Any]:
+        return OPENAI_CHAT_V1_BASE.payload(
+            model, request.prompt, request.stream,
+            temperature=request.temperature or self.llm_config['default_temperature'],
+            max_tokens=request.max_tokens or self.llm_config['max_tokens']
+        )
 
     async def _chat_ollama(self, server, request: LLMRequest, model: str) -> AsyncGenerator[str, None]:
         """Chat with Ollama server."""
-        url = f"{server.url}/chat/completions"
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'model': model,
-            'messages': [
-                {'role': 'user', 'content': request.prompt}
-            ],
-            'temperature': request.temperature or self.llm_config['default_temperature'],
-            'max_tokens': request.max_tokens or self.llm_config['max_tokens'],
-            'stream': request.stream
-        }
+        url = OPENAI_CHAT_V1_BASE.url(server.url)
+        headers = OPENAI_CHAT_V1_BASE.headers()
+        payload = self._chat_payload(request, model)
         
         logger.info(f"Making Ollama request to {url} with model {model}")
         
         try:
             async for chunk in self._make_openai_request(url, headers, payload):
                 yield chunk
+        except UpstreamError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Sans streaming, un délai dépassé pendant la génération n'est pas rejoué
+            if request.stream or is_retryable_error(e):
+                raise UpstreamError(str(e) or type(e).__name__)
+            logger.error(f"Ollama request failed: {e!r}")
+            yield f"Erreur Ollama: {str(e) or type(e).__name__}"
         except Exception as e:
             logger.error(f"Ollama request failed: {e}")
             yield f"Erreur Ollama: {str(e)}"
 
     async def _chat_openai(self, server, request: LLMRequest, model: str) -> AsyncGenerator[str, None]:
         """Chat with OpenAI-compatible server."""
-        url = f"{server.url}/chat/completions"
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        if server.api_key:
-            headers['Authorization'] = f"Bearer {server.api_key}"
-        
-        payload = {
-            'model': model,
-            'messages': [
-                {'role': 'user', 'content': request.prompt}
-            ],
-            'temperature': request.temperature or self.llm_config['default_temperature'],
-            'max_tokens': request.max_tokens or self.llm_config['max_tokens'],
-            'stream': request.stream
-        }
+        url = OPENAI_CHAT_V1_BASE.url(server.url)
+        headers = OPENAI_CHAT_V1_BASE.headers(server.api_key)
+        payload = self._chat_payload(request, model)
         
         logger.info(f"Making OpenAI request to {url} with model {model}")
         
         try:
             async for chunk in self._make_openai_request(url, headers, payload):
                 yield chunk
+        except UpstreamError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Sans streaming, un délai dépassé pendant la génération n'est pas rejoué
+            if request.stream or is_retryable_error(e):
+                raise UpstreamError(str(e) or type(e).__name__)
+            logger.error(f"OpenAI request failed: {e!r}")
+            yield f"Erreur OpenAI: {str(e) or type(e).__name__}"
         except Exception as e:
             logger.error(f"OpenAI request failed: {e}")
             yield f"Erreur OpenAI: {str(e)}"
 
     # Méthodes legacy pour compatibilité
-    async def chat_internal(self, request: LLMRequest) -> AsyncGenerator[str, None]:
+    async def chat_internal(self, request: LLMRequest,
+                            ticket: Optional[Ticket] = None,
+                            trace: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
         """Chat with internal LLM (legacy method)."""
         default_server = self.server_manager.get_default_server()
         if default_server:
-            async for chunk in self.chat_with_server(default_server, request):
+            async for chunk in self.chat_with_server(default_server, request, ticket=ticket, trace=trace):
                 yield chunk
         else:
             yield "Erreur: Aucun serveur LLM configuré"
 
-    async def chat_ollama(self, request: LLMRequest) -> AsyncGenerator[str, None]:
+    async def chat_ollama(self, request: LLMRequest,
+                          ticket: Optional[Ticket] = None,
+                          trace: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
         """Chat with Ollama (legacy method)."""
         # Chercher un serveur Ollama
-        for server_name, server in self.server_manager.get_servers().items():
-            if server.type == 'ollama':
-                async for chunk in self.chat_with_server(server_name, request):
-                    yield chunk
-                return
+        server_name = self.find_server('ollama')
+        if server_name:
+            async for chunk in self.chat_with_server(server_name, request, ticket=ticket, trace=trace):
+                yield chunk
+            return
         
         yield "Erreur: Aucun serveur Ollama configuré"
 
@@ -247,8 +354,14 @@ Texte à analyser:
         return models
     
     async def get_server_models(self, server_name: str) -> List[str]:
-        """Get available models for a specific server."""
-        return await self.server_manager.get_models(server_name)
+        """Get available models for a specific server (cached, see ModelCatalog)."""
+        if not self.server_manager.get_server(server_name):
+            return []
+        return await model_catalog.get(self.server_manager, server_name)
+    
+    async def get_all_server_models(self) -> Dict[str, List[str]]:
+        """Get available models for every server, fetched concurrently."""
+        return await model_catalog.get_all(self.server_manager)
     
     def get_servers(self):
         """Get all configured servers."""
@@ -0,0 +1,121 @@
+"""
+Catalogue des modèles disponibles par serveur LLM, mis en cache avec une
+durée de vie par serveur. Une entrée périmée est servie immédiatement
+pendant que sa mise à jour tourne en tâche de fond (stale-while-revalidate) ;
+si le serveur ne répond pas, la dernière liste connue reste servie.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from backend.config import config
+
+logger = logging.getLogger(__name__)
+
+class _Entry:
+    __slots__ = ('models', 'fetched_at', 'retry_at', 'refresh')
+
+    def __init__(self):
+        self.models: Optional[List[str]] = None
+        self.fetched_at = 0.0
+        self.retry_at = 0.0
+        self.refresh: Optional[asyncio.Task] = None
+
+class ModelCatalog:
+    """TTL-cached model lists, fetched concurrently through LLMServerManager."""
+
+    def __init__(self, ttl: int = 300, fetch_timeout: float = 5.0, error_retry: int = 30):
+        self.ttl = ttl
+        # Attente maximale d'un premier chargement avant de répondre sans lui
+        self.fetch_timeout = fetch_timeout
+        # Délai avant de réessayer un serveur qui n'a pas répondu
+        self.error_retry = error_retry
+        self._entries: Dict[str, _Entry] = {}
+
+    @classmethod
+    def from_config(cls) -> 'ModelCatalog':
+        return cls(
+            ttl=config.getint('llm', 'models_ttl', 300),
+            fetch_timeout=config.getfloat('llm', 'models_fetch_timeout', 5.0),
+            error_retry=config.getint('llm', 'models_error_retry', 30),
+        )
+
+    def _entry(self, server_name: str) -> _Entry:
+        entry = self._entries.get(server_name)
+        if entry is None:
+            entry = self._entries[server_name] = _Entry()
+        return entry
+
+    def update(self, server_name: str, models: List[str]):
+        """Store a fresh model list (also fed by the health probes)."""
+        if models:
+            entry = self._entry(server_name)
+            entry.models = list(models)
+            entry.fetched_at = time.monotonic()
+
+    async def _fetch(self, manager, server_name: str):
+        entry = self._entry(server_name)
+        try:
+            result = await manager.test_server(server_name)
+            if result.status == "success" and result.available_models:
+                self.update(server_name, result.available_models)
+                return
+            logger.warning(f"Model list unavailable for {server_name}: {result.message}")
+        except Exception as e:
+            logger.warning(f"Model list fetch failed for {server_name}: {e}")
+        entry.retry_at = time.monotonic() + self.error_retry
+
+    def _refresh(self, manager, server_name: str) -> asyncio.Task:
+        """Start (or join) the refresh of one server's list."""
+        entry = self._entry(server_name)
+        if entry.refresh is None or entry.refresh.done():
+            entry.refresh = asyncio.ensure_future(self._fetch(manager, server_name))
+        return entry.refresh
+
+    async def get(self, manager, server_name: str) -> List[str]:
+        """Models of a server: cached, last known, or the server's default model."""
+        entry = self._entry(server_name)
+        now = time.monotonic()
+        stale = now - entry.fetched_at >= self.ttl and now >= entry.retry_at
+
+        if entry.models is not None:
+            if stale:
+                # Servir la liste connue, la rafraîchir en tâche de fond
+                self._refresh(manager, server_name)
+            return entry.models
+
+        # Seul le premier demandeur attend le chargement ; les suivants
+        # reçoivent le modèle par défaut tant qu'il n'a pas abouti
+        if stale and (entry.refresh is None or entry.refresh.done()):
+            try:
+                # shield : le chargement continue si l'attente expire
+                await asyncio.wait_for(asyncio.shield(self._refresh(manager, server_name)),
+                                       self.fetch_timeout)
+            except asyncio.TimeoutError:
+                pass
+        if entry.models is not None:
+            return entry.models
+
+        server = manager.get_server(server_name)
+        return [server.default_model] if server and server.default_model else []
+
+    async def get_all(self, manager) -> Dict[str, List[str]]:
+        """Models of every configured server, fetched concurrently."""
+        names = list(manager.get_servers().keys())
+        results = await asyncio.gather(*(self.get(manager, name) for name in names))
+        return dict(zip(names, results))
+
+    def stats(self) -> Dict[str, Dict[str, Optional[float]]]:
+        now = time.monotonic()
+        return {
+            name: {
+                'models': len(entry.models) if entry.models is not None else None,
+                'age': round(now - entry.fetched_at, 1) if entry.models is not None else None,
+                'refreshing': entry.refresh is not None and not entry.refresh.done(),
+            }
+            for name, entry in self._entries.items()
+        }
+
+# Catalogue partagé par les services du processus
+model_catalog = ModelCatalog.from_config()
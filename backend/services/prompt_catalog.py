@@ -0,0 +1,156 @@
+"""
+Catalogue de prompts en mémoire avec index de recherche par identifiant,
+par auteur et par visibilité.
+"""
+from typing import List, Optional, Dict, Any, Iterable, Tuple, Union
+
+from backend.models import SystemPrompt, UserPrompt
+from backend.services.prompt_search import PromptSearchIndex
+
+Prompt = Union[SystemPrompt, UserPrompt]
+
+class PromptCatalog:
+    """Resident prompt catalog with id, author and visibility indexes."""
+
+    def __init__(self):
+        self.system_prompts: Dict[str, SystemPrompt] = {}
+        self.user_prompts: Dict[str, UserPrompt] = {}
+
+        # Index utilisateur : auteur -> ids, ids publics, ordre d'insertion
+        self._ids_by_author: Dict[str, Dict[str, None]] = {}
+        self._public_ids: Dict[str, None] = {}
+        self._positions: Dict[str, int] = {}
+        self._next_position = 0
+
+        # Nombre de prompts par catégorie (système + utilisateur)
+        self._category_counts: Dict[str, int] = {}
+
+        # Cache des sérialisations dict() par id de prompt
+        self._dicts: Dict[str, Dict[str, Any]] = {}
+
+        # Index plein texte, tenu à jour à chaque écriture
+        self.search_index = PromptSearchIndex()
+
+    # ----- Chargement complet -----
+
+    def load_system_prompts(self, prompts: Iterable[SystemPrompt]):
+        """Replace all system prompts."""
+        for prompt in self.system_prompts.values():
+            self._uncount_category(prompt.category)
+            self._dicts.pop(prompt.id, None)
+            self.search_index.remove(prompt.id)
+
+        self.system_prompts = {}
+        for prompt in prompts:
+            self.system_prompts[prompt.id] = prompt
+            self._count_category(prompt.category)
+            self.search_index.add(prompt)
+
+    def load_user_prompts(self, prompts: Iterable[UserPrompt]):
+        """Replace all user prompts and rebuild the user indexes."""
+        for prompt in self.user_prompts.values():
+            self._uncount_category(prompt.category)
+            self._dicts.pop(prompt.id, None)
+            self.search_index.remove(prompt.id)
+
+        self.user_prompts = {}
+        self._ids_by_author = {}
+        self._public_ids = {}
+        self._positions = {}
+        self._next_position = 0
+
+        for prompt in prompts:
+            self.put_user_prompt(prompt)
+
+    # ----- Mises à jour incrémentales -----
+
+    def put_user_prompt(self, prompt: UserPrompt) -> Optional[UserPrompt]:
+        """Insert or replace a user prompt, returning the previous version."""
+        previous = self.user_prompts.get(prompt.id)
+        if previous is not None:
+            self._unindex_user_prompt(previous)
+        else:
+            self._positions[prompt.id] = self._next_position
+            self._next_position += 1
+
+        self.user_prompts[prompt.id] = prompt
+        self._ids_by_author.setdefault(prompt.created_by, {})[prompt.id] = None
+        if prompt.is_public:
+            self._public_ids[prompt.id] = None
+        self._count_category(prompt.category)
+        self.search_index.add(prompt)
+        return previous
+
+    def remove_user_prompt(self, prompt_id: str) -> Optional[UserPrompt]:
+        """Remove a user prompt, returning it if it existed."""
+        prompt = self.user_prompts.pop(prompt_id, None)
+        if prompt is not None:
+            self._unindex_user_prompt(prompt)
+            self._positions.pop(prompt_id, None)
+            self.search_index.remove(prompt_id)
+        return prompt
+
+    def _unindex_user_prompt(self, prompt: UserPrompt):
+        """Drop a user prompt from the secondary indexes."""
+        author_ids = self._ids_by_author.get(prompt.created_by)
+        if author_ids is not None:
+            author_ids.pop(prompt.id, None)
+            if not author_ids:
+                del self._ids_by_author[prompt.created_by]
+        self._public_ids.pop(prompt.id, None)
+        self._uncount_category(prompt.category)
+        self._dicts.pop(prompt.id, None)
+
+    def _count_category(self, category: str):
+        self._category_counts[category] = self._category_counts.get(category, 0) + 1
+
+    def _uncount_category(self, category: str):
+        count = self._category_counts.get(category, 0) - 1
+        if count > 0:
+            self._category_counts[category] = count
+        else:
+            self._category_counts.pop(category, None)
+
+    # ----- Lecture -----
+
+    def get(self, prompt_id: str) -> Tuple[Optional[Prompt], Optional[str]]:
+        """Look up a prompt by id, returning (prompt, source)."""
+        prompt = self.system_prompts.get(prompt_id)
+        if prompt is not None:
+            return prompt, 'system'
+        prompt = self.user_prompts.get(prompt_id)
+        if prompt is not None:
+            return prompt, 'user'
+        return None, None
+
+    def _sorted(self, ids: Iterable[str]) -> List[UserPrompt]:
+        """Return user prompts for the given ids in insertion order."""
+        positions = self._positions
+        return [self.user_prompts[pid] for pid in sorted(ids, key=positions.__getitem__)]
+
+    def prompts_by_author(self, user_id: str) -> List[UserPrompt]:
+        """User prompts created by a given user."""
+        return self._sorted(self._ids_by_author.get(user_id, ()))
+
+    def visible_user_prompts(self, user_id: Optional[str] = None) -> List[UserPrompt]:
+        """User prompts visible to a user: public ones plus their own."""
+        if not user_id:
+            return self._sorted(self._public_ids)
+        own_ids = self._ids_by_author.get(user_id, {})
+        return self._sorted(self._public_ids.keys() | own_ids.keys())
+
+    def is_visible(self, prompt: UserPrompt, user_id: Optional[str] = None) -> bool:
+        """Check whether a user prompt is visible to a user."""
+        return prompt.is_public or bool(user_id and prompt.created_by == user_id)
+
+    def categories(self) -> List[str]:
+        """All categories used by at least one prompt."""
+        return sorted(self._category_counts)
+
+    def as_dict(self, prompt: Prompt) -> Dict[str, Any]:
+        """Return the cached dict() serialization of a prompt."""
+        cached = self._dicts.get(prompt.id)
+        if cached is None:
+            cached = prompt.dict()
+            self._dicts[prompt.id] = cached
+        return cached
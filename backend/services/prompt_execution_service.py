@@ -1,14 +1,13 @@
 """
 Service pour l'exécution avancée de prompts avec toutes les fonctionnalités demandées.
 """
-import json
 import uuid
 import time
-import re
 import base64
+import asyncio
 import aiohttp
 from datetime import datetime
-from typing import List, Dict, Any, Optional, AsyncGenerator
+from typing import List, Dict, Any, Optional, AsyncGenerator, Awaitable, Callable
 from pathlib import Path
 
 import PyPDF2
@@ -19,42 +18,66 @@ from backend.models import (
     PromptExecutionResult
 )
 from backend.services.cockpit_service import CockpitService
+from backend.services.prompt_template import CompiledTemplate, template_cache
+from backend.services.upstream_client import connection_manager
+from backend.services.llm_scheduler import QueueFullError, Ticket, llm_scheduler
+from backend.services.llm_failover import UpstreamError, failover_policy, is_retryable_error, is_retryable_status
+from backend.services.llm_balancer import is_balanced, load_balancer, pool_members, pool_policy
+from backend.services.llm_health import health_monitor
+from backend.services.llm_hedging import RequestClock, hedger
+from backend.services.response_cache import response_cache
+from backend.services.single_flight import single_flight
+from backend.services.execution_control import ExecutionCancelled, ExecutionIdInUseError, execution_registry
+from backend.services.execution_store import execution_store
+from backend.services.llm_protocol import ERROR, TOKEN, USAGE, json_loads, protocol_for, stream_events
+
+# Taille des morceaux lors du rejeu d'une réponse en cache
+REPLAY_CHUNK_SIZE = 256
 
 class PromptExecutionService:
     """Service for advanced prompt execution with all requested features."""
     
-    def __init__(self):
-        """Initialize the service."""
+    def __init__(self, server_lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None):
+        """Initialize the service.
+        
+        server_lookup resolves a system server name to its config dict; it is
+        used to find the members of a balanced pool and the other servers of
+        a failover group.
+        """
         self.cockpit_service = CockpitService()
-        self.executions = {}  # In-memory storage for execution results
+        self.server_lookup = server_lookup
     
     def extract_variables_from_content(self, content: str) -> List[str]:
         """Extract all variables {variable_name} from prompt content."""
-        pattern = r'\{([^}]+)\}'
-        return list(set(re.findall(pattern, content)))
+        return list(template_cache.for_content(content).placeholders)
     
-    def validate_variables(self, content: str, variables: List[PromptVariable]) -> Dict[str, Any]:
+    def validate_variables(
+        self,
+        content: str,
+        variables: List[PromptVariable],
+        template: Optional[CompiledTemplate] = None
+    ) -> Dict[str, Any]:
         """Validate that all required variables are provided."""
-        required_vars = self.extract_variables_from_content(content)
+        template = template or template_cache.for_content(content)
         provided_vars = {var.name for var in variables}
-        missing_vars = [var for var in required_vars if var not in provided_vars]
+        missing_vars = template.missing(provided_vars)
         
         return {
             "is_valid": len(missing_vars) == 0,
             "missing_variables": missing_vars,
-            "required_variables": required_vars,
+            "required_variables": list(template.placeholders),
             "provided_variables": list(provided_vars)
         }
     
-    def substitute_variables(self, content: str, variables: List[PromptVariable]) -> str:
+    def substitute_variables(
+        self,
+        content: str,
+        variables: List[PromptVariable],
+        template: Optional[CompiledTemplate] = None
+    ) -> str:
         """Substitute variables in the prompt content."""
-        result = content
-        
-        for variable in variables:
-            placeholder = f"{{{variable.name}}}"
-            result = result.replace(placeholder, variable.value)
-        
-        return result
+        template = template or template_cache.for_content(content)
+        return template.render({variable.name: variable.value for variable in variables})
     
     def process_pdf_file(self, file_base64: str) -> str:
         """Convert PDF file to text."""
@@ -79,7 +102,8 @@ class PromptExecutionService:
         self, 
         content: str, 
         variables: List[PromptVariable], 
-        files: List[str] = None
+        files: List[str] = None,
+        template: Optional[CompiledTemplate] = None
     ) -> tuple[str, List[PromptExecutionLog]]:
         """Build the final prompt with variables and files."""
         logs = []
@@ -94,7 +118,7 @@ class PromptExecutionService:
             ))
         
         # Substitute variables
-        final_content = self.substitute_variables(content, variables)
+        final_content = self.substitute_variables(content, variables, template)
         
         # Process files if any
         if files:
@@ -112,6 +136,199 @@ class PromptExecutionService:
         return final_content, logs
     
     async def execute_with_llm(
+        self,
+        final_prompt: str,
+        server_config: Dict[str, Any],
+        model: str,
+        ticket: Optional[Ticket] = None
+    ) -> tuple[str, List[PromptExecutionLog], str]:
+        """Execute the prompt once a slot is available on the LLM server.
+        
+        Identical requests already in flight share a single upstream call.
+        Transient failures are retried, then failed over to the other servers
+        of the failover group. Returns (result, logs, name of the server that
+        answered). Raises QueueFullError when the server's wait queue is full.
+        """
+        key = single_flight.make_key(server_config['url'], model, final_prompt, {'stream': False})
+        if ticket is not None and single_flight.is_calling(key):
+            # La génération existante répond : rendre la place réservée
+            ticket.release()
+            ticket = None
+        
+        async def call():
+            return await self._call_with_failover(final_prompt, server_config, model, ticket)
+        
+        return await single_flight.call(key, call)
+    
+    async def collect_streaming(
+        self,
+        final_prompt: str,
+        server_config: Dict[str, Any],
+        model: str,
+        on_chunk: Callable[[str], None],
+        trace: Optional[Dict[str, Any]] = None
+    ) -> tuple[str, List[PromptExecutionLog], str]:
+        """Like execute_with_llm, but streamed: each chunk is passed to on_chunk.
+        
+        trace, if given, receives the server, the model and the token usage
+        reported by the server.
+        """
+        start_time = time.time()
+        logs = [PromptExecutionLog(
+            timestamp=datetime.utcnow(),
+            action="api_call",
+            details=f"Appel API en streaming vers {server_config['url']} avec le modèle {model}",
+            success=True
+        )]
+        trace = trace if trace is not None else {}
+        chunks = []
+        async for chunk in self.execute_prompt_streaming(final_prompt, server_config, model, trace=trace):
+            chunks.append(chunk)
+            on_chunk(chunk)
+        
+        error = trace.get('error')
+        logs.append(PromptExecutionLog(
+            timestamp=datetime.utcnow(),
+            action="response",
+            details=f"Erreur lors de l'appel API: {error}" if error
+                    else f"Réponse reçue en {time.time() - start_time:.2f}s",
+            success=error is None
+        ))
+        return ''.join(chunks), logs, trace.get('server') or self._server_name(server_config)
+    
+    def _failover_targets(
+        self,
+        server_config: Dict[str, Any],
+        model: str,
+        alternates: bool = True
+    ) -> List[tuple]:
+        """(server_config, model) pairs to try: the server, then its failover group.
+        
+        A balanced pool is replaced by its members, best ranked first.
+        Servers whose circuit breaker is open are skipped.
+        """
+        targets = []
+        if is_balanced(server_config.get('type')):
+            members = pool_members(server_config['url'])
+            for name in load_balancer.rank(members, pool_policy(server_config.get('api_key'))):
+                member = self.server_lookup(name) if self.server_lookup is not None else None
+                if member and not is_balanced(member.get('type')):
+                    targets.append((member, model or member.get('default_model')))
+        else:
+            targets.append((server_config, model))
+        if alternates and self.server_lookup is not None:
+            for name in failover_policy.alternates(server_config.get('name')):
+                alternate = self.server_lookup(name)
+                if alternate and not is_balanced(alternate.get('type')):
+                    targets.append((alternate, alternate.get('default_model') or model))
+        return [target for target in targets if health_monitor.is_routable(target[0].get('name'))]
+    
+    def reserve(self, server_config: Dict[str, Any], model: str) -> Ticket:
+        """Reserve a slot before streaming; a balanced pool reserves on its best member.
+        
+        Raises QueueFullError when the wait queue is full.
+        """
+        targets = self._failover_targets(server_config, model)
+        target_config, target_model = targets[0] if targets else (server_config, model)
+        ticket = llm_scheduler.reserve(target_config['url'], target_model)
+        ticket.route = targets or None
+        return ticket
+    
+    def _routed_targets(
+        self,
+        server_config: Dict[str, Any],
+        model: str,
+        ticket: Optional[Ticket]
+    ) -> List[tuple]:
+        """Targets ranked by reserve() for this ticket, so the request runs where
+        its slot was taken; ranked now otherwise."""
+        if ticket is not None and ticket.route:
+            return ticket.route
+        return self._failover_targets(server_config, model)
+    
+    def _admission_slot(
+        self,
+        server_config: Dict[str, Any],
+        model: str,
+        ticket: Optional[Ticket],
+        failures: List[UpstreamError],
+        fail_fast: bool = True
+    ) -> Ticket:
+        """Slot for one attempt: the caller's ticket first, then a new reservation."""
+        if ticket is not None and not ticket.released:
+            if ticket.key == llm_scheduler.key(server_config['url'], model):
+                return ticket
+            # Place réservée sur un autre membre du pool
+            ticket.release()
+        try:
+            return llm_scheduler.reserve(server_config['url'], model)
+        except QueueFullError as e:
+            if fail_fast and not failures:
+                raise
+            # Serveur de secours saturé : passer au suivant
+            raise UpstreamError(str(e), status=503)
+    
+    @staticmethod
+    def _server_name(server_config: Dict[str, Any]) -> str:
+        return server_config.get('name') or server_config['url']
+    
+    async def _call_with_failover(
+        self,
+        final_prompt: str,
+        server_config: Dict[str, Any],
+        model: str,
+        ticket: Optional[Ticket] = None
+    ) -> tuple[str, List[PromptExecutionLog], str]:
+        """Call the server, retrying and failing over on transient errors."""
+        failures: List[UpstreamError] = []
+        failure_logs: List[PromptExecutionLog] = []
+        
+        def on_failure(target, error: UpstreamError):
+            failures.append(error)
+            failure_logs.append(PromptExecutionLog(
+                timestamp=datetime.utcnow(),
+                action="failover",
+                details=f"Échec sur {self._server_name(target[0])}: {error}",
+                success=False
+            ))
+        
+        pooled = is_balanced(server_config.get('type'))
+        
+        async def attempt(target):
+            target_config, target_model = target
+            async with self._admission_slot(target_config, target_model, ticket, failures, not pooled):
+                measurement = load_balancer.start(self._server_name(target_config))
+                try:
+                    response = await self._call_llm(final_prompt, target_config, target_model)
+                except UpstreamError:
+                    measurement.finish(success=False)
+                    raise
+                except BaseException:
+                    measurement.discard()
+                    raise
+                measurement.finish()
+                return response
+        
+        try:
+            (result, logs), (answered_config, _) = await failover_policy.call(
+                self._routed_targets(server_config, model, ticket), attempt, on_failure
+            )
+        except UpstreamError as e:
+            error_msg = f"Erreur lors de l'appel API: {str(e)}"
+            failure_logs.append(PromptExecutionLog(
+                timestamp=datetime.utcnow(),
+                action="response",
+                details=error_msg,
+                success=False
+            ))
+            return f"Erreur: {error_msg}", failure_logs, self._server_name(server_config)
+        
+        # Les échecs rattrapés ne font pas échouer l'exécution
+        for log in failure_logs:
+            log.success = True
+        return result, failure_logs + logs, self._server_name(answered_config)
+    
+    async def _call_llm(
         self,
         final_prompt: str,
         server_config: Dict[str, Any],
@@ -129,81 +346,46 @@ class PromptExecutionService:
                 success=True
             ))
             
-            if server_config['type'].lower() == "ollama":
-                # Ollama API call
-                url = f"{server_config['url'].rstrip('/')}/api/generate"
-                payload = {
-                    "model": model,
-                    "prompt": final_prompt,
-                    "stream": False
-                }
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, json=payload) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            result = data.get('response', '')
-                            
-                            logs.append(PromptExecutionLog(
-                                timestamp=datetime.utcnow(),
-                                action="response",
-                                details=f"Réponse reçue en {time.time() - start_time:.2f}s",
-                                success=True
-                            ))
-                            
-                            return result, logs
-                        else:
-                            error_msg = f"Erreur HTTP {response.status}"
-                            logs.append(PromptExecutionLog(
-                                timestamp=datetime.utcnow(),
-                                action="response",
-                                details=error_msg,
-                                success=False
-                            ))
-                            return f"Erreur: {error_msg}", logs
+            protocol = protocol_for(server_config['type'])
+            url = protocol.url(server_config['url'])
+            headers = protocol.headers(server_config.get('api_key'))
+            payload = protocol.payload(model, final_prompt, stream=False)
             
-            else:  # OpenAI compatible
-                # OpenAI API call
-                url = f"{server_config['url'].rstrip('/')}/v1/chat/completions"
-                headers = {}
-                
-                if server_config.get('api_key'):
-                    headers["Authorization"] = f"Bearer {server_config['api_key']}"
-                
-                payload = {
-                    "model": model,
-                    "messages": [
-                        {"role": "user", "content": final_prompt}
-                    ],
-                    "stream": False
-                }
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, json=payload, headers=headers) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            result = data['choices'][0]['message']['content']
-                            
-                            logs.append(PromptExecutionLog(
-                                timestamp=datetime.utcnow(),
-                                action="response",
-                                details=f"Réponse reçue en {time.time() - start_time:.2f}s",
-                                success=True
-                            ))
-                            
-                            return result, logs
-                        else:
-                            error_msg = f"Erreur HTTP {response.status}"
-                            logs.append(PromptExecutionLog(
-                                timestamp=datetime.utcnow(),
-                                action="response",
-                                details=error_msg,
-                                success=False
-                            ))
-                            return f"Erreur: {error_msg}", logs
+            session = connection_manager.session(url)
+            async with session.post(url, json=payload, headers=headers,
+                                    timeout=connection_manager.request_timeout) as response:
+                if response.status == 200:
+                    data = await response.json(loads=json_loads)
+                    result = protocol.completion_text(data)
+                    
+                    logs.append(PromptExecutionLog(
+                        timestamp=datetime.utcnow(),
+                        action="response",
+                        details=f"Réponse reçue en {time.time() - start_time:.2f}s",
+                        success=True
+                    ))
+                    
+                    return result, logs
+                else:
+                    error_msg = f"Erreur HTTP {response.status}"
+                    if is_retryable_status(response.status):
+                        raise UpstreamError(error_msg, status=response.status)
+                    logs.append(PromptExecutionLog(
+                        timestamp=datetime.utcnow(),
+                        action="response",
+                        details=error_msg,
+                        success=False
+                    ))
+                    return f"Erreur: {error_msg}", logs
         
+        except UpstreamError:
+            raise
         except Exception as e:
-            error_msg = f"Erreur lors de l'appel API: {str(e)}"
+            # Seuls les échecs de connexion sont rejoués (pas un délai dépassé
+            # pendant la génération)
+            if is_retryable_error(e):
+                raise UpstreamError(str(e) or type(e).__name__)
+            error_msg = f"Erreur lors de l'appel API: {str(e) or type(e).__name__}"
             logs.append(PromptExecutionLog(
                 timestamp=datetime.utcnow(),
                 action="response",
@@ -216,100 +398,241 @@ class PromptExecutionService:
         self,
         final_prompt: str,
         server_config: Dict[str, Any],
-        model: str
+        model: str,
+        ticket: Optional[Ticket] = None,
+        trace: Optional[Dict[str, Any]] = None
     ) -> AsyncGenerator[str, None]:
-        """Execute the prompt with streaming response."""
+        """Stream the prompt execution once a slot is available on the LLM server.
+        
+        Subscribers to an identical stream already in flight receive the
+        chunks produced so far, then the live ones, from a single upstream
+        generation. Transient failures before the first token are retried and
+        failed over; trace, if given, receives the server that answered.
+        Raises QueueFullError when the server's wait queue is full.
+        """
+        key = self.stream_key(final_prompt, server_config, model)
+        if ticket is not None:
+            if single_flight.is_streaming(key):
+                ticket.release()
+                ticket = None
+            else:
+                # La génération partagée libérera la place, même si ce client part
+                ticket.transfer()
+        
+        def produce(meta: Dict[str, Any]):
+            return self._stream_with_failover(final_prompt, server_config, model, ticket, meta)
+        
+        async for chunk in single_flight.stream(
+            key, produce,
+            on_abandon=ticket.release if ticket is not None else None,
+            info=trace
+        ):
+            yield chunk
+    
+    async def _stream_with_failover(
+        self,
+        final_prompt: str,
+        server_config: Dict[str, Any],
+        model: str,
+        ticket: Optional[Ticket],
+        meta: Dict[str, Any]
+    ) -> AsyncGenerator[str, None]:
+        """Stream from the server, retrying and failing over before the first token.
+
+        A stream slow to start may be hedged on an equivalent server (see llm_hedging).
+        """
+        failures: List[UpstreamError] = []
+        pooled = is_balanced(server_config.get('type'))
+        clock = RequestClock()
+        
+        async def attempt(target, meta=meta, hedge=False):
+            target_config, target_model = target
+            # La copie ne prend jamais la place réservée par le flux principal
+            async with self._admission_slot(target_config, target_model, None if hedge else ticket,
+                                            failures, not (pooled or hedge)):
+                meta['server'] = self._server_name(target_config)
+                meta['model'] = target_model
+                if not hedge:
+                    clock.sent(target)
+                async for chunk in load_balancer.measured(
+                    meta['server'], self._stream_llm(final_prompt, target_config, target_model, meta)
+                ):
+                    yield chunk
+        
+        targets = self._routed_targets(server_config, model, ticket)
+        chunks = failover_policy.stream(
+            targets, attempt, on_failure=lambda target, error: failures.append(error)
+        )
+        backup_meta: Dict[str, Any] = {}
+        chunks = hedger.stream(
+            targets, chunks, lambda target: attempt(target, backup_meta, hedge=True),
+            trace=meta, clock=clock
+        )
         try:
-            if server_config['type'].lower() == "ollama":
-                # Ollama streaming API call
-                url = f"{server_config['url'].rstrip('/')}/api/generate"
-                payload = {
-                    "model": model,
-                    "prompt": final_prompt,
-                    "stream": True
-                }
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, json=payload) as response:
-                        if response.status == 200:
-                            async for line in response.content:
-                                if line:
-                                    try:
-                                        data = json.loads(line.decode('utf-8'))
-                                        if 'response' in data:
-                                            yield data['response']
-                                    except json.JSONDecodeError:
-                                        continue
-                        else:
-                            yield f"Erreur HTTP {response.status}"
-            
-            else:  # OpenAI compatible streaming
-                url = f"{server_config['url'].rstrip('/')}/v1/chat/completions"
-                headers = {}
-                
-                if server_config.get('api_key'):
-                    headers["Authorization"] = f"Bearer {server_config['api_key']}"
-                
-                payload = {
-                    "model": model,
-                    "messages": [
-                        {"role": "user", "content": final_prompt}
-                    ],
-                    "stream": True
-                }
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, json=payload, headers=headers) as response:
-                        if response.status == 200:
-                            async for line in response.content:
-                                if line:
-                                    line_str = line.decode('utf-8').strip()
-                                    if line_str.startswith('data: '):
-                                        data_str = line_str[6:]
-                                        if data_str != '[DONE]':
-                                            try:
-                                                data = json.loads(data_str)
-                                                if 'choices' in data and data['choices']:
-                                                    delta = data['choices'][0].get('delta', {})
-                                                    if 'content' in delta:
-                                                        yield delta['content']
-                                            except json.JSONDecodeError:
-                                                continue
-                        else:
-                            yield f"Erreur HTTP {response.status}"
-                            
+            async for chunk in chunks:
+                yield chunk
+        except UpstreamError as e:
+            meta['error'] = str(e)
+            yield f"Erreur lors de l'appel API: {str(e)}"
+        finally:
+            if meta.get('hedge_won'):
+                meta.update(backup_meta)
+    
+    async def stream_target(
+        self,
+        final_prompt: str,
+        server_config: Dict[str, Any],
+        model: str,
+        meta: Dict[str, Any]
+    ) -> AsyncGenerator[str, None]:
+        """Stream from this server only, without failover (comparison of servers).
+        
+        A balanced pool streams from its best ranked member. meta receives
+        the server, the model, the token usage and the error, if any.
+        Raises UpstreamError when the server is unavailable.
+        """
+        targets = self._failover_targets(server_config, model, alternates=False)
+        if not targets:
+            raise UpstreamError(f"{self._server_name(server_config)} indisponible (circuit ouvert)")
+        target_config, target_model = targets[0]
+        meta['server'] = self._server_name(target_config)
+        meta['model'] = target_model
+        async with self._admission_slot(target_config, target_model, None, []):
+            async for chunk in load_balancer.measured(
+                meta['server'], self._stream_llm(final_prompt, target_config, target_model, meta)
+            ):
+                yield chunk
+    
+    def stream_key(self, final_prompt: str, server_config: Dict[str, Any], model: str) -> str:
+        """Single-flight key of a streamed execution."""
+        return single_flight.make_key(server_config['url'], model, final_prompt, {'stream': True})
+    
+    def is_streaming(self, final_prompt: str, server_config: Dict[str, Any], model: str) -> bool:
+        """True if an identical stream is already running (joining it needs no LLM slot)."""
+        return single_flight.is_streaming(self.stream_key(final_prompt, server_config, model))
+    
+    async def _stream_llm(
+        self,
+        final_prompt: str,
+        server_config: Dict[str, Any],
+        model: str,
+        meta: Optional[Dict[str, Any]] = None
+    ) -> AsyncGenerator[str, None]:
+        """Execute the prompt with streaming response; errors and usage are recorded in meta."""
+        meta = meta if meta is not None else {}
+        protocol = protocol_for(server_config['type'])
+        url = protocol.url(server_config['url'])
+        try:
+            events = stream_events(
+                connection_manager.session(url), protocol, url,
+                protocol.headers(server_config.get('api_key')),
+                protocol.payload(model, final_prompt, stream=True)
+            )
+            async for event in events:
+                if event.kind == TOKEN:
+                    yield event.text
+                elif event.kind == USAGE:
+                    meta['usage'] = event.data
+                elif event.kind == ERROR:
+                    if event.status is not None:
+                        meta['error'] = f"Erreur HTTP {event.status}"
+                        yield f"Erreur HTTP {event.status}"
+                    else:
+                        meta['error'] = event.text
+                        yield f"Erreur: {event.text}"
+                        
+        except UpstreamError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError(str(e) or type(e).__name__)
         except Exception as e:
+            meta['error'] = str(e)
             yield f"Erreur lors de l'appel API: {str(e)}"
     
     async def execute_prompt(
         self,
         request: PromptExecutionRequest,
         prompt_content: str,
-        server_config: Dict[str, Any]
+        server_config: Dict[str, Any],
+        template: Optional[CompiledTemplate] = None,
+        use_cache: bool = True,
+        user_id: Optional[str] = None,
+        disconnected: Optional[Callable[[], Awaitable[Any]]] = None,
+        on_chunk: Optional[Callable[[str], None]] = None
     ) -> PromptExecutionResult:
-        """Execute a prompt with full logging and processing."""
-        execution_id = str(uuid.uuid4())
+        """Execute a prompt with full logging and processing.
+        
+        When the response cache is enabled and use_cache is True (the prompt
+        did not opt out), identical executions are served from the cache.
+        The LLM call can be cancelled through execution_registry with the
+        execution id (request.execution_id if the client chose one), and is
+        abandoned when disconnected() completes. Raises ExecutionIdInUseError
+        if an execution with the same id is already running, or if the id
+        belongs to another user's stored execution.
+        
+        With on_chunk, the answer is generated as a stream and each chunk is
+        passed to on_chunk as it arrives (partial output of queued jobs).
+        """
+        execution_id = request.execution_id or str(uuid.uuid4())
+        if request.execution_id and not await execution_store.available(execution_id, user_id):
+            raise ExecutionIdInUseError(f"Identifiant d'exécution {execution_id} déjà utilisé")
         start_time = time.time()
         
         # Use modified content if provided, otherwise use original
         content = request.modified_content or prompt_content
+        if request.modified_content:
+            template = None
         
         # Build final prompt
         final_prompt, logs = self.build_final_prompt(
             content, 
             request.variables, 
-            request.files
+            request.files,
+            template
         )
         
         # Determine model to use
         model = request.model or server_config.get('default_model', 'llama3')
         
-        # Execute with LLM
-        result, execution_logs = await self.execute_with_llm(
-            final_prompt,
-            server_config,
-            model
-        )
+        # Look up the response cache
+        cache_key = None
+        cached = None
+        if use_cache and response_cache.enabled:
+            cache_key = response_cache.make_key(server_config['url'], model, final_prompt)
+            cached = await response_cache.lookup(cache_key)
+        
+        answered_by = None
+        if cached is not None:
+            result = cached
+            execution_logs = [PromptExecutionLog(
+                timestamp=datetime.utcnow(),
+                action="response",
+                details="Réponse servie depuis le cache",
+                success=True
+            )]
+        else:
+            # Execute with LLM
+            execution_registry.register(execution_id, user_id)
+            try:
+                if on_chunk is not None:
+                    call = self.collect_streaming(final_prompt, server_config, model, on_chunk)
+                else:
+                    call = self.execute_with_llm(final_prompt, server_config, model)
+                result, execution_logs, answered_by = await execution_registry.run(
+                    execution_id, call, disconnected
+                )
+            except ExecutionCancelled as e:
+                result = "Exécution annulée"
+                execution_logs = [PromptExecutionLog(
+                    timestamp=datetime.utcnow(),
+                    action="cancelled",
+                    details=str(e),
+                    success=False
+                )]
+            
+            # Only successful answers are cached
+            if cache_key and all(log.success for log in execution_logs):
+                await response_cache.store(cache_key, result)
         
         # Combine all logs
         all_logs = logs + execution_logs
@@ -321,14 +644,109 @@ class PromptExecutionService:
             final_prompt=final_prompt,
             result=result,
             logs=all_logs,
-            execution_time=time.time() - start_time
+            execution_time=time.time() - start_time,
+            cached=cached is not None,
+            server_name=answered_by
         )
         
         # Store execution result
-        self.executions[execution_id] = execution_result
+        await execution_store.put(execution_result, user_id)
         
         return execution_result
     
-    def get_execution_result(self, execution_id: str) -> Optional[PromptExecutionResult]:
-        """Get execution result by ID."""
-        return self.executions.get(execution_id)
\ No newline at end of file
+    async def execute_batch_row(
+        self,
+        final_prompt: str,
+        server_config: Dict[str, Any],
+        model: str,
+        use_cache: bool = True,
+        max_waits: int = 3
+    ) -> Dict[str, Any]:
+        """Run one row of a batch: result, server, timing and token counts.
+        
+        Rows wait for the server's queue instead of failing when it is full.
+        Token counts come from the server when it reports them, otherwise the
+        completion is counted in streamed chunks.
+        """
+        start = time.monotonic()
+        cache_key = None
+        if use_cache and response_cache.enabled:
+            cache_key = response_cache.make_key(server_config['url'], model, final_prompt)
+            cached = await response_cache.lookup(cache_key)
+            if cached is not None:
+                return {
+                    'status': 'ok',
+                    'result': cached,
+                    'server': self._server_name(server_config),
+                    'cached': True,
+                    'elapsed': round(time.monotonic() - start, 3),
+                }
+        
+        for attempt in range(max_waits + 1):
+            chunks = 0
+            
+            def count(chunk: str):
+                nonlocal chunks
+                chunks += 1
+            
+            trace: Dict[str, Any] = {}
+            try:
+                result, logs, answered_by = await self.collect_streaming(
+                    final_prompt, server_config, model, count, trace
+                )
+                break
+            except QueueFullError as e:
+                if attempt == max_waits:
+                    raise
+                await asyncio.sleep(e.retry_after)
+        
+        success = all(log.success for log in logs)
+        if cache_key and success:
+            await response_cache.store(cache_key, result)
+        usage = trace.get('usage') or {}
+        return {
+            'status': 'ok' if success else 'error',
+            'result': result,
+            'error': None if success else trace.get('error'),
+            'server': answered_by,
+            'model': trace.get('model', model),
+            'cached': False,
+            'elapsed': round(time.monotonic() - start, 3),
+            'prompt_tokens': usage.get('prompt_tokens'),
+            'completion_tokens': usage.get('completion_tokens') or chunks,
+        }
+    
+    async def get_cached_response(
+        self,
+        final_prompt: str,
+        server_config: Dict[str, Any],
+        model: str
+    ) -> Optional[str]:
+        """Cached answer for this final prompt on this server/model, if any."""
+        if not response_cache.enabled:
+            return None
+        return await response_cache.lookup(
+            response_cache.make_key(server_config['url'], model, final_prompt)
+        )
+    
+    async def replay_cached_response(self, result: str) -> AsyncGenerator[str, None]:
+        """Replay a cached answer as a fast stream of chunks."""
+        for start in range(0, len(result), REPLAY_CHUNK_SIZE):
+            yield result[start:start + REPLAY_CHUNK_SIZE]
+    
+    async def get_execution_result(
+        self,
+        execution_id: str,
+        user_id: Optional[str] = None
+    ) -> Optional[PromptExecutionResult]:
+        """Get execution result by ID (from the shared execution store)."""
+        return await execution_store.get(execution_id, user_id)
+    
+    async def list_executions(
+        self,
+        user_id: str,
+        prompt_id: Optional[str] = None,
+        limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        """Latest execution results of a user, optionally for one prompt."""
+        return await execution_store.list(user_id, prompt_id, limit)
\ No newline at end of file
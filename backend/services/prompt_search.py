@@ -0,0 +1,182 @@
+"""
+Index de recherche plein texte pour les prompts (BM25, insensible aux accents).
+"""
+import math
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import List, Optional, Dict, Tuple
+
+# Pondération des champs indexés
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'category': 2.0,
+    'description': 1.5,
+    'content': 1.0,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Un terme trouvé uniquement par préfixe compte moins qu'une correspondance exacte
+PREFIX_WEIGHT = 0.6
+MAX_PREFIX_EXPANSIONS = 50
+
+_TOKEN_RE = re.compile(r'\w+')
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents ("Évaluation" -> "evaluation")."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def tokenize(text: str) -> List[str]:
+    """Split accent-folded text into word tokens."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(fold(text))
+
+class PromptSearchIndex:
+    """Inverted index over prompt title, description, content and category."""
+
+    def __init__(self, cache_size: int = 128):
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._doc_terms: Dict[str, Dict[str, float]] = {}
+        self._doc_lengths: Dict[str, float] = {}
+        self._total_length = 0.0
+
+        # Vocabulaire trié pour la recherche par préfixe, reconstruit à la demande
+        self._sorted_terms: List[str] = []
+        self._terms_dirty = False
+
+        # Incrémenté à chaque modification pour invalider le cache des requêtes
+        self.generation = 0
+        self._cache: "OrderedDict[str, List[Tuple[str, float]]]" = OrderedDict()
+        self._cache_size = cache_size
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    # ----- Mises à jour -----
+
+    def clear(self):
+        """Remove every document from the index."""
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0.0
+        self._sorted_terms = []
+        self._terms_dirty = False
+        self._touch()
+
+    def add(self, prompt):
+        """Index (or re-index) a prompt."""
+        if prompt.id in self._doc_terms:
+            self.remove(prompt.id)
+
+        terms: Dict[str, float] = {}
+        length = 0.0
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(getattr(prompt, field, None) or ''):
+                terms[token] = terms.get(token, 0.0) + weight
+                length += weight
+
+        for term, frequency in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._terms_dirty = True
+            postings[prompt.id] = frequency
+
+        self._doc_terms[prompt.id] = terms
+        self._doc_lengths[prompt.id] = length
+        self._total_length += length
+        self._touch()
+
+    def remove(self, prompt_id: str):
+        """Drop a prompt from the index."""
+        terms = self._doc_terms.pop(prompt_id, None)
+        if terms is None:
+            return
+
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(prompt_id, None)
+            if not postings:
+                del self._postings[term]
+                self._terms_dirty = True
+
+        self._total_length -= self._doc_lengths.pop(prompt_id, 0.0)
+        self._touch()
+
+    def _touch(self):
+        self.generation += 1
+        self._cache.clear()
+
+    # ----- Recherche -----
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        """Return (term, weight) pairs matching a query token exactly or by prefix."""
+        if self._terms_dirty:
+            self._sorted_terms = sorted(self._postings)
+            self._terms_dirty = False
+
+        matches = []
+        if token in self._postings:
+            matches.append((token, 1.0))
+
+        start = bisect_left(self._sorted_terms, token)
+        for term in self._sorted_terms[start:start + MAX_PREFIX_EXPANSIONS + 1]:
+            if not term.startswith(token):
+                break
+            if term != token:
+                matches.append((term, PREFIX_WEIGHT))
+        return matches
+
+    def search(self, query: str) -> List[Tuple[str, float]]:
+        """Return (prompt_id, score) pairs matching every query token, best first."""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        cache_key = ' '.join(tokens)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            return cached
+
+        doc_count = len(self._doc_terms)
+        avg_length = self._total_length / doc_count if doc_count else 0.0
+
+        scores: Optional[Dict[str, float]] = None
+        for token in tokens:
+            token_scores: Dict[str, float] = {}
+            for term, weight in self._expand(token):
+                postings = self._postings[term]
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    if scores is not None and doc_id not in scores:
+                        continue
+                    norm = 1 - BM25_B + BM25_B * (self._doc_lengths[doc_id] / avg_length)
+                    score = weight * idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+                    if score > token_scores.get(doc_id, 0.0):
+                        token_scores[doc_id] = score
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    doc_id: scores[doc_id] + score
+                    for doc_id, score in token_scores.items()
+                }
+            if not scores:
+                break
+
+        results = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+        self._cache[cache_key] = results
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return results
@@ -1,5 +1,8 @@
 import json
 import uuid
+import base64
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 from pathlib import Path
@@ -11,16 +14,71 @@ from backend.models import (
     PromptType
 )
 from backend.config import config
+from backend.services.prompt_catalog import PromptCatalog
+from backend.services.prompt_search import tokenize, fold
+from backend.services.json_store import file_signature
+from backend.services.prompt_template import template_cache
+from backend.services.prompt_storage import (
+    JsonUserPromptStorage, SqliteUserPromptStorage,
+    migrate_json_to_sqlite, read_user_prompts_json, write_user_prompts_json
+)
 
 logger = logging.getLogger(__name__)
 
+PROMPT_TYPES = ['internal', 'external']
+
+# Champs renvoyés par défaut par le listing paginé (sans contenu ni HTML)
+LIST_DEFAULT_FIELDS = [
+    'id', 'title', 'description', 'category', 'type', 'source', 'editable',
+    'is_public', 'created_by', 'accepts_files', 'uses_cockpit_data', 'variables',
+    'updated_at'
+]
+LIST_SORT_KEYS = ['title', 'category', 'type', 'created_at', 'updated_at']
+LIST_MAX_LIMIT = 200
+
+def _sort_value(prompt, sort_key: str) -> str:
+    """String sort key for a prompt (dates as ISO strings, text accent-folded)."""
+    value = getattr(prompt, sort_key, None)
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, 'value'):
+        return value.value
+    return fold(str(value))
+
+def _encode_cursor(sort: str, key: tuple) -> str:
+    raw = json.dumps([sort, key[0], key[1]], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, prompt_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("Curseur invalide")
+    if cursor_sort != sort:
+        raise ValueError("Le curseur ne correspond pas au tri demandé")
+    return (value, prompt_id)
+
 class PromptService:
     """Service for managing system and user prompts."""
     
     def __init__(self):
         # Détection automatique de l'environnement
         self._setup_file_paths()
-        self._ensure_user_prompts_file()
+        
+        # Catalogue résident : les fichiers ne sont relus que lorsque leur
+        # signature (mtime, taille, inode ou version SQLite) change.
+        self._catalog = PromptCatalog()
+        self._setup_user_storage()
+        
+        # Vues triées du listing paginé, par (version, utilisateur, filtres, tri)
+        self._list_views: "OrderedDict[tuple, list]" = OrderedDict()
+        self._system_loaded = False
+        self._system_signature: Optional[tuple] = None
+        self._user_loaded = False
+        self._user_signature: Optional[tuple] = None
         
     def _setup_file_paths(self):
         """Configure les chemins des fichiers selon l'environnement (Docker vs Windows local)."""
@@ -46,11 +104,22 @@ class PromptService:
             logger.info(f"Fichier système: {self.system_prompts_file}")
             logger.info(f"Fichier utilisateur: {self.user_prompts_file}")
     
-    def _ensure_user_prompts_file(self):
-        """Ensure user prompts file exists."""
-        if not Path(self.user_prompts_file).exists():
-            with open(self.user_prompts_file, 'w') as f:
-                json.dump({"internal": [], "external": []}, f, indent=2)
+    def _setup_user_storage(self):
+        """Choose the user prompt backend ([database] user_prompts_backend = json|sqlite)."""
+        backend = config.get('database', 'user_prompts_backend', 'json').lower()
+        
+        if backend == 'sqlite':
+            db_path = config.get('database', 'user_prompts_db_path', None) or \
+                str(Path(self.user_prompts_file).with_suffix('.db'))
+            self.user_storage = SqliteUserPromptStorage(db_path)
+            # Migration unique depuis user_prompts.json
+            migrate_json_to_sqlite(self.user_prompts_file, self.user_storage)
+            logger.info(f"Prompts utilisateur stockés dans SQLite: {db_path}")
+        else:
+            self.user_storage = JsonUserPromptStorage(
+                self.user_prompts_file,
+                lambda: self._catalog.user_prompts.values()
+            )
     
     def _load_system_prompts(self) -> Dict[str, List[SystemPrompt]]:
         """Load system prompts from JSON file."""
@@ -86,106 +155,182 @@ class PromptService:
             logger.error(f"Error loading system prompts: {e}")
             return {"internal": [], "external": []}
     
-    def _load_user_prompts(self) -> Dict[str, List[UserPrompt]]:
-        """Load user prompts from JSON file."""
-        try:
-            with open(self.user_prompts_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-            prompts = {}
-            for prompt_type in ['internal', 'external']:
-                prompts[prompt_type] = [
-                    UserPrompt(
-                        type=PromptType(prompt_type),
-                        **prompt
-                    )
-                    for prompt in data.get(prompt_type, [])
-                ]
-            
-            return prompts
-        except Exception as e:
-            logger.error(f"Error loading user prompts: {e}")
-            return {"internal": [], "external": []}
+    def _get_catalog(self) -> PromptCatalog:
+        """Return the resident catalog, reloading files whose signature changed."""
+        signature = file_signature(self.system_prompts_file)
+        if not self._system_loaded or signature != self._system_signature:
+            system_prompts = self._load_system_prompts()
+            self._catalog.load_system_prompts(
+                prompt for prompt_type in system_prompts.values() for prompt in prompt_type
+            )
+            self._system_signature = signature
+            self._system_loaded = True
+        
+        signature = self.user_storage.signature()
+        if not self._user_loaded or signature != self._user_signature:
+            self._catalog.load_user_prompts(self.user_storage.load())
+            self._user_signature = signature
+            self._user_loaded = True
+        
+        return self._catalog
     
-    def _save_user_prompts(self, prompts: Dict[str, List[UserPrompt]]):
-        """Save user prompts to JSON file."""
+    def _store_user_write(self, write, *args):
+        """Persist a change already applied to the catalog."""
+        previous = self._user_signature
         try:
-            data = {}
-            for prompt_type, prompt_list in prompts.items():
-                data[prompt_type] = [
-                    prompt.dict(exclude={'type'}) for prompt in prompt_list
-                ]
-            
-            with open(self.user_prompts_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False, default=str)
-                
-        except Exception as e:
-            logger.error(f"Error saving user prompts: {e}")
+            signature = write(*args)
+        except Exception:
+            # L'état en mémoire ne correspond plus au stockage : forcer une relecture
+            self._user_loaded = False
             raise
+        
+        # Our own write: the in-memory copy is already up to date
+        self._user_signature = signature
+        if not self.user_storage.follows(previous, signature):
+            # Écriture d'un autre worker intercalée, jamais vue par la copie
+            # en mémoire : relire au prochain accès
+            self._user_loaded = False
+    
+    def get_catalog_version(self) -> str:
+        """Version of the whole catalog, identical in every worker process.
+        
+        Derived from the storage signatures (file mtime/size/inode, SQLite
+        version counter), so it changes on every write to either store.
+        """
+        self._get_catalog()
+        return f"{self._system_signature}|{self._user_signature}"
+    
+    def reload(self):
+        """Force a reload of both prompt files on next access."""
+        self._system_loaded = False
+        self._user_loaded = False
+    
+    def _with_access(self, catalog: PromptCatalog, prompt, source: str,
+                     user_id: Optional[str]) -> Dict[str, Any]:
+        """Serialize a prompt with its source and editability for a user."""
+        if source == 'system':
+            return {**catalog.as_dict(prompt), 'source': 'system', 'editable': False}
+        return {
+            **catalog.as_dict(prompt),
+            'source': 'user',
+            'editable': user_id == prompt.created_by
+        }
     
     def get_all_prompts(self, user_id: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
         """Get all prompts (system + user's own + public user prompts)."""
-        system_prompts = self._load_system_prompts()
-        user_prompts = self._load_user_prompts()
+        catalog = self._get_catalog()
         
-        result = {}
+        result = {prompt_type: [] for prompt_type in PROMPT_TYPES}
         
-        for prompt_type in ['internal', 'external']:
-            result[prompt_type] = []
-            
-            # Add system prompts
-            for prompt in system_prompts.get(prompt_type, []):
-                result[prompt_type].append({
-                    **prompt.dict(),
-                    'source': 'system',
-                    'editable': False
-                })
-            
-            # Add user prompts
-            for prompt in user_prompts.get(prompt_type, []):
-                # Include if public or if it's the user's own prompt
-                if prompt.is_public or (user_id and prompt.created_by == user_id):
-                    result[prompt_type].append({
-                        **prompt.dict(),
-                        'source': 'user',
-                        'editable': user_id == prompt.created_by
-                    })
+        # Add system prompts
+        for prompt in catalog.system_prompts.values():
+            result.setdefault(prompt.type.value, []).append(
+                self._with_access(catalog, prompt, 'system', user_id)
+            )
+        
+        # Add user prompts that are public or owned by the user
+        for prompt in catalog.visible_user_prompts(user_id):
+            result.setdefault(prompt.type.value, []).append(
+                self._with_access(catalog, prompt, 'user', user_id)
+            )
         
         return result
     
+    def _list_view(self, user_id: Optional[str], sort: str, prompt_type: Optional[str],
+                   category: Optional[str], source: Optional[str]) -> list:
+        """Sorted (key, prompt, source) entries for a filtered listing, cached per catalog version."""
+        sort_key = sort.lstrip('-')
+        cache_key = (self.get_catalog_version(), user_id, sort_key, prompt_type, category, source)
+        view = self._list_views.get(cache_key)
+        if view is not None:
+            self._list_views.move_to_end(cache_key)
+            return view
+        
+        catalog = self._catalog
+        entries = []
+        if source in (None, 'system'):
+            entries.extend((prompt, 'system') for prompt in catalog.system_prompts.values())
+        if source in (None, 'user'):
+            entries.extend((prompt, 'user') for prompt in catalog.visible_user_prompts(user_id))
+        elif source == 'mine' and user_id:
+            entries.extend((prompt, 'user') for prompt in catalog.prompts_by_author(user_id))
+        
+        view = sorted(
+            ((_sort_value(prompt, sort_key), prompt.id), prompt, prompt_source)
+            for prompt, prompt_source in entries
+            if (not prompt_type or prompt.type.value == prompt_type)
+            and (not category or prompt.category == category)
+        )
+        
+        self._list_views[cache_key] = view
+        if len(self._list_views) > 64:
+            self._list_views.popitem(last=False)
+        return view
+    
+    def list_prompts(self, user_id: Optional[str] = None, limit: int = 50,
+                     cursor: Optional[str] = None, sort: str = 'title',
+                     prompt_type: Optional[str] = None, category: Optional[str] = None,
+                     source: Optional[str] = None,
+                     fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Paginated, field-projected listing of the prompts visible to a user.
+        
+        sort is one of LIST_SORT_KEYS, optionally prefixed with '-' for a
+        descending order. source is 'system', 'user' (visible user prompts) or
+        'mine'. Pagination uses an opaque keyset cursor, so pages stay
+        consistent when prompts are added or removed. fields defaults to
+        LIST_DEFAULT_FIELDS; use ['*'] to get full prompts.
+        Raises ValueError on invalid parameters.
+        """
+        if sort.lstrip('-') not in LIST_SORT_KEYS:
+            raise ValueError(f"Tri non supporté: {sort}")
+        if source not in (None, 'system', 'user', 'mine'):
+            raise ValueError(f"Source non supportée: {source}")
+        limit = max(1, min(limit, LIST_MAX_LIMIT))
+        
+        view = self._list_view(user_id, sort, prompt_type, category, source)
+        keys = [entry[0] for entry in view]
+        descending = sort.startswith('-')
+        
+        if descending:
+            end = bisect_left(keys, _decode_cursor(cursor, sort)) if cursor else len(view)
+            start = max(0, end - limit)
+            page = view[start:end][::-1]
+            has_more = start > 0
+        else:
+            start = bisect_right(keys, _decode_cursor(cursor, sort)) if cursor else 0
+            page = view[start:start + limit]
+            has_more = start + limit < len(view)
+        
+        projection = None if fields == ['*'] else (fields or LIST_DEFAULT_FIELDS)
+        items = []
+        for _, prompt, prompt_source in page:
+            item = self._with_access(self._catalog, prompt, prompt_source, user_id)
+            if projection is not None:
+                item = {field: item[field] for field in projection if field in item}
+            items.append(item)
+        
+        return {
+            "items": items,
+            "next_cursor": _encode_cursor(sort, page[-1][0]) if page and has_more else None,
+            "total": len(view),
+            "limit": limit
+        }
+    
     def get_prompt_by_id(self, prompt_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Get specific prompt by ID."""
-        # Check system prompts first
-        system_prompts = self._load_system_prompts()
-        for prompt_type in ['internal', 'external']:
-            for prompt in system_prompts.get(prompt_type, []):
-                if prompt.id == prompt_id:
-                    return {
-                        **prompt.dict(),
-                        'source': 'system',
-                        'editable': False
-                    }
-        
-        # Check user prompts
-        user_prompts = self._load_user_prompts()
-        for prompt_type in ['internal', 'external']:
-            for prompt in user_prompts.get(prompt_type, []):
-                if prompt.id == prompt_id:
-                    # Check access permissions
-                    if prompt.is_public or (user_id and prompt.created_by == user_id):
-                        return {
-                            **prompt.dict(),
-                            'source': 'user',
-                            'editable': user_id == prompt.created_by
-                        }
-        
-        return None
+        catalog = self._get_catalog()
+        prompt, source = catalog.get(prompt_id)
+        if prompt is None:
+            return None
+        
+        # Check access permissions
+        if source == 'user' and not catalog.is_visible(prompt, user_id):
+            return None
+        
+        return self._with_access(catalog, prompt, source, user_id)
     
     def create_user_prompt(self, prompt_data: UserPromptCreate, user_id: str) -> UserPrompt:
         """Create new user prompt."""
-        # Load existing prompts
-        user_prompts = self._load_user_prompts()
-        
         # Create new prompt
         new_prompt = UserPrompt(
             id=str(uuid.uuid4()),
@@ -193,55 +338,53 @@ class PromptService:
             **prompt_data.dict()
         )
         
-        # Add to appropriate list
-        prompt_type = new_prompt.type.value
-        if prompt_type not in user_prompts:
-            user_prompts[prompt_type] = []
-        
-        user_prompts[prompt_type].append(new_prompt)
-        
-        # Save to file
-        self._save_user_prompts(user_prompts)
+        # Read-modify-write under the storage lock (other workers may write too)
+        with self.user_storage.write_lock():
+            catalog = self._get_catalog()
+            catalog.put_user_prompt(new_prompt)
+            
+            # Save to storage
+            self._store_user_write(self.user_storage.insert, new_prompt)
         
+        # Compile the template once for this version
+        template_cache.put(new_prompt.id, new_prompt.updated_at, new_prompt.content)
         return new_prompt
     
     def update_user_prompt(self, prompt_id: str, prompt_data: UserPromptUpdate, 
                           user_id: str) -> Optional[UserPrompt]:
         """Update existing user prompt."""
-        user_prompts = self._load_user_prompts()
-        
-        # Find and update prompt
-        for prompt_type in ['internal', 'external']:
-            for i, prompt in enumerate(user_prompts.get(prompt_type, [])):
-                if prompt.id == prompt_id and prompt.created_by == user_id:
-                    # Update fields
-                    update_data = prompt_data.dict(exclude_unset=True)
-                    for field, value in update_data.items():
-                        setattr(prompt, field, value)
-                    
-                    prompt.updated_at = datetime.utcnow()
-                    
-                    # Save changes
-                    self._save_user_prompts(user_prompts)
-                    
-                    return prompt
-        
-        return None
+        with self.user_storage.write_lock():
+            catalog = self._get_catalog()
+            
+            prompt = catalog.user_prompts.get(prompt_id)
+            if prompt is None or prompt.created_by != user_id:
+                return None
+            
+            # Update fields on a copy so that the indexes see old and new versions
+            update_data = prompt_data.dict(exclude_unset=True)
+            prompt = prompt.copy(update=update_data)
+            prompt.updated_at = datetime.utcnow()
+            
+            catalog.put_user_prompt(prompt)
+            
+            # Save changes
+            self._store_user_write(self.user_storage.update, prompt)
+        
+        template_cache.put(prompt.id, prompt.updated_at, prompt.content)
+        return prompt
     
     def delete_user_prompt(self, prompt_id: str, user_id: str) -> bool:
         """Delete user prompt."""
-        user_prompts = self._load_user_prompts()
-        
-        # Find and remove prompt
-        for prompt_type in ['internal', 'external']:
-            prompts_list = user_prompts.get(prompt_type, [])
-            for i, prompt in enumerate(prompts_list):
-                if prompt.id == prompt_id and prompt.created_by == user_id:
-                    prompts_list.pop(i)
-                    self._save_user_prompts(user_prompts)
-                    return True
-        
-        return False
+        with self.user_storage.write_lock():
+            catalog = self._get_catalog()
+            
+            prompt = catalog.user_prompts.get(prompt_id)
+            if prompt is None or prompt.created_by != user_id:
+                return False
+            
+            catalog.remove_user_prompt(prompt_id)
+            self._store_user_write(self.user_storage.delete, prompt_id)
+        return True
     
     def duplicate_prompt(self, prompt_id: str, user_id: str, 
                         new_title: Optional[str] = None) -> Optional[UserPrompt]:
@@ -265,58 +408,80 @@ class PromptService:
         
         return self.create_user_prompt(prompt_data, user_id)
     
+    def export_user_prompts(self, path: str) -> int:
+        """Export all user prompts to a user_prompts.json style file."""
+        prompts = list(self._get_catalog().user_prompts.values())
+        write_user_prompts_json(path, prompts)
+        return len(prompts)
+    
+    def import_user_prompts(self, path: str) -> int:
+        """Import (insert or replace) user prompts from a user_prompts.json style file."""
+        prompts = read_user_prompts_json(path)
+        
+        if isinstance(self.user_storage, SqliteUserPromptStorage):
+            self.user_storage.import_prompts(prompts)
+            self._user_loaded = False
+        else:
+            with self.user_storage.write_lock():
+                catalog = self._get_catalog()
+                for prompt in prompts:
+                    catalog.put_user_prompt(prompt)
+                self._store_user_write(self.user_storage.insert, None)
+        return len(prompts)
+    
     def get_user_prompts(self, user_id: str) -> List[UserPrompt]:
         """Get all prompts created by a specific user."""
-        user_prompts = self._load_user_prompts()
-        
-        result = []
-        for prompt_type in ['internal', 'external']:
-            for prompt in user_prompts.get(prompt_type, []):
-                if prompt.created_by == user_id:
-                    result.append(prompt)
-        
-        return result
+        return self._get_catalog().prompts_by_author(user_id)
     
     def get_categories(self) -> List[str]:
         """Get all unique categories from system and user prompts."""
-        categories = set()
-        
-        # System prompts
-        system_prompts = self._load_system_prompts()
-        for prompt_type in ['internal', 'external']:
-            for prompt in system_prompts.get(prompt_type, []):
-                categories.add(prompt.category)
-        
-        # User prompts
-        user_prompts = self._load_user_prompts()
-        for prompt_type in ['internal', 'external']:
-            for prompt in user_prompts.get(prompt_type, []):
-                categories.add(prompt.category)
-        
-        return sorted(list(categories))
+        return self._get_catalog().categories()
     
     def search_prompts(self, query: str, user_id: Optional[str] = None, 
                       category: Optional[str] = None, 
-                      prompt_type: Optional[PromptType] = None) -> Dict[str, List[Dict[str, Any]]]:
-        """Search prompts by title, content, or category."""
-        all_prompts = self.get_all_prompts(user_id)
+                      prompt_type: Optional[PromptType] = None,
+                      facets: bool = False) -> Dict[str, Any]:
+        """Search prompts by title, description, content or category.
+        
+        Results are ranked by BM25 score (accent-insensitive, with prefix
+        matching) and grouped by type. With facets, a "facets" entry gives
+        the counts per category and type of the visible matches, before the
+        category/type filters.
+        """
+        catalog = self._get_catalog()
         
-        result = {"internal": [], "external": []}
+        if tokenize(query):
+            matches = catalog.search_index.search(query)
+        else:
+            # Requête vide : tout le catalogue visible, dans l'ordre habituel
+            matches = [(prompt_id, 0.0) for prompt_id in catalog.system_prompts]
+            matches += [(prompt.id, 0.0) for prompt in catalog.visible_user_prompts(user_id)]
+        
+        result: Dict[str, Any] = {prompt_type_: [] for prompt_type_ in PROMPT_TYPES}
+        counts = {"category": {}, "type": {}}
         
-        for ptype in ['internal', 'external']:
+        for prompt_id, score in matches:
+            prompt, source = catalog.get(prompt_id)
+            if prompt is None:
+                continue
+            if source == 'user' and not catalog.is_visible(prompt, user_id):
+                continue
+            
+            ptype = prompt.type.value
+            counts["category"][prompt.category] = counts["category"].get(prompt.category, 0) + 1
+            counts["type"][ptype] = counts["type"].get(ptype, 0) + 1
+            
+            # Filter by category and type
+            if category and prompt.category != category:
+                continue
             if prompt_type and ptype != prompt_type.value:
                 continue
-                
-            for prompt in all_prompts.get(ptype, []):
-                # Filter by category
-                if category and prompt.get('category') != category:
-                    continue
-                
-                # Search in title and content
-                query_lower = query.lower()
-                if (query_lower in prompt.get('title', '').lower() or 
-                    query_lower in prompt.get('content', '').lower() or
-                    query_lower in prompt.get('category', '').lower()):
-                    result[ptype].append(prompt)
+            
+            result.setdefault(ptype, []).append({
+                **self._with_access(catalog, prompt, source, user_id),
+                'score': round(score, 4)
+            })
         
+        if facets:
+            result["facets"] = counts
         return result
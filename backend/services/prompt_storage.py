@@ -0,0 +1,291 @@
+"""
+Backends de stockage des prompts utilisateur (fichier JSON ou base SQLite).
+"""
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Callable, Iterable
+
+from backend.models import UserPrompt, PromptType
+from backend.services.json_store import JsonFileStore, atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TYPES = ['internal', 'external']
+
+def _empty_user_prompts() -> Dict[str, list]:
+    return {prompt_type: [] for prompt_type in PROMPT_TYPES}
+
+def _parse_user_prompts(data: Dict[str, Any]) -> List[UserPrompt]:
+    prompts = []
+    for prompt_type in PROMPT_TYPES:
+        for prompt in data.get(prompt_type, []):
+            prompts.append(UserPrompt(type=PromptType(prompt_type), **prompt))
+    return prompts
+
+def _serialize_user_prompts(prompts: Iterable[UserPrompt]) -> Dict[str, list]:
+    data = _empty_user_prompts()
+    for prompt in prompts:
+        data.setdefault(prompt.type.value, []).append(prompt.dict(exclude={'type'}))
+    return data
+
+def read_user_prompts_json(path: str) -> List[UserPrompt]:
+    """Read user prompts from a user_prompts.json style file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return _parse_user_prompts(json.load(f))
+
+def write_user_prompts_json(path: str, prompts: Iterable[UserPrompt]):
+    """Write user prompts to a user_prompts.json style file."""
+    atomic_write_json(
+        path, _serialize_user_prompts(prompts), indent=2, ensure_ascii=False, default=str
+    )
+
+class JsonUserPromptStorage:
+    """User prompts stored in a single JSON file, rewritten on every change."""
+
+    def __init__(self, path: str, snapshot: Callable[[], Iterable[UserPrompt]]):
+        # snapshot() retourne l'état complet à écrire (le catalogue résident)
+        self.path = path
+        self._snapshot = snapshot
+        self.store = JsonFileStore(path, default_factory=_empty_user_prompts)
+        with self.store.lock():
+            if not Path(self.path).exists():
+                self.store.write(_empty_user_prompts())
+
+    def signature(self) -> Optional[tuple]:
+        """Token that changes whenever the stored prompts change."""
+        return self.store.signature()
+
+    def write_lock(self):
+        """Exclusive lock to hold around a read-modify-write cycle."""
+        return self.store.lock()
+
+    def follows(self, previous: Optional[tuple], signature: Optional[tuple]) -> bool:
+        """True if signature is the write right after previous (nothing missed in between)."""
+        # Fichier verrouillé pendant tout le cycle : aucune écriture intercalée
+        return True
+
+    def load(self) -> List[UserPrompt]:
+        try:
+            return _parse_user_prompts(self.store.read())
+        except Exception as e:
+            logger.error(f"Error loading user prompts: {e}")
+            return []
+
+    def _save(self) -> Optional[tuple]:
+        try:
+            self.store.write(_serialize_user_prompts(self._snapshot()), default=str)
+        except Exception as e:
+            logger.error(f"Error saving user prompts: {e}")
+            raise
+        return self.signature()
+
+    # Chaque écriture retourne la nouvelle signature du stockage
+    def insert(self, prompt: UserPrompt) -> Optional[tuple]:
+        return self._save()
+
+    def update(self, prompt: UserPrompt) -> Optional[tuple]:
+        return self._save()
+
+    def delete(self, prompt_id: str) -> Optional[tuple]:
+        return self._save()
+
+class SqliteUserPromptStorage:
+    """User prompts stored one row per prompt in a SQLite database (WAL mode)."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        # Profondeur de la transaction en cours (write_lock et écritures imbriquées)
+        self._depth = 0
+        self._conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._init_db()
+
+    def _init_db(self):
+        """Create the schema and enable WAL journaling."""
+        conn = self._conn
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_prompts (
+                id TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                created_by TEXT NOT NULL,
+                is_public INTEGER NOT NULL DEFAULT 0,
+                category TEXT NOT NULL,
+                updated_at TEXT,
+                data TEXT NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_prompts_created_by ON user_prompts (created_by)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_prompts_is_public ON user_prompts (is_public)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_prompts_category ON user_prompts (category)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_prompts_type ON user_prompts (type)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0')")
+
+    @contextmanager
+    def _transaction(self):
+        """One IMMEDIATE transaction; nested calls join the outer one."""
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self._conn
+                finally:
+                    self._depth -= 1
+                return
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._depth = 1
+            try:
+                yield self._conn
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            finally:
+                self._depth = 0
+
+    def write_lock(self):
+        """Hold an IMMEDIATE transaction around a read-modify-write cycle.
+
+        Other workers cannot write until it ends, so the prompts read inside
+        are current; the writes made inside commit with it.
+        """
+        return self._transaction()
+
+    def follows(self, previous: Optional[tuple], signature: Optional[tuple]) -> bool:
+        """True if signature is the write right after previous (nothing missed in between)."""
+        return previous is not None and signature == ('sqlite', previous[1] + 1)
+
+    def signature(self) -> Optional[tuple]:
+        """Token that changes whenever the stored prompts change."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return ('sqlite', int(row[0])) if row else None
+
+    def _row(self, prompt: UserPrompt) -> Dict[str, Any]:
+        return {
+            'id': prompt.id,
+            'type': prompt.type.value,
+            'created_by': prompt.created_by,
+            'is_public': 1 if prompt.is_public else 0,
+            'category': prompt.category,
+            'updated_at': prompt.updated_at.isoformat() if prompt.updated_at else None,
+            'data': json.dumps(prompt.dict(exclude={'type'}), ensure_ascii=False, default=str),
+        }
+
+    def _write(self, statements: Callable[[sqlite3.Connection], None]) -> tuple:
+        """Run statements in one IMMEDIATE transaction (the write_lock one if held),
+        bump and return the version."""
+        with self._transaction() as conn:
+            statements(conn)
+            conn.execute(
+                "UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'"
+            )
+            version = conn.execute(
+                "SELECT value FROM meta WHERE key = 'version'"
+            ).fetchone()[0]
+        return ('sqlite', int(version))
+
+    def load(self) -> List[UserPrompt]:
+        prompts = []
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT type, data FROM user_prompts ORDER BY position'
+            ).fetchall()
+        for prompt_type, data in rows:
+            try:
+                prompts.append(UserPrompt(type=PromptType(prompt_type), **json.loads(data)))
+            except Exception as e:
+                logger.error(f"Error loading user prompt row: {e}")
+        return prompts
+
+    def insert(self, prompt: UserPrompt) -> tuple:
+        row = self._row(prompt)
+        return self._write(lambda conn: conn.execute('''
+            INSERT INTO user_prompts (id, position, type, created_by, is_public, category, updated_at, data)
+            VALUES (:id, (SELECT COALESCE(MAX(position), 0) + 1 FROM user_prompts),
+                    :type, :created_by, :is_public, :category, :updated_at, :data)
+        ''', row))
+
+    def update(self, prompt: UserPrompt) -> tuple:
+        row = self._row(prompt)
+        return self._write(lambda conn: conn.execute('''
+            UPDATE user_prompts
+            SET type = :type, created_by = :created_by, is_public = :is_public,
+                category = :category, updated_at = :updated_at, data = :data
+            WHERE id = :id
+        ''', row))
+
+    def delete(self, prompt_id: str) -> tuple:
+        return self._write(lambda conn: conn.execute(
+            'DELETE FROM user_prompts WHERE id = ?', (prompt_id,)
+        ))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM user_prompts').fetchone()[0]
+
+    def import_prompts(self, prompts: Iterable[UserPrompt]) -> int:
+        """Insert or replace prompts in bulk, keeping their order. Returns the count."""
+        rows = [self._row(prompt) for prompt in prompts]
+
+        def statements(conn):
+            start = conn.execute('SELECT COALESCE(MAX(position), 0) FROM user_prompts').fetchone()[0]
+            for offset, row in enumerate(rows, 1):
+                conn.execute('''
+                    INSERT INTO user_prompts (id, position, type, created_by, is_public, category, updated_at, data)
+                    VALUES (:id, :position, :type, :created_by, :is_public, :category, :updated_at, :data)
+                    ON CONFLICT(id) DO UPDATE SET
+                        type = excluded.type, created_by = excluded.created_by,
+                        is_public = excluded.is_public, category = excluded.category,
+                        updated_at = excluded.updated_at, data = excluded.data
+                ''', {**row, 'position': start + offset})
+
+        self._write(statements)
+        return len(rows)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO meta (key, value) VALUES (?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                (key, value)
+            )
+
+def migrate_json_to_sqlite(json_path: str, storage: SqliteUserPromptStorage,
+                           force: bool = False) -> int:
+    """One-shot import of user_prompts.json into the SQLite store.
+
+    The migration is recorded in the database and skipped on later calls
+    unless force is True. Returns the number of imported prompts. Runs
+    under the store's write lock: with several workers starting together,
+    only the first one imports.
+    """
+    with storage.write_lock():
+        if not force and storage.get_meta('migrated_from_json'):
+            return 0
+        count = 0
+        if Path(json_path).exists():
+            count = storage.import_prompts(read_user_prompts_json(json_path))
+        storage.set_meta('migrated_from_json', json_path)
+    logger.info(f"Migrated {count} user prompts from {json_path} to {storage.db_path}")
+    return count
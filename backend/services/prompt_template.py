@@ -0,0 +1,94 @@
+"""
+Templates de prompts compilés : découpage unique en segments littéraux et
+variables {nom}, puis rendu en une seule passe.
+"""
+import re
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+PLACEHOLDER_PATTERN = re.compile(r'\{([^{}]+)\}')
+
+class CompiledTemplate:
+    """Prompt content split into literal text and {variable} placeholders."""
+
+    __slots__ = ('source', 'literals', 'names', 'placeholders')
+
+    def __init__(self, source: str):
+        self.source = source
+        # literals[i] précède names[i] ; literals[-1] termine le texte
+        self.literals: List[str] = []
+        self.names: List[str] = []
+
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(source):
+            self.literals.append(source[position:match.start()])
+            self.names.append(match.group(1))
+            position = match.end()
+        self.literals.append(source[position:])
+
+        self.placeholders = frozenset(self.names)
+
+    def render(self, values: Dict[str, str]) -> str:
+        """Substitute values in one pass; unknown placeholders are left as is."""
+        if not self.names:
+            return self.source
+
+        literals = self.literals
+        parts = []
+        for i, name in enumerate(self.names):
+            parts.append(literals[i])
+            value = values.get(name)
+            parts.append(value if value is not None else '{' + name + '}')
+        parts.append(literals[-1])
+        return ''.join(parts)
+
+    def missing(self, provided: Iterable[str]) -> List[str]:
+        """Placeholders without a provided value."""
+        return sorted(self.placeholders.difference(provided))
+
+class TemplateCache:
+    """LRU of compiled templates keyed by prompt id and version (updated_at)."""
+
+    def __init__(self, max_size: int = 512):
+        self._by_prompt: "OrderedDict[Tuple[str, Any], CompiledTemplate]" = OrderedDict()
+        self._by_content: "OrderedDict[str, CompiledTemplate]" = OrderedDict()
+        self._max_size = max_size
+
+    def _store(self, cache: OrderedDict, key, template: CompiledTemplate):
+        cache[key] = template
+        cache.move_to_end(key)
+        if len(cache) > self._max_size:
+            cache.popitem(last=False)
+
+    def put(self, prompt_id: str, version: Any, content: str) -> CompiledTemplate:
+        """Compile a prompt version (called when the prompt is saved)."""
+        template = CompiledTemplate(content)
+        self._store(self._by_prompt, (prompt_id, version), template)
+        return template
+
+    def get(self, prompt_id: str, version: Any, content: str) -> CompiledTemplate:
+        """Compiled template for a prompt version, compiling it on first use."""
+        template = self._by_prompt.get((prompt_id, version))
+        if template is not None and (template.source is content or template.source == content):
+            self._by_prompt.move_to_end((prompt_id, version))
+            return template
+        return self.put(prompt_id, version, content)
+
+    def for_content(self, content: str) -> CompiledTemplate:
+        """Compiled template for ad hoc content (e.g. modified in the UI)."""
+        template = self._by_content.get(content)
+        if template is not None:
+            self._by_content.move_to_end(content)
+            return template
+        template = CompiledTemplate(content)
+        self._store(self._by_content, content, template)
+        return template
+
+# Cache partagé par les services du processus
+template_cache = TemplateCache()
+
+def template_for_prompt(prompt: Dict[str, Any], content: Optional[str] = None) -> CompiledTemplate:
+    """Compiled template for a prompt dict, or for content that replaces it."""
+    if content and content != prompt['content']:
+        return template_cache.for_content(content)
+    return template_cache.get(prompt['id'], prompt.get('updated_at'), prompt['content'])
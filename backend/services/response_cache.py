@@ -0,0 +1,288 @@
+"""
+Cache des réponses LLM pour les exécutions non streamées : un niveau LRU en
+mémoire par processus et un niveau disque SQLite partagé entre les workers,
+avec expiration (TTL) et taille maximale.
+
+Les accès au disque passent par un thread (lookup/store) pour ne pas bloquer
+la boucle asyncio ; la taille totale est tenue à jour dans la base.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from backend.config import config
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """Two-tier (memory LRU + SQLite) cache of LLM answers."""
+
+    def __init__(self, enabled: bool = False, memory_entries: int = 256,
+                 ttl_seconds: int = 86400, disk_path: Optional[str] = None,
+                 max_disk_mb: int = 200):
+        self.enabled = enabled
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+
+        # clé -> (réponse, date d'expiration)
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self.counters = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+
+        self.disk_path = disk_path
+        self.disk_enabled = bool(enabled and disk_path)
+        self._db: Optional[sqlite3.Connection] = None
+        self._opening = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'ResponseCache':
+        disk_enabled = config.getboolean('response_cache', 'disk_enabled', True)
+        data_dir = Path(config.get('storage', 'data_directory', fallback='data'))
+        return cls(
+            enabled=config.getboolean('response_cache', 'enabled', False),
+            memory_entries=config.getint('response_cache', 'memory_entries', 256),
+            ttl_seconds=config.getint('response_cache', 'ttl_seconds', 86400),
+            disk_path=config.get(
+                'response_cache', 'disk_path', str(data_dir / 'response_cache.db')
+            ) if disk_enabled else None,
+            max_disk_mb=config.getint('response_cache', 'max_disk_mb', 200),
+        )
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Connection opened on first use rather than when the module is imported."""
+        if self._db is None:
+            with self._opening:
+                if self._db is None:
+                    self._init_disk()
+        return self._db
+
+    def _init_disk(self):
+        Path(self.disk_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.disk_path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses (expires_at)')
+        # Taille totale tenue à jour à chaque écriture, partagée entre les
+        # workers ; calculée une seule fois
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO cache_meta (key, value)
+            SELECT 'bytes', COALESCE(SUM(size), 0) FROM responses
+        ''')
+        self._db = conn
+
+    @staticmethod
+    def make_key(server_url: str, model: str, final_prompt: str,
+                 params: Optional[Dict[str, Any]] = None) -> str:
+        """Cache key for (server, model, final prompt hash, generation params)."""
+        prompt_hash = hashlib.sha256(final_prompt.encode('utf-8')).hexdigest()
+        material = json.dumps(
+            [server_url.rstrip('/'), model, prompt_hash, params or {}], sort_keys=True
+        )
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached answer for a key, counting hits and misses (blocking, see lookup())."""
+        now = time.time()
+        result = self._memory_get(key, now)
+        if result is not None:
+            return result
+        return self._disk_result(key, self._disk_get(key, now))
+
+    async def lookup(self, key: str) -> Optional[str]:
+        """Cached answer for a key; the disk tier is read in a thread."""
+        now = time.time()
+        result = self._memory_get(key, now)
+        if result is not None:
+            return result
+        disk = await asyncio.to_thread(self._disk_get, key, now) if self.disk_enabled else None
+        return self._disk_result(key, disk)
+
+    def put(self, key: str, result: str):
+        """Store an answer in both tiers (blocking, see store())."""
+        self._disk_put(key, result, self._store_memory(key, result))
+
+    async def store(self, key: str, result: str):
+        """Store an answer in both tiers; the disk tier is written in a thread."""
+        expires_at = self._store_memory(key, result)
+        if self.disk_enabled:
+            await asyncio.to_thread(self._disk_put, key, result, expires_at)
+
+    def _memory_get(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.counters['hits'] += 1
+                    self.counters['memory_hits'] += 1
+                    return entry[0]
+                del self._memory[key]
+            return None
+
+    def _disk_result(self, key: str, result: Optional[Tuple[str, float]]) -> Optional[str]:
+        with self._lock:
+            if result is None:
+                self.counters['misses'] += 1
+                return None
+            self._remember(key, result[0], result[1])
+            self.counters['hits'] += 1
+            self.counters['disk_hits'] += 1
+            return result[0]
+
+    def _store_memory(self, key: str, result: str) -> float:
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, result, expires_at)
+            self.counters['stores'] += 1
+        return expires_at
+
+    def _remember(self, key: str, result: str, expires_at: float):
+        self._memory[key] = (result, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        if not self.disk_enabled:
+            return None
+        try:
+            with self._disk_lock:
+                row = self._conn.execute(
+                    'SELECT result, expires_at FROM responses WHERE key = ?', (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] <= now:
+                    self._conn.execute('BEGIN IMMEDIATE')
+                    try:
+                        self._delete_expired(now, key)
+                        self._conn.execute('COMMIT')
+                    except Exception:
+                        self._conn.execute('ROLLBACK')
+                        raise
+                    return None
+                self._conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+                return row[0], row[1]
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read failed: {e}")
+            return None
+
+    def _disk_put(self, key: str, result: str, expires_at: float):
+        if not self.disk_enabled:
+            return
+        size = len(result.encode('utf-8'))
+        now = time.time()
+        try:
+            with self._disk_lock:
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    previous = self._conn.execute(
+                        'SELECT size FROM responses WHERE key = ?', (key,)
+                    ).fetchone()
+                    self._conn.execute('''
+                        INSERT INTO responses (key, result, size, expires_at, last_access)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(key) DO UPDATE SET
+                            result = excluded.result, size = excluded.size,
+                            expires_at = excluded.expires_at, last_access = excluded.last_access
+                    ''', (key, result, size, expires_at, now))
+                    total = self._add_bytes(size - (previous[0] if previous else 0))
+                    self._evict(now, total)
+                    self._conn.execute('COMMIT')
+                except Exception:
+                    self._conn.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache write failed: {e}")
+
+    def _add_bytes(self, delta: int) -> int:
+        """Update the stored total size; returns the new total."""
+        if delta:
+            self._conn.execute("UPDATE cache_meta SET value = value + ? WHERE key = 'bytes'", (delta,))
+        return self._conn.execute("SELECT value FROM cache_meta WHERE key = 'bytes'").fetchone()[0]
+
+    def _delete_expired(self, now: float, key: Optional[str] = None) -> int:
+        """Delete the expired entries (or the one of key); returns the freed size."""
+        where, params = 'expires_at <= ?', (now,)
+        if key is not None:
+            where, params = 'key = ? AND expires_at <= ?', (key, now)
+        freed = self._conn.execute(
+            f'SELECT COALESCE(SUM(size), 0) FROM responses WHERE {where}', params
+        ).fetchone()[0]
+        if freed:
+            self._conn.execute(f'DELETE FROM responses WHERE {where}', params)
+            self._add_bytes(-freed)
+        return freed
+
+    def _evict(self, now: float, total: int):
+        """Drop expired entries, then the least recently used ones above the size limit."""
+        conn = self._conn
+        total -= self._delete_expired(now)
+        if total <= self.max_disk_bytes:
+            return
+        excess = total - self.max_disk_bytes
+        freed = 0
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY last_access'):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany('DELETE FROM responses WHERE key = ?', victims)
+        self._add_bytes(-freed)
+
+    def clear(self):
+        """Empty both tiers."""
+        with self._lock:
+            self._memory.clear()
+        if self.disk_enabled:
+            with self._disk_lock:
+                self._conn.execute('BEGIN IMMEDIATE')
+                self._conn.execute('DELETE FROM responses')
+                self._conn.execute("UPDATE cache_meta SET value = 0 WHERE key = 'bytes'")
+                self._conn.execute('COMMIT')
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['enabled'] = self.enabled
+            stats['memory_entries'] = len(self._memory)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        if self.disk_enabled:
+            with self._disk_lock:
+                stats['disk_entries'] = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+                stats['disk_bytes'] = self._add_bytes(0)
+        return stats
+
+# Cache partagé par les services du processus
+response_cache = ResponseCache.from_config()
@@ -0,0 +1,157 @@
+"""
+Regroupement des requêtes LLM identiques en cours (« single flight ») : une
+seule génération amont par clé (serveur, modèle, prompt final, paramètres),
+partagée par tous les demandeurs arrivés pendant qu'elle tourne.
+"""
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from backend.services.response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+class _Flight:
+    """A generation shared by several subscribers."""
+
+    def __init__(self, on_abandon: Optional[Callable[[], None]] = None):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.on_abandon = on_abandon
+        self.meta: Dict[str, Any] = {}
+        self._event = asyncio.Event()
+
+    def publish(self):
+        """Wake up every subscriber waiting for new chunks."""
+        self._event.set()
+        self._event = asyncio.Event()
+
+class _Call:
+    """A non-streaming call shared by several waiters."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """Coalesce identical in-flight LLM calls and streams."""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Flight] = {}
+        self.counters = {'started': 0, 'coalesced': 0}
+
+    # Même identité de requête que le cache des réponses
+    make_key = staticmethod(ResponseCache.make_key)
+
+    def is_calling(self, key: str) -> bool:
+        return key in self._calls
+
+    def is_streaming(self, key: str) -> bool:
+        return key in self._streams
+
+    # ----- Appels non streamés -----
+
+    async def call(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run factory() once for all concurrent callers with the same key."""
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = entry
+            entry.task.add_done_callback(lambda task: self._forget_call(key, entry))
+            self.counters['started'] += 1
+        else:
+            self.counters['coalesced'] += 1
+
+        entry.waiters += 1
+        try:
+            # shield : l'annulation d'un demandeur n'interrompt pas les autres
+            return await asyncio.shield(entry.task)
+        finally:
+            entry.waiters -= 1
+            if entry.waiters == 0 and not entry.task.done():
+                entry.task.cancel()
+                self._forget_call(key, entry)
+
+    def _forget_call(self, key: str, entry: _Call):
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+
+    # ----- Flux -----
+
+    async def stream(self, key: str, factory: Callable[[Dict[str, Any]], AsyncIterator[str]],
+                     on_abandon: Optional[Callable[[], None]] = None,
+                     info: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
+        """Subscribe to the generation for key, starting it if needed.
+
+        factory(meta) produces the chunks and may record details in meta;
+        every subscriber gets them copied into info at the end of the stream.
+        Late subscribers first receive the chunks already produced, then the
+        live ones. The generation is cancelled when its last subscriber
+        leaves; on_abandon is then called (used to free resources that the
+        generation would have released had it started).
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _Flight(on_abandon)
+            self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._produce(key, flight, factory))
+            self.counters['started'] += 1
+        else:
+            self.counters['coalesced'] += 1
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                event = flight._event
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    if info is not None:
+                        info.update(flight.meta)
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await event.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                flight.task.cancel()
+                self._forget_stream(key, flight)
+                if flight.on_abandon is not None:
+                    flight.on_abandon()
+
+    async def _produce(self, key: str, flight: _Flight,
+                       factory: Callable[[Dict[str, Any]], AsyncIterator[str]]):
+        try:
+            async for chunk in factory(flight.meta):
+                flight.chunks.append(chunk)
+                flight.publish()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Shared LLM stream failed: {e}")
+            flight.error = e
+        finally:
+            flight.done = True
+            self._forget_stream(key, flight)
+            flight.publish()
+
+    def _forget_stream(self, key: str, flight: _Flight):
+        if self._streams.get(key) is flight:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **self.counters,
+            'calls_in_flight': len(self._calls),
+            'streams_in_flight': len(self._streams),
+        }
+
+# Regroupement partagé par les services du processus
+single_flight = SingleFlight()
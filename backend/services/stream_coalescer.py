@@ -0,0 +1,107 @@
+"""
+Regroupement des tokens envoyés au navigateur : au lieu d'un événement SSE
+par token, les tokens accumulés sont envoyés toutes les N ms ou dès que M
+octets sont en attente. Le premier token part immédiatement.
+"""
+import asyncio
+import json
+import time
+from typing import AsyncGenerator, AsyncIterator, Dict, Optional
+
+from backend.config import config
+
+class FrameCoalescer:
+    """Coalesce upstream chunks into fewer, larger SSE frames."""
+
+    def __init__(self, enabled: bool = True, flush_ms: int = 50, flush_bytes: int = 2048):
+        self.enabled = enabled
+        self.flush_interval = flush_ms / 1000
+        self.flush_bytes = flush_bytes
+        self.counters = {'chunks': 0, 'frames': 0, 'bytes': 0}
+
+    @classmethod
+    def from_config(cls) -> 'FrameCoalescer':
+        return cls(
+            enabled=config.getboolean('streaming', 'coalesce_enabled', True),
+            flush_ms=config.getint('streaming', 'coalesce_ms', 50),
+            flush_bytes=config.getint('streaming', 'coalesce_bytes', 2048),
+        )
+
+    async def coalesce(self, chunks: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """Yield the chunks grouped by time and size; the first one without delay."""
+        if not self.enabled:
+            async for chunk in chunks:
+                self.counters['chunks'] += 1
+                yield chunk
+            return
+
+        iterator = chunks.__aiter__()
+        pending: Optional[asyncio.Future] = None
+        buffer = []
+        size = 0
+        first = True
+        last_flush = time.monotonic()
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                if buffer:
+                    # Attendre le token suivant au plus jusqu'à l'échéance d'envoi
+                    remaining = self.flush_interval - (time.monotonic() - last_flush)
+                    done, _ = await asyncio.wait({pending}, timeout=max(0.0, remaining))
+                    if not done:
+                        yield ''.join(buffer)
+                        buffer, size = [], 0
+                        last_flush = time.monotonic()
+                        continue
+                try:
+                    chunk = await pending
+                except StopAsyncIteration:
+                    break
+                finally:
+                    if pending.done():
+                        pending = None
+
+                self.counters['chunks'] += 1
+                if first:
+                    # Le premier token n'attend pas : temps de première réponse inchangé
+                    first = False
+                    last_flush = time.monotonic()
+                    yield chunk
+                    continue
+                buffer.append(chunk)
+                size += len(chunk)
+                if size >= self.flush_bytes or time.monotonic() - last_flush >= self.flush_interval:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+                    last_flush = time.monotonic()
+            if buffer:
+                yield ''.join(buffer)
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+                try:
+                    await pending
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+            aclose = getattr(chunks, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    async def sse(self, chunks: AsyncIterator[str], field: str) -> AsyncGenerator[str, None]:
+        """SSE frames {field: text} for the coalesced chunks, counted."""
+        async for text in self.coalesce(chunks):
+            frame = f"data: {json.dumps({field: text})}\n\n"
+            self.counters['frames'] += 1
+            self.counters['bytes'] += len(frame)
+            yield frame
+
+    def stats(self) -> Dict[str, float]:
+        frames = self.counters['frames']
+        return {
+            **self.counters,
+            'chunks_per_frame': round(self.counters['chunks'] / frames, 2) if frames else None,
+        }
+
+# Regroupement partagé par les routes de streaming
+frame_coalescer = FrameCoalescer.from_config()
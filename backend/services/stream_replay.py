@@ -0,0 +1,498 @@
+"""
+Reprise des flux SSE après une coupure réseau. Les événements de chaque
+exécution sont numérotés (id: <execution_id>:<n>) et conservés dans un
+tampon borné ; une reconnexion avec l'en-tête Last-Event-ID renvoie les
+événements manqués puis suit la génération en cours, sans nouvel appel au
+serveur LLM.
+
+La génération tourne indépendamment de la connexion : si le client part,
+elle est interrompue, ou continue pendant resume_grace secondes en attendant
+une reprise si ce délai est configuré. Les tampons expirent après replay_ttl secondes sans
+nouvel événement et les plus anciens sont évincés au-delà de replay_max_mb.
+
+Avec plusieurs workers, les événements sont aussi recopiés par lots en
+SQLite (à côté des résultats d'exécution) : une reprise arrivée sur un
+autre processus les relit toutes les replay_poll_ms millisecondes, et la
+génération continue tant qu'un tel lecteur se manifeste.
+"""
+import asyncio
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from backend.config import config
+from backend.services.execution_control import shared_state_enabled, shared_state_path
+
+logger = logging.getLogger(__name__)
+
+class ReplayBuffer:
+    """Sequence-numbered SSE frames of one execution and its current readers."""
+
+    # Délai laissé à la réponse pour commencer avant que l'exécution soit
+    # considérée comme abandonnée
+    start_grace = 5.0
+
+    def __init__(self, execution_id: str, user_id: Optional[str], grace: float, resumable: bool):
+        self.execution_id = execution_id
+        self.user_id = user_id
+        self.grace = grace
+        # False une fois évincé : plus de reprise, seuls les lecteurs en cours
+        # sont servis et les événements qu'ils ont reçus sont libérés
+        self.resumable = resumable
+        self.frames: List[str] = []
+        self.base = 1  # numéro du premier événement de frames
+        self.last_seq = 0
+        self.size = 0
+        self.closed = False
+        self.updated_at = time.monotonic()
+        self._changed = asyncio.Event()
+        self._cursors: Dict[int, int] = {}
+        self._readers = itertools.count()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._joined = asyncio.Event()
+        self._started = False
+        # Lecteur suivant la copie partagée depuis un autre processus
+        self.remote_reader: Optional[Callable[[], Awaitable[bool]]] = None
+
+    def append(self, frame: str) -> int:
+        """Number and store a frame; returns the stored size."""
+        self.last_seq += 1
+        frame = f"id: {self.execution_id}:{self.last_seq}\n{frame}"
+        self.frames.append(frame)
+        self.size += len(frame)
+        self._wake()
+        return len(frame)
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        self.updated_at = time.monotonic()
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def since(self, seq: int) -> List[Tuple[int, str]]:
+        start = max(seq + 1, self.base)
+        return [(n, self.frames[n - self.base]) for n in range(start, self.last_seq + 1)]
+
+    def attach(self, seq: int) -> int:
+        reader = next(self._readers)
+        self._cursors[reader] = seq
+        self._idle.clear()
+        self._joined.set()
+        self._started = True
+        return reader
+
+    def ack(self, reader: int, seq: int):
+        self._cursors[reader] = seq
+        if not self.resumable:
+            self.trim()
+
+    def detach(self, reader: int):
+        self._cursors.pop(reader, None)
+        if not self._cursors:
+            self._joined.clear()
+            self._idle.set()
+        if not self.resumable:
+            self.trim()
+
+    def trim(self) -> int:
+        """Drop the frames every reader has received; returns the freed size."""
+        upto = min(self._cursors.values(), default=self.last_seq)
+        count = max(0, upto - self.base + 1)
+        if not count:
+            return 0
+        freed = sum(len(frame) for frame in self.frames[:count])
+        del self.frames[:count]
+        self.base += count
+        self.size -= freed
+        return freed
+
+    def changed(self) -> Awaitable[bool]:
+        """Awaitable completing at the next frame or at the end of the stream."""
+        # Événement pris tout de suite : un ajout avant la première attente
+        # n'est pas manqué
+        return self._changed.wait()
+
+    async def abandoned(self):
+        """Complete once the execution has had no reader for `grace` seconds."""
+        while True:
+            await self._idle.wait()
+            delay = self.grace if self.resumable else 0
+            if not self._started:
+                delay = max(delay, self.start_grace)
+            try:
+                await asyncio.wait_for(self._joined.wait(), delay)
+            except asyncio.TimeoutError:
+                if self.resumable and self.remote_reader is not None and await self.remote_reader():
+                    continue
+                return
+
+class StreamReplay:
+    """Replay buffers of the running and recently finished streamed executions.
+
+    With a path, the frames are mirrored to a SQLite database shared by the
+    worker processes, so a stream can be resumed on any of them.
+    """
+
+    def __init__(self, enabled: bool = True, ttl: int = 300, max_mb: int = 64, grace: float = 0.0,
+                 path: Optional[str] = None, poll: float = 0.1):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_bytes = max_mb * 1024 * 1024
+        self.grace = grace
+        self.path = path
+        # Intervalle des écritures par lots et des relectures de la copie partagée
+        self.poll = poll
+        self._buffers: Dict[str, ReplayBuffer] = {}
+        self._tasks = set()
+        self.size = 0
+        self.counters = {'streams': 0, 'resumed': 0, 'frames_replayed': 0, 'evicted': 0, 'expired': 0}
+        self._swept = 0.0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._opening = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> 'StreamReplay':
+        return cls(
+            enabled=config.getboolean('streaming', 'replay_enabled', True),
+            ttl=config.getint('streaming', 'replay_ttl', 300),
+            max_mb=config.getint('streaming', 'replay_max_mb', 64),
+            grace=config.getfloat('streaming', 'resume_grace', 0.0),
+            path=shared_state_path() if shared_state_enabled() else None,
+            poll=config.getint('streaming', 'replay_poll_ms', 100) / 1000,
+        )
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Connection opened on first use rather than when the module is imported."""
+        if self._db is None:
+            with self._opening:
+                if self._db is None:
+                    self._init_db()
+        return self._db
+
+    def _init_db(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS replay_streams (
+                execution_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                last_seq INTEGER NOT NULL,
+                closed INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                reader_seen REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS replay_frames (
+                execution_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                frame TEXT NOT NULL,
+                PRIMARY KEY (execution_id, seq)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_replay_updated ON replay_streams (updated_at)')
+        self._db = conn
+
+    def open(self, execution_id: str, user_id: Optional[str] = None) -> ReplayBuffer:
+        """Buffer of a new execution, resumable unless replay is disabled."""
+        self._expire()
+        buffer = ReplayBuffer(execution_id, user_id, self.grace if self.enabled else 0, self.enabled)
+        if self.enabled:
+            self._buffers[execution_id] = buffer
+            if self.path:
+                buffer.remote_reader = lambda: self._has_remote_reader(execution_id)
+        self.counters['streams'] += 1
+        return buffer
+
+    def stream(self, buffer: ReplayBuffer, frames: AsyncIterator[str],
+               disconnected: Optional[Callable[[], Awaitable[Any]]] = None) -> AsyncGenerator[str, None]:
+        """Run frames into the buffer in the background and follow it from the start.
+
+        The producer should stop when buffer.abandoned() completes.
+        """
+        self._spawn(self._produce(buffer, frames))
+        if self.path and buffer.resumable:
+            self._spawn(self._mirror(buffer))
+        return self.follow(buffer, 0, disconnected)
+
+    def _spawn(self, coro: Awaitable[Any]):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _produce(self, buffer: ReplayBuffer, frames: AsyncIterator[str]):
+        try:
+            async for frame in frames:
+                size = buffer.append(frame)
+                if buffer.resumable and self._buffers.get(buffer.execution_id) is buffer:
+                    self.size += size
+                    if self.size > self.max_bytes:
+                        self._evict()
+                elif not buffer.resumable:
+                    buffer.trim()
+        except Exception as e:
+            logger.error(f"Stream {buffer.execution_id} failed: {e}")
+        finally:
+            buffer.close()
+
+    async def resume(self, last_event_id: Optional[str], user_id: Optional[str] = None,
+                     disconnected: Optional[Callable[[], Awaitable[Any]]] = None
+                     ) -> Optional[AsyncGenerator[str, None]]:
+        """Frames after the position designated by a Last-Event-ID header, then
+        the live ones; None if the stream is no longer available.
+
+        Streams of other worker processes are followed through the shared copy.
+        """
+        if not last_event_id or ':' not in last_event_id:
+            return None
+        execution_id, _, seq = last_event_id.strip().rpartition(':')
+        if not seq.isdigit():
+            return None
+        seq = int(seq)
+        buffer = self._buffers.get(execution_id)
+        if buffer is not None:
+            owner, last_seq, first_seq = buffer.user_id, buffer.last_seq, buffer.base
+        elif self.path and self.enabled:
+            shared = await asyncio.to_thread(self._shared_stream, execution_id)
+            if shared is None:
+                owner = last_seq = first_seq = None
+            else:
+                owner, last_seq = shared
+                first_seq = 1
+        else:
+            last_seq = None
+        if last_seq is None:
+            logger.info(f"Stream {execution_id} cannot be resumed (expired or unknown)")
+            return None
+        if owner is not None and owner != user_id:
+            return None
+        if seq > last_seq or seq < first_seq - 1:
+            return None
+        self.counters['resumed'] += 1
+        self.counters['frames_replayed'] += last_seq - seq
+        if buffer is not None:
+            return self.follow(buffer, seq, disconnected)
+        return self._follow_shared(execution_id, seq, disconnected)
+
+    async def follow(self, buffer: ReplayBuffer, seq: int,
+                     disconnected: Optional[Callable[[], Awaitable[Any]]] = None) -> AsyncGenerator[str, None]:
+        """Frames after seq, then the live ones until the stream ends or the client leaves."""
+        # Lecteur enregistré une fois la réponse commencée : une réponse jamais
+        # itérée ne retient pas l'exécution
+        reader = buffer.attach(seq)
+        gone = asyncio.ensure_future(disconnected()) if disconnected is not None else None
+        changed: Optional[asyncio.Future] = None
+        try:
+            while True:
+                for seq, frame in buffer.since(seq):
+                    yield frame
+                    buffer.ack(reader, seq)
+                if buffer.closed and seq >= buffer.last_seq:
+                    return
+                changed = asyncio.ensure_future(buffer.changed())
+                waiting = {changed, gone} if gone is not None else {changed}
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if gone is not None and gone in done:
+                    return
+        finally:
+            for future in (changed, gone):
+                if future is not None and not future.done():
+                    future.cancel()
+            buffer.detach(reader)
+
+    # ----- Copie partagée entre processus -----
+
+    async def _mirror(self, buffer: ReplayBuffer):
+        """Copy the frames of a buffer to the shared database, in batches, until it ends."""
+        flushed = 0
+        while buffer.resumable:
+            # Événement pris avant la lecture : un ajout pendant l'écriture n'est pas manqué
+            changed = buffer.changed()
+            closed = buffer.closed
+            frames = buffer.since(flushed)
+            if frames or closed:
+                try:
+                    await asyncio.to_thread(self._store_frames, buffer, frames, closed)
+                    if frames:
+                        flushed = frames[-1][0]
+                except sqlite3.Error as e:
+                    logger.warning(f"Replay mirror of {buffer.execution_id} failed: {e}")
+            if closed:
+                changed.close()
+                return
+            await changed
+            await asyncio.sleep(self.poll)
+
+    def _store_frames(self, buffer: ReplayBuffer, frames: List[Tuple[int, str]], closed: bool):
+        last_seq = frames[-1][0] if frames else buffer.last_seq
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute('''
+                    INSERT INTO replay_streams (execution_id, user_id, last_seq, closed, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (execution_id) DO UPDATE SET
+                        last_seq = excluded.last_seq, closed = excluded.closed,
+                        updated_at = excluded.updated_at
+                ''', (buffer.execution_id, buffer.user_id, last_seq, int(closed), time.time()))
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO replay_frames (execution_id, seq, frame) VALUES (?, ?, ?)',
+                    [(buffer.execution_id, seq, frame) for seq, frame in frames]
+                )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _shared_stream(self, execution_id: str) -> Optional[Tuple[Optional[str], int]]:
+        """Owner and last sequence number of a stream in the shared copy."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT user_id, last_seq FROM replay_streams WHERE execution_id = ? AND updated_at >= ?',
+                (execution_id, time.time() - self.ttl)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _read_shared(self, execution_id: str, seq: int) -> Tuple[List[Tuple[int, str]], bool]:
+        """Frames after seq and whether the stream has ended; marks the reader as present."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    'UPDATE replay_streams SET reader_seen = ? WHERE execution_id = ?',
+                    (time.time(), execution_id)
+                )
+                stream = self._conn.execute(
+                    'SELECT closed FROM replay_streams WHERE execution_id = ?', (execution_id,)
+                ).fetchone()
+                frames = self._conn.execute('''
+                    SELECT seq, frame FROM replay_frames WHERE execution_id = ? AND seq > ? ORDER BY seq
+                ''', (execution_id, seq)).fetchall()
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        # Copie effacée (expirée ou évincée) : fin du flux pour ce lecteur
+        return frames, stream is None or bool(stream[0])
+
+    async def _follow_shared(self, execution_id: str, seq: int,
+                             disconnected: Optional[Callable[[], Awaitable[Any]]]) -> AsyncGenerator[str, None]:
+        gone = asyncio.ensure_future(disconnected()) if disconnected is not None else None
+        try:
+            while True:
+                frames, ended = await asyncio.to_thread(self._read_shared, execution_id, seq)
+                for seq, frame in frames:
+                    yield frame
+                if ended:
+                    return
+                if gone is None:
+                    await asyncio.sleep(self.poll)
+                else:
+                    await asyncio.wait({gone}, timeout=self.poll)
+                    if gone.done():
+                        return
+        finally:
+            if gone is not None and not gone.done():
+                gone.cancel()
+
+    async def _has_remote_reader(self, execution_id: str) -> bool:
+        """True if a process followed the shared copy within the grace delay."""
+        def seen() -> bool:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT reader_seen FROM replay_streams WHERE execution_id = ?', (execution_id,)
+                ).fetchone()
+            return bool(row and row[0] and row[0] >= time.time() - self.grace)
+        try:
+            return await asyncio.to_thread(seen)
+        except sqlite3.Error as e:
+            logger.warning(f"Replay reader check of {execution_id} failed: {e}")
+            return False
+
+    def _forget(self, execution_ids: List[str], expired: bool = False):
+        """Delete shared copies in the background, and those expired if asked."""
+        if not self.path or not (execution_ids or expired):
+            return
+
+        def delete():
+            with self._lock:
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    ids = list(execution_ids)
+                    if expired:
+                        ids += [row[0] for row in self._conn.execute(
+                            'SELECT execution_id FROM replay_streams WHERE updated_at < ?',
+                            (time.time() - self.ttl,)
+                        )]
+                    for execution_id in ids:
+                        self._conn.execute('DELETE FROM replay_frames WHERE execution_id = ?', (execution_id,))
+                        self._conn.execute('DELETE FROM replay_streams WHERE execution_id = ?', (execution_id,))
+                    self._conn.execute('COMMIT')
+                except BaseException:
+                    self._conn.execute('ROLLBACK')
+                    raise
+
+        async def run():
+            try:
+                await asyncio.to_thread(delete)
+            except sqlite3.Error as e:
+                logger.warning(f"Replay cleanup failed: {e}")
+
+        self._spawn(run())
+
+    # ----- Rétention -----
+
+    def _drop(self, buffer: ReplayBuffer):
+        """Stop retaining a buffer; its current readers are still served."""
+        self._buffers.pop(buffer.execution_id, None)
+        self.size -= buffer.size
+        buffer.resumable = False
+        buffer.trim()
+        self._forget([buffer.execution_id])
+
+    def _expire(self):
+        limit = time.monotonic() - self.ttl
+        for buffer in [b for b in self._buffers.values() if b.updated_at < limit]:
+            self._drop(buffer)
+            self.counters['expired'] += 1
+        # Copies laissées par un processus disparu, au plus une fois par minute
+        if time.monotonic() - self._swept >= min(self.ttl, 60):
+            self._swept = time.monotonic()
+            self._forget([], expired=True)
+
+    def _evict(self):
+        """Drop the oldest buffers, finished ones first, until under the memory limit."""
+        self._expire()
+        order = sorted(self._buffers.values(), key=lambda b: (not b.closed, b.updated_at))
+        for buffer in order:
+            if self.size <= self.max_bytes:
+                break
+            self._drop(buffer)
+            self.counters['evicted'] += 1
+            logger.info(f"Replay buffer of {buffer.execution_id} evicted (memory limit)")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            'buffers': len(self._buffers),
+            'running': sum(1 for b in self._buffers.values() if not b.closed),
+            'bytes': self.size,
+            'shared': bool(self.path),
+        }
+
+# Tampons partagés par les routes de streaming
+stream_replay = StreamReplay.from_config()
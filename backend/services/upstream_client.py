@@ -0,0 +1,98 @@
+"""
+Sessions HTTP partagées vers les serveurs LLM : une session aiohttp par
+upstream (schéma, hôte, port) avec pool keep-alive, limite de connexions par
+hôte et cache DNS. Évite une connexion TCP (et une négociation TLS) par appel.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+import aiohttp
+from yarl import URL
+
+from backend.config import config
+
+logger = logging.getLogger(__name__)
+
+UpstreamKey = Tuple[str, str, Optional[int]]
+
+def upstream_key(url: str) -> UpstreamKey:
+    """Identify the upstream a URL points to."""
+    parsed = URL(url)
+    return (parsed.scheme, parsed.host or '', parsed.port)
+
+class UpstreamConnectionManager:
+    """Process-wide pooled aiohttp sessions, one per LLM upstream."""
+
+    def __init__(self, timeout: int = 120, connect_timeout: int = 10,
+                 limit_per_host: int = 32, keepalive_timeout: int = 60,
+                 dns_cache_ttl: int = 300, request_timeout: int = 300):
+        # timeout = silence maximale entre deux lectures : une génération en
+        # streaming peut durer plus longtemps tant que des tokens arrivent
+        self.timeout = aiohttp.ClientTimeout(
+            total=None, connect=connect_timeout, sock_read=timeout
+        )
+        # Appels non streamés : rien n'arrive avant la fin de la génération,
+        # seule la durée totale est bornée (à passer en timeout= de la requête)
+        self.request_timeout = aiohttp.ClientTimeout(
+            total=request_timeout, connect=connect_timeout
+        )
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self._sessions: Dict[UpstreamKey, Tuple[asyncio.AbstractEventLoop, aiohttp.ClientSession]] = {}
+
+    @classmethod
+    def from_config(cls) -> 'UpstreamConnectionManager':
+        return cls(
+            timeout=config.getint('llm', 'timeout', 120),
+            connect_timeout=config.getint('llm', 'connect_timeout', 10),
+            limit_per_host=config.getint('llm', 'pool_limit_per_host', 32),
+            keepalive_timeout=config.getint('llm', 'keepalive_timeout', 60),
+            dns_cache_ttl=config.getint('llm', 'dns_cache_ttl', 300),
+            request_timeout=config.getint('llm', 'request_timeout', 300),
+        )
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit_per_host,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    def session(self, url: str) -> aiohttp.ClientSession:
+        """Pooled session for the upstream of url (must be called from the event loop)."""
+        loop = asyncio.get_running_loop()
+        key = upstream_key(url)
+        entry = self._sessions.get(key)
+        if entry is not None:
+            session_loop, session = entry
+            if session_loop is loop and not session.closed:
+                return session
+
+        session = self._create_session()
+        self._sessions[key] = (loop, session)
+        logger.debug(f"Opened pooled session for {key[0]}://{key[1]}:{key[2]}")
+        return session
+
+    async def start(self, urls: Iterable[str] = ()):
+        """Open the sessions of the known upstreams (at application startup)."""
+        for url in urls:
+            try:
+                self.session(url)
+            except Exception as e:
+                logger.warning(f"Could not open session for {url}: {e}")
+
+    async def close(self):
+        """Close every session owned by the current event loop."""
+        loop = asyncio.get_running_loop()
+        for key, (session_loop, session) in list(self._sessions.items()):
+            if session_loop is loop:
+                await session.close()
+                del self._sessions[key]
+
+# Gestionnaire partagé par tous les services du processus
+connection_manager = UpstreamConnectionManager.from_config()
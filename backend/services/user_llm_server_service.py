@@ -1,14 +1,13 @@
 """
 Service pour la gestion des serveurs LLM utilisateur.
 """
-import json
-import uuid
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
 from backend.models import UserLLMServer, UserLLMServerCreate, UserLLMServerUpdate
 from backend.config import config
+from backend.services.json_store import JsonFileStore
 
 class UserLLMServerService:
     """Service for managing user LLM servers."""
@@ -18,24 +17,26 @@ class UserLLMServerService:
         self.data_dir = Path(config.get('storage', 'data_directory', fallback='data'))
         self.servers_file = self.data_dir / 'user_llm_servers.json'
         self.data_dir.mkdir(exist_ok=True)
+        self.store = JsonFileStore(self.servers_file)
         self._load_servers()
     
     def _load_servers(self):
         """Load user LLM servers from file."""
-        if self.servers_file.exists():
-            try:
-                with open(self.servers_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                self.servers = {
-                    server_id: UserLLMServer(**server_data)
-                    for server_id, server_data in data.items()
-                }
-            except Exception as e:
-                print(f"Error loading user LLM servers: {e}")
-                self.servers = {}
-        else:
+        try:
+            data = self.store.read()
+            self.servers = {
+                server_id: UserLLMServer(**server_data)
+                for server_id, server_data in data.items()
+            }
+        except Exception as e:
+            print(f"Error loading user LLM servers: {e}")
             self.servers = {}
     
+    def _refresh(self):
+        """Reload servers if another worker changed the file."""
+        if self.store.changed():
+            self._load_servers()
+    
     def _save_servers(self):
         """Save user LLM servers to file."""
         try:
@@ -51,8 +52,7 @@ class UserLLMServerService:
                 if 'updated_at' in server_data and isinstance(server_data['updated_at'], datetime):
                     server_data['updated_at'] = server_data['updated_at'].isoformat()
             
-            with open(self.servers_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            self.store.write(data)
         except Exception as e:
             print(f"Error saving user LLM servers: {e}")
     
@@ -63,12 +63,15 @@ class UserLLMServerService:
             **server_data.dict()
         )
         
-        self.servers[server.id] = server
-        self._save_servers()
+        with self.store.lock():
+            self._refresh()
+            self.servers[server.id] = server
+            self._save_servers()
         return server
     
     def get_user_servers(self, user_id: str) -> List[UserLLMServer]:
         """Get all LLM servers for a user."""
+        self._refresh()
         return [
             server for server in self.servers.values()
             if server.user_id == user_id and server.is_active
@@ -76,6 +79,7 @@ class UserLLMServerService:
     
     def get_server(self, server_id: str, user_id: str) -> Optional[UserLLMServer]:
         """Get a specific server by ID if it belongs to the user."""
+        self._refresh()
         server = self.servers.get(server_id)
         if server and server.user_id == user_id:
             return server
@@ -83,31 +87,33 @@ class UserLLMServerService:
     
     def update_server(self, server_id: str, user_id: str, updates: UserLLMServerUpdate) -> Optional[UserLLMServer]:
         """Update a user LLM server."""
-        server = self.get_server(server_id, user_id)
-        if not server:
-            return None
-        
-        # Apply updates
-        update_data = updates.dict(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(server, field, value)
-        
-        server.updated_at = datetime.utcnow()
-        self.servers[server_id] = server
-        self._save_servers()
+        with self.store.lock():
+            server = self.get_server(server_id, user_id)
+            if not server:
+                return None
+            
+            # Apply updates
+            update_data = updates.dict(exclude_unset=True)
+            for field, value in update_data.items():
+                setattr(server, field, value)
+            
+            server.updated_at = datetime.utcnow()
+            self.servers[server_id] = server
+            self._save_servers()
         return server
     
     def delete_server(self, server_id: str, user_id: str) -> bool:
         """Delete a user LLM server."""
-        server = self.get_server(server_id, user_id)
-        if not server:
-            return False
-        
-        # Soft delete by setting is_active to False
-        server.is_active = False
-        server.updated_at = datetime.utcnow()
-        self.servers[server_id] = server
-        self._save_servers()
+        with self.store.lock():
+            server = self.get_server(server_id, user_id)
+            if not server:
+                return False
+            
+            # Soft delete by setting is_active to False
+            server.is_active = False
+            server.updated_at = datetime.utcnow()
+            self.servers[server_id] = server
+            self._save_servers()
         return True
     
     def test_server_connection(self, server: UserLLMServer) -> Dict[str, Any]:
@@ -0,0 +1,60 @@
+"""
+Tests du registre des exécutions en cours partagé entre les workers
+(backend/services/execution_control.py).
+"""
+import asyncio
+
+import pytest
+
+from backend.services.execution_control import ExecutionIdInUseError, ExecutionRegistry
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two registries sharing one database, like two worker processes."""
+    path = str(tmp_path / "executions.db")
+    first, second = ExecutionRegistry(path, poll=0.01), ExecutionRegistry(path, poll=0.01)
+    second.owner = "other"
+    return first, second
+
+async def chunks():
+    for n in range(1000):
+        await asyncio.sleep(0.01)
+        yield str(n)
+
+def test_cancel_from_other_worker(workers):
+    first, second = workers
+
+    async def scenario():
+        first.register("e1", "alice")
+        info = {}
+        received = []
+        async for chunk in first.guard("e1", chunks(), info=info):
+            received.append(chunk)
+            if len(received) == 3:
+                assert not second.cancel("e1", "bob")
+                assert second.cancel("e1", "alice")
+        return received, info
+
+    received, info = asyncio.run(scenario())
+    assert info['stopped'] == 'cancelled'
+    assert len(received) < 100
+    assert not second.cancel("e1", "alice")
+
+def test_execution_id_taken_in_other_worker(workers):
+    first, second = workers
+    first.register("e1", "alice")
+
+    with pytest.raises(ExecutionIdInUseError):
+        second.register("e1", "alice")
+
+    first.unregister("e1")
+    second.register("e1", "alice")
+
+def test_stale_execution_is_replaced(workers):
+    first, second = workers
+    first.register("e1", "alice")
+    second.stale_seconds = 0
+
+    assert not second.cancel("e1", "alice")
+    second.register("e1", "bob")
+    assert second.cancel("e1", "bob")
@@ -0,0 +1,98 @@
+"""
+Tests du stockage des résultats d'exécution (backend/services/execution_store.py).
+"""
+import asyncio
+
+import pytest
+
+from backend.models import PromptExecutionResult
+from backend.services.execution_store import ExecutionStore
+
+def make_result(execution_id: str, result: str = "réponse", final_prompt: str = "prompt") -> PromptExecutionResult:
+    return PromptExecutionResult(
+        execution_id=execution_id,
+        prompt_id="p1",
+        final_prompt=final_prompt,
+        result=result,
+        logs=[],
+        execution_time=0.1,
+    )
+
+def run(coro):
+    return asyncio.run(coro)
+
+@pytest.fixture
+def store(tmp_path):
+    return ExecutionStore(str(tmp_path / "executions.db"))
+
+def test_put_and_get_by_owner(store):
+    assert run(store.put(make_result("e1"), "alice"))
+    assert run(store.get("e1", "alice")).result == "réponse"
+    assert run(store.get("e1", "bob")) is None
+
+def test_other_user_cannot_overwrite_execution(store):
+    run(store.put(make_result("e1", "à alice"), "alice"))
+
+    assert not run(store.available("e1", "bob"))
+    assert not run(store.put(make_result("e1", "à bob"), "bob"))
+
+    assert run(store.get("e1", "alice")).result == "à alice"
+    assert run(store.get("e1", "bob")) is None
+    assert [row['execution_id'] for row in run(store.list("bob"))] == []
+
+def test_owner_can_overwrite_execution(store):
+    run(store.put(make_result("e1", "premier"), "alice"))
+
+    assert run(store.available("e1", "alice"))
+    assert run(store.put(make_result("e1", "second"), "alice"))
+    assert run(store.get("e1", "alice")).result == "second"
+
+def test_expired_execution_id_can_be_reused(tmp_path):
+    store = ExecutionStore(str(tmp_path / "executions.db"), ttl_seconds=0)
+    run(store.put(make_result("e1"), "alice"))
+
+    assert run(store.available("e1", "bob"))
+    assert run(store.put(make_result("e1", "à bob"), "bob"))
+
+def stored_bytes(store) -> int:
+    return store._conn.execute('''
+        SELECT (SELECT COALESCE(SUM(size), 0) FROM executions)
+             + (SELECT COALESCE(SUM(size), 0) FROM prompt_bodies)
+    ''').fetchone()[0]
+
+def test_eviction_counts_final_prompts(store):
+    # Prompts finaux volumineux (texte de PDF) : l'essentiel de la taille
+    store.max_bytes = 25000
+    for n in range(5):
+        run(store.put(make_result(f"e{n}", final_prompt=str(n) * 10000), "alice"))
+
+    assert store.stats()['bytes'] == stored_bytes(store) <= store.max_bytes
+    # Seules les plus anciennes sont évincées, avec leur prompt final
+    assert run(store.get("e4", "alice")) is not None
+    assert run(store.get("e3", "alice")) is not None
+    assert run(store.get("e0", "alice")) is None
+    assert store.stats()['prompt_bodies'] == 2
+
+def test_shared_final_prompt_kept_while_referenced(store):
+    store.max_bytes = 14400
+    run(store.put(make_result("e0", final_prompt="x" * 10000), "alice"))
+    run(store.put(make_result("e1", final_prompt="x" * 10000), "bob"))
+    run(store.put(make_result("e2", final_prompt="y" * 4000), "alice"))
+
+    assert run(store.get("e0", "alice")) is None
+    assert run(store.get("e1", "bob")).final_prompt == "x" * 10000
+    assert store.stats()['bytes'] == stored_bytes(store)
+
+def test_running_total_follows_replacements(store):
+    run(store.put(make_result("e1", final_prompt="a" * 1000), "alice"))
+    run(store.put(make_result("e1", final_prompt="b" * 50), "alice"))
+
+    assert store.stats()['prompt_bodies'] == 1
+    assert store.stats()['bytes'] == stored_bytes(store)
+
+def test_running_total_survives_reopening(tmp_path):
+    path = str(tmp_path / "executions.db")
+    run(ExecutionStore(path).put(make_result("e1"), "alice"))
+
+    reopened = ExecutionStore(path)
+    assert reopened.stats()['bytes'] == stored_bytes(reopened) > 0
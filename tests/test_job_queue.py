@@ -0,0 +1,65 @@
+"""
+Tests de la file des jobs d'exécution (backend/services/job_queue.py).
+"""
+import asyncio
+
+import pytest
+
+from backend.services.execution_control import ExecutionIdInUseError
+from backend.services.job_queue import DONE, JobQueue
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), workers=1, heartbeat=0.02)
+
+def stored_partial(queue, job_id: str):
+    return queue._conn.execute('SELECT partial FROM jobs WHERE job_id = ?', (job_id,)).fetchone()[0]
+
+def test_follow_streams_the_whole_output(queue):
+    async def runner(job):
+        for n in range(10):
+            job.on_chunk(f"{n},")
+            await asyncio.sleep(0.01)
+        return DONE
+
+    async def scenario():
+        queue.start(runner)
+        await queue.submit("j1", "alice", "p1", {})
+        assert await queue.get("j1", "bob") is None
+        events = [event async for event in queue.follow("j1", "alice", interval=0.01)]
+        await queue.stop()
+        return events
+
+    events = asyncio.run(scenario())
+    assert ''.join(event.get('chunk', '') for event in events) == ''.join(f"{n}," for n in range(10))
+    assert events[-1] == {'done': True, 'status': DONE, 'error': None}
+
+def test_heartbeat_appends_new_chunks(queue):
+    asyncio.run(queue.submit("j1", "alice", "p1", {}))
+    job = queue._claim()
+    job.on_chunk("a")
+    job.on_chunk("b")
+    queue._renew(job)
+    job.on_chunk("c")
+    queue._renew(job)
+    queue._renew(job)
+
+    assert stored_partial(queue, "j1") == "abc"
+    assert queue._get("j1", "alice", since=1)['partial'] == "bc"
+
+def test_reclaimed_job_restarts_its_partial_output(queue):
+    asyncio.run(queue.submit("j1", "alice", "p1", {}))
+    job = queue._claim()
+    job.on_chunk("première tentative")
+    queue._renew(job)
+    # Bail expiré (processus disparu) : le job est repris
+    queue._write('UPDATE jobs SET lease_until = 0 WHERE job_id = ?', ("j1",))
+
+    assert queue._claim().job_id == "j1"
+    assert stored_partial(queue, "j1") is None
+
+def test_execution_id_already_submitted(queue):
+    asyncio.run(queue.submit("j1", "alice", "p1", {}))
+
+    with pytest.raises(ExecutionIdInUseError):
+        asyncio.run(queue.submit("j1", "alice", "p1", {}))
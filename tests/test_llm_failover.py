@@ -0,0 +1,35 @@
+"""
+Tests des erreurs rejouées par la bascule entre serveurs LLM
+(backend/services/llm_failover.py, prompt_execution_service.py).
+"""
+import asyncio
+
+import aiohttp
+import pytest
+
+from backend.services import prompt_execution_service as module
+from backend.services.llm_failover import UpstreamError
+from backend.services.prompt_execution_service import PromptExecutionService
+
+SERVER = {'name': 'local', 'type': 'ollama', 'url': 'http://local:11434'}
+
+class FailingSession:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+    def post(self, *args, **kwargs):
+        raise self.error
+
+def call_with(monkeypatch, error: BaseException):
+    monkeypatch.setattr(module.connection_manager, 'session', lambda url: FailingSession(error))
+    return asyncio.run(PromptExecutionService()._call_llm("p", SERVER, 'llama3'))
+
+def test_connect_failure_is_retried(monkeypatch):
+    with pytest.raises(UpstreamError):
+        call_with(monkeypatch, aiohttp.ConnectionTimeoutError())
+
+def test_generation_timeout_is_not_retried(monkeypatch):
+    result, logs = call_with(monkeypatch, asyncio.TimeoutError())
+
+    assert result.startswith("Erreur")
+    assert not logs[-1].success
@@ -0,0 +1,48 @@
+"""
+Tests des disjoncteurs des serveurs LLM (backend/services/llm_health.py).
+"""
+import pytest
+
+from backend.services.llm_balancer import LoadBalancer
+from backend.services.llm_failover import UpstreamError
+from backend.services.llm_health import CircuitBreaker, health_monitor
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    # Fin du délai de refroidissement
+    breaker.opened_at -= 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    return breaker
+
+def test_half_open_admits_a_single_probe():
+    breaker = half_open_breaker()
+
+    assert breaker.acquire() == CircuitBreaker.HALF_OPEN
+    assert breaker.acquire() is None
+    assert not breaker.allows_requests()
+
+    breaker.record_success()
+    assert breaker.acquire() == CircuitBreaker.CLOSED
+    assert breaker.acquire() == CircuitBreaker.CLOSED
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = half_open_breaker()
+    breaker.acquire()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.acquire() is None
+
+def test_cancelled_probe_lets_another_one_through(monkeypatch):
+    monkeypatch.setattr(health_monitor, '_servers', {})
+    health_monitor.health("s1").breaker = half_open_breaker()
+    balancer = LoadBalancer()
+
+    probe = balancer.start("s1")
+    with pytest.raises(UpstreamError):
+        balancer.start("s1")
+    probe.discard()
+
+    balancer.start("s1").finish()
+    assert health_monitor.describe("s1")['circuit'] == CircuitBreaker.CLOSED
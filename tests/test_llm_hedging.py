@@ -0,0 +1,61 @@
+"""
+Tests des requêtes couvertes (backend/services/llm_hedging.py).
+"""
+import asyncio
+
+from backend.services.llm_hedging import Hedger, RequestClock
+
+TARGETS = [("s1", "llama3"), ("s2", "llama3"), ("s3", "llama3"), ("s4", "mistral")]
+
+def make_hedger() -> Hedger:
+    hedger = Hedger(enabled=True, min_samples=1, min_delay=0.05, budget=1.0, burst=1.0)
+    hedger.observe("llama3", 0.05)
+    return hedger
+
+def test_backup_skips_the_next_failover_target():
+    hedger = make_hedger()
+
+    assert hedger.backup(TARGETS) == ("s3", "llama3")
+    assert hedger.backup(TARGETS, ("s2", "llama3")) is None
+    assert hedger.backup(TARGETS[:2]) is None
+
+def test_hedging_delay_runs_from_the_request_sent():
+    hedger = make_hedger()
+    clock = RequestClock()
+    trace = {}
+
+    async def primary():
+        # Attente d'une place plus longue que le délai de couverture
+        await asyncio.sleep(0.15)
+        clock.sent(TARGETS[0])
+        await asyncio.sleep(0.01)
+        yield "primary"
+
+    async def copy(target):
+        yield target[0]
+
+    async def scenario():
+        return [chunk async for chunk in hedger.stream(TARGETS, primary(), copy, trace=trace, clock=clock)]
+
+    assert asyncio.run(scenario()) == ["primary"]
+    assert 'hedged' not in trace
+    assert max(hedger._ttfts["llama3"]) < 0.1
+
+def test_stalled_request_is_hedged_past_the_next_target():
+    hedger = make_hedger()
+    clock = RequestClock()
+    trace = {}
+
+    async def primary():
+        clock.sent(TARGETS[0])
+        await asyncio.sleep(1)
+        yield "primary"
+
+    async def copy(target):
+        yield target[0]
+
+    async def scenario():
+        return [chunk async for chunk in hedger.stream(TARGETS, primary(), copy, trace=trace, clock=clock)]
+
+    assert asyncio.run(scenario()) == ["s3"]
+    assert trace == {'hedged': True, 'hedge_won': True}
@@ -0,0 +1,41 @@
+"""
+Tests du routage d'une requête vers le membre de pool où sa place a été
+réservée (backend/services/prompt_execution_service.py, llm_scheduler.py).
+"""
+import asyncio
+
+from backend.services.llm_scheduler import llm_scheduler
+from backend.services.prompt_execution_service import PromptExecutionService
+
+MEMBERS = {
+    f"member{n}": {'name': f"member{n}", 'type': 'ollama', 'url': f"http://member{n}:11434"}
+    for n in range(4)
+}
+POOL = {'name': 'pool', 'type': 'balanced', 'url': ','.join(MEMBERS), 'api_key': 'least_outstanding'}
+
+def make_service(monkeypatch):
+    service = PromptExecutionService(server_lookup=MEMBERS.get)
+
+    async def stream_llm(final_prompt, server_config, model, meta=None):
+        yield server_config['name']
+
+    monkeypatch.setattr(service, '_stream_llm', stream_llm)
+    return service
+
+def test_stream_runs_on_the_reserved_member(monkeypatch):
+    service = make_service(monkeypatch)
+
+    async def run_once():
+        # Membres à égalité : le départage aléatoire ne doit être tiré qu'une fois
+        ticket = service.reserve(POOL, 'llama3')
+        meta = {}
+        chunks = [chunk async for chunk in service._stream_with_failover("p", POOL, 'llama3', ticket, meta)]
+        reserved = next(name for name, member in MEMBERS.items()
+                        if llm_scheduler.key(member['url'], 'llama3') == ticket.key)
+        return reserved, meta['server'], chunks, ticket.released
+
+    for _ in range(20):
+        reserved, served, chunks, released = asyncio.run(run_once())
+        assert served == reserved
+        assert chunks == [reserved]
+        assert released
@@ -0,0 +1,115 @@
+"""
+Tests du stockage SQLite des prompts utilisateur partagé entre plusieurs
+workers (backend/services/prompt_storage.py, prompt_service.py).
+"""
+import threading
+
+import pytest
+
+from backend.models import PromptType, UserPrompt, UserPromptCreate, UserPromptUpdate
+from backend.services.prompt_service import PromptService
+from backend.services.prompt_storage import SqliteUserPromptStorage, migrate_json_to_sqlite, write_user_prompts_json
+
+@pytest.fixture
+def make_worker(tmp_path, monkeypatch):
+    """PromptService instances sharing one SQLite store, like worker processes."""
+    monkeypatch.setenv('PROMPTACHAT_DATABASE_USER_PROMPTS_BACKEND', 'sqlite')
+    monkeypatch.setenv('PROMPTACHAT_DATABASE_USER_PROMPTS_DB_PATH', str(tmp_path / 'user_prompts.db'))
+
+    def setup_file_paths(service):
+        service.system_prompts_file = str(tmp_path / 'prompts.json')
+        service.user_prompts_file = str(tmp_path / 'user_prompts.json')
+
+    monkeypatch.setattr(PromptService, '_setup_file_paths', setup_file_paths)
+    return PromptService
+
+def create(service, title: str = "Prompt", user_id: str = "alice") -> UserPrompt:
+    return service.create_user_prompt(
+        UserPromptCreate(title=title, content="Bonjour {nom}", type=PromptType.INTERNAL), user_id
+    )
+
+def test_update_from_stale_worker_keeps_other_changes(make_worker):
+    first, second = make_worker(), make_worker()
+    prompt = create(first)
+    # Copie résidente du second worker, avant la modification du premier
+    assert [p.id for p in second.get_user_prompts("alice")] == [prompt.id]
+
+    first.update_user_prompt(prompt.id, UserPromptUpdate(title="Titre du premier"), "alice")
+    second.update_user_prompt(prompt.id, UserPromptUpdate(description="Description du second"), "alice")
+
+    for service in (first, second, make_worker()):
+        [stored] = service.get_user_prompts("alice")
+        assert stored.title == "Titre du premier"
+        assert stored.description == "Description du second"
+
+def test_write_lock_blocks_other_workers(tmp_path):
+    path = str(tmp_path / 'user_prompts.db')
+    first, second = SqliteUserPromptStorage(path), SqliteUserPromptStorage(path)
+    prompt = UserPrompt(title="P", content="c", type=PromptType.INTERNAL, created_by="alice")
+    written = threading.Event()
+
+    def write():
+        second.insert(prompt)
+        written.set()
+
+    with first.write_lock():
+        version = first.signature()
+        writer = threading.Thread(target=write)
+        writer.start()
+        assert not written.wait(0.3)
+        assert first.signature() == version
+    writer.join(5)
+
+    assert written.is_set()
+    assert first.count() == 1
+
+def test_writes_inside_write_lock_commit_together(tmp_path):
+    storage = SqliteUserPromptStorage(str(tmp_path / 'user_prompts.db'))
+    start = storage.signature()
+    prompts = [UserPrompt(title=f"P{n}", content="c", type=PromptType.INTERNAL, created_by="alice")
+               for n in range(2)]
+
+    with pytest.raises(RuntimeError):
+        with storage.write_lock():
+            storage.insert(prompts[0])
+            raise RuntimeError("échec au milieu du cycle")
+    assert storage.count() == 0
+    assert storage.signature() == start
+
+    with storage.write_lock():
+        first = storage.insert(prompts[0])
+        second = storage.insert(prompts[1])
+    assert storage.follows(start, first) and storage.follows(first, second)
+    assert storage.count() == 2
+
+def test_skipped_version_forces_reload(make_worker):
+    first, second = make_worker(), make_worker()
+    create(first, "Premier")
+    first.get_user_prompts("alice")
+    create(second, "Second")
+
+    # Écriture depuis une copie périmée (sans relecture) : la version saute
+    prompt = UserPrompt(title="Troisième", content="c", type=PromptType.INTERNAL, created_by="alice")
+    first._catalog.put_user_prompt(prompt)
+    first._store_user_write(first.user_storage.insert, prompt)
+
+    assert sorted(p.title for p in first.get_user_prompts("alice")) == ["Premier", "Second", "Troisième"]
+
+def test_json_migration_runs_once(tmp_path):
+    json_path = str(tmp_path / 'user_prompts.json')
+    write_user_prompts_json(json_path, [
+        UserPrompt(title="Importé", content="c", type=PromptType.INTERNAL, created_by="alice")
+    ])
+    path = str(tmp_path / 'user_prompts.db')
+
+    assert migrate_json_to_sqlite(json_path, SqliteUserPromptStorage(path)) == 1
+    assert migrate_json_to_sqlite(json_path, SqliteUserPromptStorage(path)) == 0
+    assert SqliteUserPromptStorage(path).count() == 1
+
+def test_search_facets_only_on_request(make_worker):
+    service = make_worker()
+    create(service, title="Bonjour")
+
+    assert "facets" not in service.search_prompts("bonjour", "alice")
+    result = service.search_prompts("bonjour", "alice", facets=True)
+    assert result["facets"]["type"] == {PromptType.INTERNAL.value: 1}
@@ -0,0 +1,55 @@
+"""
+Tests du cache des réponses LLM (backend/services/response_cache.py).
+"""
+import asyncio
+
+import pytest
+
+from backend.services.response_cache import ResponseCache
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(enabled=True, memory_entries=2, disk_path=str(tmp_path / "cache.db"))
+
+def disk_bytes(cache) -> int:
+    return cache._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+def test_lookup_and_store_off_the_event_loop(cache):
+    async def scenario():
+        assert await cache.lookup("k1") is None
+        await cache.store("k1", "réponse")
+        # Hors du niveau mémoire : relu depuis le disque
+        cache._memory.clear()
+        return await cache.lookup("k1")
+
+    assert asyncio.run(scenario()) == "réponse"
+    assert cache.counters['disk_hits'] == 1
+    assert cache.counters['misses'] == 1
+
+def test_running_total_follows_writes_and_eviction(cache):
+    cache.max_disk_bytes = 2400
+    cache.put("k1", "a" * 1000)
+    cache.put("k1", "b" * 500)
+    assert cache.stats()['disk_bytes'] == disk_bytes(cache) == 500
+
+    cache.put("k2", "c" * 1000)
+    cache.put("k3", "d" * 1000)
+    stats = cache.stats()
+    assert stats['disk_bytes'] == disk_bytes(cache) <= cache.max_disk_bytes
+    assert stats['disk_entries'] == 2
+    cache._memory.clear()
+    assert cache.get("k1") is None
+
+def test_expired_entries_leave_the_total(tmp_path):
+    cache = ResponseCache(enabled=True, ttl_seconds=0, disk_path=str(tmp_path / "cache.db"))
+    cache.put("k1", "a" * 100)
+    cache._memory.clear()
+
+    assert cache.get("k1") is None
+    assert cache.stats()['disk_bytes'] == disk_bytes(cache) == 0
+
+def test_running_total_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ResponseCache(enabled=True, disk_path=path).put("k1", "a" * 100)
+
+    assert ResponseCache(enabled=True, disk_path=path).stats()['disk_bytes'] == 100
@@ -0,0 +1,95 @@
+"""
+Tests de la reprise des flux sur un autre worker (backend/services/stream_replay.py).
+"""
+import asyncio
+
+import pytest
+
+from backend.services.stream_replay import StreamReplay
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two replay stores sharing one database, like two worker processes."""
+    path = str(tmp_path / "executions.db")
+    return (StreamReplay(grace=0.2, path=path, poll=0.01),
+            StreamReplay(grace=0.2, path=path, poll=0.01))
+
+async def frames(count: int, stop=None):
+    for n in range(count):
+        if stop is not None and stop.done():
+            return
+        yield f"data: {n}\n\n"
+        await asyncio.sleep(0.02)
+
+async def collect(chunks):
+    return [frame async for frame in chunks]
+
+def payload(frame: str) -> str:
+    return frame.split("\n")[1]
+
+def test_resume_on_other_worker(workers):
+    first, second = workers
+
+    async def scenario():
+        buffer = first.open("e1", "alice")
+        sent = await collect(first.stream(buffer, frames(5)))
+        await asyncio.sleep(0.05)
+        assert await second.resume("e1:2", "bob") is None
+        return sent, await collect(await second.resume("e1:2", "alice"))
+
+    sent, resumed = asyncio.run(scenario())
+    assert [payload(f) for f in resumed] == [payload(f) for f in sent[2:]]
+    assert resumed[0].startswith("id: e1:3\n")
+
+def test_generation_continues_for_remote_reader(workers):
+    first, second = workers
+
+    async def scenario():
+        buffer = first.open("e1", "alice")
+        abandoned = asyncio.ensure_future(buffer.abandoned())
+        local = first.stream(buffer, frames(30, abandoned))
+        # Coupure après deux événements, reprise sur l'autre worker
+        received = [await local.__anext__(), await local.__anext__()]
+        await local.aclose()
+        await asyncio.sleep(0.05)
+        resumed = await second.resume("e1:2", "alice")
+        received += await collect(resumed)
+        finished = abandoned.done()
+        abandoned.cancel()
+        return received, finished
+
+    received, abandoned = asyncio.run(scenario())
+    assert not abandoned
+    assert [payload(f) for f in received] == [f"data: {n}" for n in range(30)]
+
+def test_unknown_stream_is_not_resumed(workers):
+    _, second = workers
+    assert asyncio.run(second.resume("inconnu:3", "alice")) is None
+
+def test_reader_attaches_when_the_response_starts():
+    replay = StreamReplay(path=None)
+
+    async def scenario():
+        buffer = replay.open("e1", "alice")
+        buffer.start_grace = 0.05
+        abandoned = asyncio.ensure_future(buffer.abandoned())
+        # Réponse jamais itérée : l'exécution est abandonnée
+        replay.stream(buffer, frames(30, abandoned))
+        await asyncio.wait_for(abandoned, 1)
+        return buffer.last_seq
+
+    assert asyncio.run(scenario()) < 30
+
+def test_generation_stops_when_the_client_leaves():
+    replay = StreamReplay(path=None)
+
+    async def scenario():
+        buffer = replay.open("e1", "alice")
+        abandoned = asyncio.ensure_future(buffer.abandoned())
+        local = replay.stream(buffer, frames(30, abandoned))
+        await local.__anext__()
+        await local.aclose()
+        # Pas de délai de reprise par défaut
+        await asyncio.wait_for(abandoned, 0.1)
+
+    asyncio.run(scenario())